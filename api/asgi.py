@@ -0,0 +1,154 @@
+# Async variant of the API in index.py, served by any ASGI server e.g. uvicorn api.asgi:app
+# Serves /json, /stats and / with the same responses, Spotify and image requests go through the
+# shared async client of asyncPipeline so one worker can wait on many of them at once
+from urllib.parse import parse_qsl
+from werkzeug import Response
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+from werkzeug.http import parse_etags
+from werkzeug.utils import redirect
+import re, sys
+
+sys.path.append("..")
+import asyncPipeline
+import metrics
+import statsCache
+import statsCollector
+import statsImageGenerator
+import tenants
+from api import index
+
+ROUTES = [
+    (re.compile(r"^/json(?:/(?P<user>[^/]+))?$"), "get_stats"),
+    (re.compile(r"^/stats(?:/(?P<user>[^/]+))?$"), "create_stats_image"),
+    (re.compile(r"^/$"), "home"),
+]
+
+
+class Request:
+    # The parts of an ASGI request used by the endpoints
+
+    def __init__(self, scope: dict):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.args = dict(reversed(parse_qsl(scope.get("query_string", b"").decode("latin-1"))))
+        self.headers = {
+            name.decode("latin-1").lower(): value.decode("latin-1")
+            for name, value in scope.get("headers", [])
+        }
+
+
+def json_response(data, status: int = 200) -> Response:
+    response = index.app.json.response(data)
+    response.status_code = status
+    return response
+
+
+def not_modified(request: Request, etag: str, endpoint: str):
+    return index.not_modified_response(
+        parse_etags(request.headers.get("if-none-match")), etag, endpoint
+    )
+
+
+async def get_stats(request: Request, user=None):
+    if user is not None and user not in tenants.get_tenants():
+        return json_response({"error": f"Unknown user: {user}"}, 404)
+    try:
+        requestedSlices = index.get_requested_slices(request.args)
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+    stats = await asyncPipeline.collect_slices(requestedSlices, user=user)
+    etag = statsCache.content_hash(stats)
+    cachedResponse = not_modified(request, etag, "json")
+    if cachedResponse is not None:
+        return cachedResponse
+    return index.stats_response(stats, etag)
+
+
+async def create_stats_image(request: Request, user=None):
+    if user is not None and user not in tenants.get_tenants():
+        return json_response({"error": f"Unknown user: {user}"}, 404)
+    requestedContentType, requestedContentTimerange = index.get_requested_infographic(request.args)
+
+    stats = await asyncPipeline.collect(
+        [statsImageGenerator.SECTION_STATS_KEYS[requestedContentType]],
+        [requestedContentTimerange],
+        user=user,
+        compact=True,
+    )
+    etag = statsImageGenerator.get_infographic_etag(
+        stats, requestedContentType, requestedContentTimerange
+    )
+    cachedResponse = not_modified(request, etag, "stats")
+    if cachedResponse is not None:
+        return cachedResponse
+
+    # Renders are sent whole, the images are downloaded concurrently without holding a thread
+    svgImage, complete = await asyncPipeline.render_cached_infographic(
+        stats, requestedContentType, requestedContentTimerange
+    )
+    return index.render_response(svgImage, etag, complete)
+
+
+async def home(request: Request):
+    return redirect("https://github.com/JohanVerne/SpotifyREADMEStats")
+
+
+ENDPOINTS = {
+    "get_stats": get_stats,
+    "create_stats_image": create_stats_image,
+    "home": home,
+}
+
+
+async def dispatch(request: Request) -> tuple:
+    for pattern, endpoint in ROUTES:
+        match = pattern.match(request.path)
+        if match is None:
+            continue
+        if request.method not in ("GET", "HEAD"):
+            return MethodNotAllowed(valid_methods=["GET", "HEAD"]).get_response(), endpoint
+        try:
+            kwargs = {name: value for name, value in match.groupdict().items() if value}
+            return await ENDPOINTS[endpoint](request, **kwargs), endpoint
+        except statsCollector.CollectionError as e:
+            response = index.rate_limited_response(e)
+            if response is None:
+                raise
+            return response, endpoint
+    return NotFound().get_response(), None
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await asyncPipeline.close_client()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    timings = metrics.start_timings()
+    request = Request(scope)
+    response, endpoint = await dispatch(request)
+    index.record_response_metrics(response, endpoint, timings)
+
+    body = response.get_data()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": response.status_code,
+            "headers": [
+                (name.lower().encode("latin-1"), value.encode("latin-1"))
+                for name, value in response.headers.items()
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": b"" if request.method == "HEAD" else body})
@@ -1,38 +1,257 @@
 # Simple API used to access stats via HTTP requests
 from flask import Flask, jsonify, redirect, Response, request
 from io import BytesIO
-import sys
+import hmac, math, os, sys, time
 
 sys.path.append("..")
+import metrics
+import rateLimiter
+import statsCache
 import statsCollector
 import statsImageGenerator
+import statsScheduler
+import tenants
 
 app = Flask(__name__)
 
+# Cache-Control directives of each endpoint (in seconds), so GitHub camo and the Vercel edge
+# can cache responses, overridable with CACHE_<ENDPOINT>_<DIRECTIVE> environment variables
+# e.g. CACHE_STATS_S_MAXAGE=600
+CACHE_POLICIES = {
+    "stats": {
+        "max-age": 3600,
+        "s-maxage": 3600,
+        "stale-while-revalidate": 24 * 60 * 60,
+        "stale-if-error": 7 * 24 * 60 * 60,
+    },
+    "json": {
+        "max-age": 600,
+        "s-maxage": 600,
+        "stale-while-revalidate": 60 * 60,
+        "stale-if-error": 24 * 60 * 60,
+    },
+}
 
-@app.route("/json")  # Endpoint to get Spotify stats as json
-def get_stats():
-    stats = statsCollector.main()
-    return jsonify(stats)
 
+@app.before_request
+def start_request_timings():
+    metrics.start_timings()
 
-@app.route("/stats")  # Endpoint to get infographics stats
-def create_stats_image():
-    stats = statsCollector.main()
-    requestedContentType = request.args.get("type", None)
+
+@app.after_request
+def record_request_metrics(response):
+    timings = metrics.get_timings()
+    if timings is None or request.endpoint == "get_metrics":
+        return response
+    record_response_metrics(response, request.endpoint, timings)
+    return response
+
+
+# Send the stage timings in a Server-Timing header (disable with SERVER_TIMING=0)
+# and record the duration and size of the response, for this app and the ASGI one (see asgi)
+# Streamed responses are measured until their headers are sent, their size is unknown
+def record_response_metrics(response, endpoint: str, timings: metrics.Timings):
+    if os.environ.get("SERVER_TIMING", "1") != "0":
+        response.headers["Server-Timing"] = timings.server_timing()
+    labels = {"endpoint": endpoint or "unknown", "status": str(response.status_code)}
+    metrics.observe("request_duration_seconds", time.perf_counter() - timings.start_time, labels)
+    if response.content_length is not None:
+        metrics.observe(
+            "response_size_bytes",
+            response.content_length,
+            {"endpoint": labels["endpoint"]},
+            buckets=metrics.SIZE_BUCKETS,
+        )
+
+
+@app.errorhandler(statsCollector.CollectionError)
+def collection_failed(e):
+    response = rate_limited_response(e)
+    if response is None:
+        raise e
+    return response
+
+
+# Spotify is rate limiting us and some requested stats are not cached at all (cached ones are served
+# while throttled): answer 503 with the Retry-After instead of a 500, None for other failures
+def rate_limited_response(e: statsCollector.CollectionError):
+    if e.retry_after is None:
+        return None
+    response = app.json.response({"error": "Spotify is rate limiting requests, retry later"})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(max(1, math.ceil(e.retry_after)))
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+# Build the Cache-Control header of an endpoint
+def get_cache_control(endpoint: str) -> str:
+    directives = ["public"]
+    for directive, default in CACHE_POLICIES[endpoint].items():
+        envName = f"CACHE_{endpoint}_{directive}".upper().replace("-", "_")
+        directives.append(f"{directive}={int(os.environ.get(envName, default))}")
+    return ", ".join(directives)
+
+
+# Answer 304 Not Modified if the client already has the current version
+def not_modified(etag: str, endpoint: str):
+    return not_modified_response(request.if_none_match, etag, endpoint)
+
+
+# Same as not_modified with the ETags of the If-None-Match header of any request
+# ETags are compared weakly (RFC 9110), proxies compressing the response send them back as W/"..."
+def not_modified_response(if_none_match, etag: str, endpoint: str):
+    if if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = get_cache_control(endpoint)
+        return response
+    return None
+
+
+# Build the /json response of the stats, with their ETag
+def stats_response(stats: dict, etag: str) -> Response:
+    response = app.json.response(stats)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = get_cache_control("json")
+    return response
+
+
+# Build the response of a render, svg_image is a string or an iterator of its chunks
+# Only complete renders get the ETag and the caching policy: a render with placeholders for missing
+# images must not be kept by caches or revalidated with a 304, it would outlive the failed downloads
+def render_response(svg_image, etag: str, complete: bool) -> Response:
+    response = Response(svg_image, mimetype="image/svg+xml")
+    if complete:
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = get_cache_control("stats")
+    else:
+        response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+# Parse the fields parameter of /json (e.g. "top_artists.short_term,last_albums") into stats slices
+def parse_fields(fields: str) -> list:
+    requestedSlices = set()
+    for field in fields.split(","):
+        section, _, sp_range = field.strip().partition(".")
+        if section not in statsCollector.SECTIONS:
+            raise ValueError(f"Unknown field: {field}")
+        if sp_range and sp_range not in statsCollector.TIME_RANGES:
+            raise ValueError(f"Unknown time range: {field}")
+        requestedSlices.update(
+            statsCollector.get_slices([section], [sp_range] if sp_range else None)
+        )
+    return [s for s in statsCollector.get_slices() if s in requestedSlices]
+
+
+# Get the slices requested by the query arguments of /json, all of them without fields
+# Raises ValueError for unknown fields
+def get_requested_slices(args) -> list:
+    requestedFields = args.get("fields", None)
+    if requestedFields:
+        return parse_fields(requestedFields)
+    return statsCollector.get_slices()
+
+
+# Get the (type, range) of the infographic requested by the query arguments of /stats
+# Unknown types and ranges fall back to the recent top artists
+def get_requested_infographic(args) -> tuple:
+    requestedContentType = args.get("type", None)
     if requestedContentType not in [
         "artists",
         "top_songs",
         "last_albums",
     ]:
         requestedContentType = "artists"
-    requestedContentTimerange = request.args.get("range", None)
+    requestedContentTimerange = args.get("range", None)
     if requestedContentTimerange not in ["short_term", "long_term"]:
         requestedContentTimerange = "short_term"
-    svgImage = statsImageGenerator.create_spotify_infographic(
+    return requestedContentType, requestedContentTimerange
+
+
+@app.route("/json")  # Endpoint to get Spotify stats as json
+@app.route("/json/<user>")  # Same for one of the accounts of the tenant registry
+def get_stats(user=None):
+    if user is not None and user not in tenants.get_tenants():
+        return jsonify({"error": f"Unknown user: {user}"}), 404
+    try:
+        requestedSlices = get_requested_slices(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    stats = statsCollector.collect_slices(requestedSlices, user=user)
+    etag = statsCache.content_hash(stats)
+    cachedResponse = not_modified(etag, "json")
+    if cachedResponse is not None:
+        return cachedResponse
+    return stats_response(stats, etag)
+
+
+@app.route("/stats")  # Endpoint to get infographics stats
+@app.route("/stats/<user>")  # Same for one of the accounts of the tenant registry
+def create_stats_image(user=None):
+    if user is not None and user not in tenants.get_tenants():
+        return jsonify({"error": f"Unknown user: {user}"}), 404
+    requestedContentType, requestedContentTimerange = get_requested_infographic(request.args)
+
+    # Only the stats shown by the requested image are collected, as records (see statsModel)
+    stats = statsCollector.collect(
+        [statsImageGenerator.SECTION_STATS_KEYS[requestedContentType]],
+        [requestedContentTimerange],
+        user=user,
+        compact=True,
+    )
+
+    # The ETag only depends on the stats, so unchanged images are neither rendered nor sent
+    etag = statsImageGenerator.get_infographic_etag(
         stats, requestedContentType, requestedContentTimerange
     )
-    return Response(svgImage, mimetype="image/svg+xml")
+    cachedResponse = not_modified(etag, "stats")
+    if cachedResponse is not None:
+        return cachedResponse
+
+    # Renders that are not cached yet are streamed, the header is sent before any image is downloaded
+    # Whether every image makes it in is only known once the body is sent, so streamed renders are
+    # sent as incomplete ones, their cached copy is served with the ETag to the next requests
+    svgImage = statsImageGenerator.get_cached_render(
+        stats, requestedContentType, requestedContentTimerange
+    )
+    complete = svgImage is not None
+    if svgImage is None and statsImageGenerator.streaming_enabled():
+        svgImage = statsImageGenerator.iter_cached_infographic(
+            stats, requestedContentType, requestedContentTimerange
+        )
+    elif svgImage is None:
+        svgImage, complete = statsImageGenerator.render_cached_infographic(
+            stats, requestedContentType, requestedContentTimerange
+        )
+    return render_response(svgImage, etag, complete)
+
+
+# Whether the request carries secret as its bearer token, compared in constant time
+def has_bearer_token(secret: str) -> bool:
+    authorization = request.headers.get("Authorization", "")
+    return hmac.compare_digest(authorization.encode("utf-8"), f"Bearer {secret}".encode("utf-8"))
+
+
+@app.route("/cron/refresh")  # Endpoint to pre-warm the caches, called by Vercel Cron
+def refresh_caches():
+    # Vercel sends the CRON_SECRET as a bearer token, other callers are rejected
+    # Without a CRON_SECRET every caller is rejected, anyone could make the account hit Spotify
+    cronSecret = os.environ.get("CRON_SECRET")
+    if not cronSecret or not has_bearer_token(cronSecret):
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(statsScheduler.refresh_everything())
+
+
+@app.route("/metrics")  # Endpoint exposing the metrics in the Prometheus text format
+def get_metrics():
+    # Protected like /cron/refresh when a METRICS_TOKEN is set
+    metricsToken = os.environ.get("METRICS_TOKEN")
+    if metricsToken and not has_bearer_token(metricsToken):
+        return jsonify({"error": "Unauthorized"}), 401
+    rateLimiter.record_state()
+    return Response(metrics.render_metrics(), mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/")  # Home endpoint
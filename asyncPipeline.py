@@ -0,0 +1,295 @@
+## Async counterparts of the Spotify collection and of the image downloads, used by the ASGI app (api/asgi.py)
+## Spotify and CDN requests go through a shared httpx.AsyncClient, so a single process can wait on
+## hundreds of them at once. The paging, parsing, caching and resizing are the plans of statsCollector and
+## statsImageGenerator (see requestPlans), only their requests are performed here, so both APIs serve the same output
+import asyncio, base64, os
+import spotipy
+import httpSessions
+import metrics
+import rateLimiter
+import requestPlans
+import statsCache
+import statsCollector
+import statsImageGenerator
+import tenants
+import tokenManager
+
+try:
+    import httpx
+except ImportError:  # Only the async API needs httpx, see requirements.txt
+    httpx = None
+
+# Errors of the requests retried like connection errors and resets by the sync sessions
+TRANSPORT_ERRORS = (httpx.TransportError,) if httpx is not None else ()
+
+
+_client = None
+
+
+# Create the async HTTP client shared by the Spotify and CDN requests
+# Its pool holds up to ASYNC_HTTP_POOL_SIZE connections (default 100), retries are done by get_with_retries
+def create_client():
+    if httpx is None:
+        raise RuntimeError("The async API requires httpx, install it with pip install httpx")
+    poolSize = int(os.environ.get("ASYNC_HTTP_POOL_SIZE", "100"))
+    transport = httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(max_connections=poolSize, max_keepalive_connections=poolSize),
+    )
+    return httpx.AsyncClient(transport=transport, timeout=10)
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = create_client()
+    return _client
+
+
+# Replace the shared client, None closes nothing and creates a new one on next use
+def set_client(client):
+    global _client
+    _client = client
+
+
+async def close_client():
+    global _client
+    client, _client = _client, None
+    if client is not None:
+        await client.aclose()
+
+
+# GET a URL with the retry policy of the sync sessions (see httpSessions): connection errors and
+# server errors (RETRY_STATUSES) are retried HTTP_RETRIES times with the same jittered backoff,
+# or after the Retry-After of the response, the last response is returned whatever its status
+async def get_with_retries(client, url: str, **kwargs):
+    retries, backoffFactor, backoffJitter = httpSessions.get_retry_settings()
+    for attempt in range(retries + 1):
+        try:
+            response = await client.get(url, **kwargs)
+        except TRANSPORT_ERRORS:
+            if attempt == retries:
+                raise
+        else:
+            if response.status_code not in httpSessions.RETRY_STATUSES or attempt == retries:
+                return response
+            retryAfter = response.headers.get("Retry-After")
+            if retryAfter is not None and retryAfter.isdigit():
+                await asyncio.sleep(int(retryAfter))
+                continue
+        await asyncio.sleep(httpSessions.get_backoff(attempt + 1, backoffFactor, backoffJitter))
+
+
+class AsyncSpotify:
+    # Async client of the Web API endpoints used by the collector, answering the same JSON as spotipy
+    # Built from the spotipy client of an account, whose token manager and base URL it reuses
+    # Requests go through the rate limiter (see rateLimiter) like the ones of the sync collector
+
+    def __init__(self, sp: spotipy.Spotify, client=None):
+        self.sp = sp
+        self.client = client or get_client()
+
+    async def _acquire(self, limiter: rateLimiter.RateLimiter, priority: int):
+        # Requests that have to wait for a token sleep on the event loop, not in a worker thread
+        if not limiter.try_acquire(priority):
+            await limiter.acquire_async(priority)
+
+    async def _get_access_token(self) -> str:
+        # The access token is reused until it is about to expire, only reading it from the
+        # shared store or refreshing it blocks, in a worker thread
+        accessToken = tokenManager.get_cached_token(self.sp)
+        if accessToken is None:
+            accessToken = await asyncio.to_thread(self.sp.auth_manager.get_access_token)
+        return accessToken
+
+    async def _get(self, path: str, **params) -> dict:
+        params = {name: value for name, value in params.items() if value is not None}
+        limiter = rateLimiter.get_limiter()
+        priority = rateLimiter.get_priority()
+        throttled = reauthenticated = False
+        while True:
+            await self._acquire(limiter, priority)
+            accessToken = await self._get_access_token()
+            response = await get_with_retries(
+                self.client,
+                self.sp.prefix + path,
+                params=params,
+                headers={"Authorization": f"Bearer {accessToken}"},
+            )
+            if response.status_code < 400:
+                return response.json()
+            error = spotipy.SpotifyException(
+                response.status_code,
+                -1,
+                f"{response.url}:\n {response.text}",
+                headers=dict(response.headers),
+            )
+            # Sent again once with a new access token if the token was rejected
+            if response.status_code == 401 and not reauthenticated:
+                reauthenticated = tokenManager.invalidate_token(self.sp, accessToken)
+                if reauthenticated:
+                    continue
+            if response.status_code != 429:
+                raise error
+            # Sent again once the Retry-After is over, if the request can wait that long
+            retryAfter = rateLimiter.get_retry_after(error)
+            limiter.throttle(retryAfter)
+            if throttled:
+                raise rateLimiter.RateLimitedError(retryAfter) from error
+            throttled = True
+
+    # Perform the requests a plan of statsCollector yielded together, concurrently
+    async def perform(self, requests: list) -> list:
+        return await asyncio.gather(
+            *(getattr(self, method)(*args, **kwargs) for method, args, kwargs in requests)
+        )
+
+    async def current_user_top_artists(self, time_range="medium_term", limit=20, offset=0):
+        return await self._get("me/top/artists", time_range=time_range, limit=limit, offset=offset)
+
+    async def current_user_top_tracks(self, time_range="medium_term", limit=20, offset=0):
+        return await self._get("me/top/tracks", time_range=time_range, limit=limit, offset=offset)
+
+    async def current_user_saved_albums(self, limit=20, offset=0):
+        return await self._get("me/albums", limit=limit, offset=offset)
+
+    async def artists(self, artists: list):
+        return await self._get("artists", ids=",".join(artists))
+
+
+async def collect_slice(sp: AsyncSpotify, section: str, sp_range: str, history_store=None):
+    plan = statsCollector.plan_slice(section, sp_range)
+    if plan is None:
+        # The recently played history is read and written in the cache, it is collected in a worker thread
+        return await asyncio.to_thread(
+            statsCollector.collect_slice, rateLimiter.limit(sp.sp), section, sp_range, history_store
+        )
+    return await requestPlans.run_async(plan, sp.perform)
+
+
+async def collect_slices_concurrently(
+    sp: AsyncSpotify, slices: list, history_store=None
+) -> dict:
+    # Every API request of the slices runs concurrently, the failures are merged by statsCollector.merge_slices
+    results = await asyncio.gather(
+        *(collect_slice(sp, section, sp_range, history_store) for section, sp_range in slices),
+        return_exceptions=True,
+    )
+    return statsCollector.merge_slices(slices, results)
+
+
+async def _collect_missing_slices(slices: list, cache, user: str = None) -> tuple:
+    # Slices are claimed through statsCollector.SliceClaim, so sync and async requests share their collections
+    claim = statsCollector.SliceClaim(slices, user)
+    try:
+        if claim.own_slices:
+            errors = {}
+            sp = AsyncSpotify(statsCollector.get_tenant_client(user))
+            try:
+                ownData = await collect_slices_concurrently(sp, claim.own_slices, history_store=cache)
+            except statsCollector.CollectionError as e:
+                ownData, errors = e.data, e.errors
+            await asyncio.to_thread(claim.publish, cache, ownData, errors)
+    except BaseException as e:
+        # Cancelled requests fail their waiters instead of leaving them hanging
+        claim.abort(e if isinstance(e, Exception) else RuntimeError("Cancelled"))
+        raise
+    await claim.wait_async()
+    return claim.data, claim.errors
+
+
+async def collect_slices(slices: list, cache=None, user: str = None, compact: bool = False) -> dict:
+    # Runs statsCollector.plan_collect_slices, the cache is read and written in worker threads
+    if cache is None:
+        cache = statsCache.get_cache()
+    cache = tenants.get_tenant_cache(cache, user)
+    return await requestPlans.run_async(
+        statsCollector.plan_collect_slices(slices, cache, user, compact),
+        lambda missingSlices: _collect_missing_slices(missingSlices, cache, user),
+        in_thread=True,
+    )
+
+
+async def collect(
+    sections: list = None,
+    ranges: list = None,
+    cache=None,
+    user: str = None,
+    compact: bool = False,
+) -> dict:
+    return await collect_slices(statsCollector.get_slices(sections, ranges), cache, user, compact)
+
+
+# Download an image with the shared async client, None if it can't be downloaded
+async def download_image_as_base64(url):
+    try:
+        with metrics.timer("image_download"):
+            response = await get_with_retries(get_client(), url, timeout=5)
+            response.raise_for_status()
+        img_base64 = base64.b64encode(response.content).decode("utf-8")
+        content_type = response.headers.get("content-type", "image/jpeg")
+        return f"data:{content_type};base64,{img_base64}"
+    except Exception as e:
+        metrics.inc("upstream_errors_total", {"upstream": "images"})
+        print(f"Error fetching image from {url}: {e}")
+        return None
+
+
+# Runs statsImageGenerator.plan_image in the image flights shared with the sync pipeline, only the
+# downloads are async, the image cache lookups and the resizing run in worker threads
+async def fetch_image_as_base64(url, size: int = None):
+    return await statsImageGenerator.image_flights.do_async(
+        (url, size),
+        requestPlans.run_async,
+        statsImageGenerator.plan_image(url, size),
+        download_image_as_base64,
+        in_thread=True,
+    )
+
+
+async def fetch_images_as_base64(urls, deadline: float = None, size: int = None) -> dict:
+    # Images are downloaded concurrently
+    # Images that are not downloaded before the deadline are mapped to None and finish in the background
+    uniqueUrls = list(dict.fromkeys(url for url in urls if url))
+    if not uniqueUrls:
+        return {}
+    if deadline is None:
+        deadline = float(os.environ.get("IMAGE_FETCH_DEADLINE", "8"))
+
+    tasks = {url: asyncio.ensure_future(fetch_image_as_base64(url, size)) for url in uniqueUrls}
+    done, _ = await asyncio.wait(tasks.values(), timeout=deadline)
+
+    images = {}
+    for url, task in tasks.items():
+        if task in done and task.exception() is None:
+            images[url] = task.result()
+        else:
+            print(f"Image {url} missed the {deadline}s deadline, using placeholder")
+            images[url] = None
+    return images
+
+
+async def get_cached_infographic(
+    stats_data: dict,
+    section_type: str = "artists",
+    time_range: str = "short_term",
+    cache=None,
+) -> str:
+    # The SVG of render_cached_infographic
+    return (await render_cached_infographic(stats_data, section_type, time_range, cache))[0]
+
+
+async def render_cached_infographic(
+    stats_data: dict,
+    section_type: str = "artists",
+    time_range: str = "short_term",
+    cache=None,
+) -> tuple:
+    # Runs statsImageGenerator.plan_cached_infographic, the render cache is read and written
+    # and the SVG rendered in worker threads
+    if cache is None:
+        cache = statsCache.get_cache()
+    return await requestPlans.run_async(
+        statsImageGenerator.plan_cached_infographic(stats_data, section_type, time_range, cache),
+        lambda request: fetch_images_as_base64(request[0], size=request[1]),
+        in_thread=True,
+    )
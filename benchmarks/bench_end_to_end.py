@@ -0,0 +1,196 @@
+## End to end benchmark of the collector, the renderer and the Flask endpoints against local stand-ins
+## of Spotify and its image CDN (see fakeSpotify), so it runs without network access or Spotify account
+## Usage: python benchmarks/bench_end_to_end.py [--iterations N] [--latency S] [--check | --save-baseline]
+import argparse, contextlib, io, json, os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import fakeSpotify
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+
+# Nearest-rank percentile of a list of values
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+# Run a scenario iterations times, returns its latency percentiles (ms), throughput (op/s) and bytes per response
+# setup runs before each iteration and is not timed, run returns the response
+def measure(run, setup=None, iterations: int = 20) -> dict:
+    latencies = []
+    sizes = []
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+        startTime = time.perf_counter()
+        # The collector prints every item, keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = run()
+        latencies.append(time.perf_counter() - startTime)
+        sizes.append(len(response))
+    return {
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "throughput": round(len(latencies) / sum(latencies), 1),
+        "bytes": int(sum(sizes) / len(sizes)),
+    }
+
+
+# Point the app to the stand-ins, with fresh clients, sessions and caches
+def configure(spotify_url: str):
+    os.environ.update(
+        {
+            "SPOTIPY_CLIENT_ID": "bench-client-id",
+            "SPOTIPY_CLIENT_SECRET": "bench-client-secret",
+            "SPOTIPY_REDIRECT_URI": "http://127.0.0.1/callback",
+            "SPOTIFY_REFRESH_TOKEN": "bench-refresh-token",
+            "SPOTIFY_API_URL": spotify_url,
+            "SPOTIFY_ACCOUNTS_URL": spotify_url,
+        }
+    )
+    # Cold scenarios collect back to back, far faster than the default pacing of the rate limiter,
+    # which would be measured instead of the app: only Retry-After is honored unless set
+    os.environ.setdefault("SPOTIFY_RATE_LIMIT", "0")
+    # Cold scenarios must reach the stand-ins, not the snapshots saved by the previous iterations
+    os.environ["SNAPSHOT_DB_PATH"] = ""
+    for name in ("REDIS_URL", "KV_URL", "IMAGE_CACHE_DIR", "SPOTIFY_TENANTS", "TENANTS_FILE"):
+        os.environ.pop(name, None)
+
+
+def run_benchmarks(iterations: int) -> dict:
+    import httpSessions
+    import imageCache
+    import rateLimiter
+    import statsCache
+    import statsCollector
+    import statsImageGenerator
+    from api import index
+
+    httpSessions.reset_sessions()
+    statsCollector.reset_spotify_clients()
+    rateLimiter.reset_limiter()
+    statsCache.set_cache(statsCache.MemoryCacheBackend())
+
+    def cold_images():
+        imageCache.set_image_cache(imageCache.ImageCache())
+
+    def cold_caches():
+        statsCache.set_cache(statsCache.MemoryCacheBackend())
+        cold_images()
+
+    client = index.app.test_client()
+    with contextlib.redirect_stdout(io.StringIO()):
+        stats = statsCollector.get_user_data(
+            statsCollector.setup_spotify_client(), concurrent=True
+        )
+
+    def render():
+        return statsImageGenerator.create_spotify_infographic(stats, "artists", "short_term")
+
+    def get(path):
+        # Reading data consumes streamed responses too
+        return lambda: client.get(path).data
+
+    results = {
+        "collector_main": measure(
+            lambda: json.dumps(statsCollector.main()), iterations=iterations
+        ),
+        "render_cold_images": measure(render, cold_images, iterations),
+        "render_warm_images": measure(render, iterations=iterations),
+        "api_json_cold": measure(get("/json"), cold_caches, iterations),
+        "api_json_warm": measure(get("/json"), iterations=iterations),
+        "api_stats_cold": measure(get("/stats?type=artists"), cold_caches, iterations),
+        "api_stats_warm": measure(get("/stats?type=artists"), iterations=iterations),
+    }
+    statsCache.set_cache(None)
+    imageCache.set_image_cache(None)
+    return results
+
+
+# Compare results to a baseline, returns the list of regressions
+# A scenario regresses when its p50 or p90 is more than tolerance (and min_delta_ms) slower,
+# or its responses grew by more than 5%
+def compare(results: dict, baseline: dict, tolerance: float, min_delta_ms: float = 2.0) -> list:
+    regressions = []
+    for scenario, metrics in results.items():
+        reference = baseline.get(scenario)
+        if reference is None:
+            continue
+        for metric in ("p50_ms", "p90_ms"):
+            limit = max(reference[metric] * (1 + tolerance), reference[metric] + min_delta_ms)
+            if metrics[metric] > limit:
+                regressions.append(
+                    f"{scenario} {metric}: {metrics[metric]} > {reference[metric]} (+{tolerance:.0%})"
+                )
+        if metrics["bytes"] > reference["bytes"] * 1.05:
+            regressions.append(f"{scenario} bytes: {metrics['bytes']} > {reference['bytes']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End to end benchmark against local Spotify and CDN stand-ins")
+    parser.add_argument("--iterations", type=int, default=20, help="runs of each scenario (default: 20)")
+    parser.add_argument("--latency", type=float, default=0.02, help="Spotify latency in seconds (default: 0.02)")
+    parser.add_argument("--cdn-latency", type=float, default=0.01, help="CDN latency in seconds (default: 0.01)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="latency jitter in seconds (default: 0)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of failed requests (default: 0)")
+    parser.add_argument("--items", type=int, default=5, help="items of each Web API endpoint (default: 5)")
+    parser.add_argument("--image-size", type=int, default=640, help="CDN image size in pixels (default: 640)")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown (default: 0.5 = 50%%)")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--check", action="store_true", help="exit with an error on regressions")
+    group.add_argument("--save-baseline", action="store_true", help="store the results as the baseline")
+    args = parser.parse_args()
+
+    cdn = fakeSpotify.start_fake_cdn(
+        fakeSpotify.FakeServerConfig(
+            latency=args.cdn_latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            image_size=args.image_size,
+        )
+    )
+    spotify = fakeSpotify.start_fake_spotify(
+        cdn.url,
+        fakeSpotify.FakeServerConfig(
+            latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, items=args.items
+        ),
+    )
+    configure(spotify.url)
+    try:
+        results = run_benchmarks(args.iterations)
+    finally:
+        spotify.stop()
+        cdn.stop()
+
+    print(f"{'scenario':<20} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'op/s':>8} {'bytes':>9}")
+    for scenario, metrics in results.items():
+        print(
+            f"{scenario:<20} {metrics['p50_ms']:>9} {metrics['p90_ms']:>9} {metrics['p99_ms']:>9}"
+            f" {metrics['throughput']:>8} {metrics['bytes']:>9}"
+        )
+    print(f"Spotify: {spotify.requests} requests, {spotify.errors} errors, {spotify.bytes_sent} bytes")
+    print(f"CDN: {cdn.requests} requests, {cdn.errors} errors, {cdn.bytes_sent} bytes")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions and args.check:
+            sys.exit(1)
+        if not regressions:
+            print("No regression against", args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+## Microbenchmark of the SVG rendering: template based renderer vs the previous f-string concatenation
+## Usage: python benchmarks/bench_svg_render.py [iterations]
+import os, sys, timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from statsImageGenerator import (
+    create_spotify_infographic,
+    escape_xml,
+    get_section_data,
+    get_section_layout,
+    wrap_text,
+)
+
+# Size of the base64 data URI of each image, about what a downscaled 268px JPEG takes
+IMAGE_BYTES = 24 * 1024
+
+
+# Previous implementation, kept to check the output is byte-identical and to measure the speedup
+def legacy_create_spotify_infographic(
+    stats_data: dict,
+    section_type: str = "artists",
+    time_range: str = "short_term",
+    image_deadline: float = None,
+    images: dict = None,
+) -> str:
+
+    # Determine number of items and columns based on section type
+    num_columns, num_items, card_width, card_height = get_section_layout(section_type)
+
+    # Calculate SVG dimensions - COMPACT
+    padding = 12
+    card_spacing = 8
+    title_height = 45  # Reduced since no subtitle
+    total_width = (
+        (card_width * num_columns) + (card_spacing * (num_columns - 1)) + (padding * 2)
+    )
+    total_height = card_height + title_height + padding
+
+    # SVG header with enhanced styles
+    svg_header = f"""<svg width="{total_width}" height="{total_height}" xmlns="http://www.w3.org/2000/svg">
+    <defs>
+        <style type="text/css">
+            .title {{ 
+                fill: #1DB954; 
+                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', 'Helvetica Neue', Arial, sans-serif; 
+                font-size: 22px; 
+                font-weight: 700; 
+            }}
+            .card-title {{ 
+                fill: #FFFFFF; 
+                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Arial, sans-serif; 
+                font-size: 11px; 
+                font-weight: 600;
+                line-height: 1.3;
+            }}
+            .card-subtitle {{ 
+                fill: #B3B3B3; 
+                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Arial, sans-serif; 
+                font-size: 9px; 
+                font-weight: 400; 
+            }}
+        </style>
+        <!-- Dark gradient background -->
+        <linearGradient id="bgGradient" x1="0%" y1="0%" x2="0%" y2="100%">
+            <stop offset="0%" style="stop-color:#1a1a1a;stop-opacity:1" />
+            <stop offset="100%" style="stop-color:#0a0a0a;stop-opacity:1" />
+        </linearGradient>
+        <!-- Card gradient -->
+        <linearGradient id="cardGradient" x1="0%" y1="0%" x2="0%" y2="100%">
+            <stop offset="0%" style="stop-color:#2a2a2a;stop-opacity:1" />
+            <stop offset="100%" style="stop-color:#1e1e1e;stop-opacity:1" />
+        </linearGradient>
+        <!-- Green accent gradient -->
+        <linearGradient id="accentGradient" x1="0%" y1="0%" x2="100%" y2="100%">
+            <stop offset="0%" style="stop-color:#1DB954;stop-opacity:0.15" />
+            <stop offset="100%" style="stop-color:#1ed760;stop-opacity:0.05" />
+        </linearGradient>
+        <!-- Subtle glow effect -->
+        <filter id="glow" x="-50%" y="-50%" width="200%" height="200%">
+            <feGaussianBlur in="SourceGraphic" stdDeviation="1" result="blur"/>
+            <feComponentTransfer in="blur" result="glow">
+                <feFuncA type="linear" slope="1.5"/>
+            </feComponentTransfer>
+            <feMerge>
+                <feMergeNode in="glow"/>
+                <feMergeNode in="SourceGraphic"/>
+            </feMerge>
+        </filter>
+        <!-- Card shadow -->
+        <filter id="cardShadow" x="-20%" y="-20%" width="140%" height="140%">
+            <feGaussianBlur in="SourceAlpha" stdDeviation="3"/>
+            <feOffset dx="0" dy="2" result="offsetblur"/>
+            <feComponentTransfer>
+                <feFuncA type="linear" slope="0.3"/>
+            </feComponentTransfer>
+            <feMerge>
+                <feMergeNode/>
+                <feMergeNode in="SourceGraphic"/>
+            </feMerge>
+        </filter>
+    </defs>
+    
+    <!-- Background with gradient -->
+    <rect width="{total_width}" height="{total_height}" fill="url(#bgGradient)"/>
+    """
+
+    # Title section (NO SUBTITLE IN HEADER)
+    svg_content = ""
+
+    if section_type == "artists":
+        if time_range == "short_term":
+            title = "My Recent Top Artists"
+        else:
+            title = "My All-Time Top Artists"
+
+    elif section_type == "top_songs":
+        if time_range == "short_term":
+            title = "My Recent Top Songs"
+        else:
+            title = "My All-Time Top Songs"
+
+    elif section_type == "last_albums":
+        title = "Last Played Albums"
+    else:
+        return None
+    data = get_section_data(stats_data, section_type, time_range)
+
+    # Add title with glow (NO SUBTITLE)
+    svg_content += f"""
+    <g filter="url(#glow)">
+        <text x="{padding}" y="32" class="title">{escape_xml(title)}</text>
+    </g>
+    """
+
+    # Create cards
+    y_start = title_height
+    items = list(data.items())[:num_items]
+
+    for i, (idx, item) in enumerate(items):
+        # Calculate position
+        col = i % num_columns
+        x = padding + (col * (card_width + card_spacing))
+        y = y_start
+
+        # Get item data
+        name = item.get("name", "Unknown")
+        image_url = item.get("image", None)
+
+        # Wrap text instead of truncating
+        max_chars = 18 if section_type == "last_albums" else 16
+        name_lines = wrap_text(name, max_chars)
+
+        # Get subtitle (artist name or genre)
+        if section_type == "artists":
+            subtitle_text = item.get("genre", "Unknown")
+            subtitle_lines = wrap_text(subtitle_text, max_chars)
+        else:
+            artist_name = item.get("artist", "Unknown")
+            subtitle_lines = wrap_text(artist_name, max_chars)
+
+        # Image dimensions
+        img_size = card_width - 16
+        img_y_offset = 8
+
+        # Card container with shadow and gradient
+        svg_content += f"""
+    <g class="card" filter="url(#cardShadow)">
+        <!-- Card background with gradient -->
+        <rect x="{x}" y="{y}" width="{card_width}" height="{card_height}" 
+              fill="url(#cardGradient)" rx="10" ry="10"/>
+        
+        <!-- Subtle accent overlay -->
+        <rect x="{x}" y="{y}" width="{card_width}" height="{card_height}" 
+              fill="url(#accentGradient)" rx="10" ry="10" opacity="0.3"/>
+        
+        <!-- Top accent line -->
+        <rect x="{x}" y="{y}" width="{card_width}" height="2" 
+              fill="#1DB954" rx="10" ry="10" opacity="0.6"/>
+        """
+
+        # Fetch and embed image as base64 if available
+        if image_url:
+            base64_image = images.get(image_url)
+            if base64_image:
+                svg_content += f"""
+        <!-- Album/Artist Image (embedded as base64) -->
+        <image x="{x + 8}" y="{y + img_y_offset}" width="{img_size}" height="{img_size}" 
+               href="{base64_image}" preserveAspectRatio="xMidYMid slice"
+               style="clip-path: inset(0% round 8px);"/>
+        """
+            else:
+                # Placeholder if image fetch failed
+                svg_content += f"""
+        <rect x="{x + 8}" y="{y + img_y_offset}" width="{img_size}" height="{img_size}" 
+              fill="#333333" rx="8" ry="8"/>
+        <text x="{x + card_width/2}" y="{y + img_y_offset + img_size/2 + 5}" 
+              class="card-title" text-anchor="middle" opacity="0.3" font-size="24">♪</text>
+        """
+        else:
+            # Placeholder if no image URL
+            svg_content += f"""
+        <rect x="{x + 8}" y="{y + img_y_offset}" width="{img_size}" height="{img_size}" 
+              fill="#333333" rx="8" ry="8"/>
+        <text x="{x + card_width/2}" y="{y + img_y_offset + img_size/2 + 5}" 
+              class="card-title" text-anchor="middle" opacity="0.3" font-size="24">♪</text>
+        """
+
+        # Text section with wrapped text
+        text_y = y + img_y_offset + img_size + 18
+
+        # Title (up to 2 lines)
+        for line_idx, line in enumerate(name_lines):
+            escaped_line = escape_xml(line)
+            svg_content += f"""
+        <text x="{x + card_width/2}" y="{text_y + (line_idx * 13)}" class="card-title" text-anchor="middle">
+            {escaped_line}
+        </text>
+        """
+
+        # Subtitle (artist/genre - 1 line)
+        subtitle_y = text_y + (len(name_lines) * 13) + 10
+        if subtitle_lines:
+            escaped_subtitle = escape_xml(subtitle_lines[0])
+            svg_content += f"""
+        <text x="{x + card_width/2}" y="{subtitle_y}" class="card-subtitle" text-anchor="middle">
+            {escaped_subtitle}
+        </text>
+        """
+
+        svg_content += "</g>"
+
+    svg_footer = "</svg>"
+
+    return svg_header + svg_content + svg_footer
+
+
+def make_stats():
+    def items(prefix, count, extra):
+        return {
+            i: dict(name=f"{prefix} number {i} & friends", image=f"https://i.scdn.co/image/{prefix}{i}", **extra)
+            for i in range(count)
+        }
+
+    return {
+        "top_artists": {
+            "short_term": items("artist", 5, {"genre": "indie rock"}),
+            "long_term": items("legend", 5, {"genre": "classic <rock>"}),
+        },
+        "top_songs": {
+            "short_term": items("song", 5, {"artist": "Some Band"}),
+            "long_term": items("hit", 5, {"artist": "Other Band"}),
+        },
+        "last_albums": items("album", 3, {"artist": "Some Band"}),
+    }
+
+
+def make_images(stats):
+    images = {}
+    for section in stats.values():
+        for data in ([section] if 0 in section else section.values()):
+            for item in data.values():
+                images[item["image"]] = "data:image/jpeg;base64," + "A" * IMAGE_BYTES
+    return images
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    stats = make_stats()
+    images = make_images(stats)
+    variants = [("artists", "short_term"), ("top_songs", "long_term"), ("last_albums", "short_term")]
+
+    for section_type, time_range in variants:
+        args = (stats, section_type, time_range, None, images)
+        assert create_spotify_infographic(*args) == legacy_create_spotify_infographic(*args)
+        legacy = timeit.timeit(lambda: legacy_create_spotify_infographic(*args), number=iterations)
+        templated = timeit.timeit(lambda: create_spotify_infographic(*args), number=iterations)
+        print(
+            f"{section_type:>12} {time_range:<10}"
+            f" legacy {legacy / iterations * 1e6:8.1f} us"
+            f" templates {templated / iterations * 1e6:8.1f} us"
+            f" speedup x{legacy / templated:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
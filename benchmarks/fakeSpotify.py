@@ -0,0 +1,211 @@
+## Local stand-ins for the Spotify Web API, the Spotify accounts service and the image CDN
+## Both run on http.server in a background thread, with configurable latency, payload sizes and error injection
+import json, random, threading, time
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+try:
+    from PIL import Image
+except ImportError:  # Without Pillow the CDN serves random bytes instead of JPEGs
+    Image = None
+
+
+class FakeServerConfig:
+    # Behaviour of a fake server
+    # latency and jitter are in seconds, error_rate is the share of requests answered with error_status
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        items: int = 5,
+        image_size: int = 640,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.items = items  # Items of each Web API endpoint, returned a page at a time
+        self.image_size = image_size  # Width and height of the CDN images, in pixels
+        self.random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    def delay(self) -> float:
+        with self._random_lock:
+            return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def should_fail(self) -> bool:
+        with self._random_lock:
+            return self.random.random() < self.error_rate
+
+
+class FakeServer(ThreadingHTTPServer):
+    # HTTP server running in a daemon thread, counting requests and bytes sent
+    daemon_threads = True
+
+    def __init__(self, handler_class, config: FakeServerConfig):
+        super().__init__(("127.0.0.1", 0), handler_class)
+        self.config = config
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self._stats_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, size: int, error: bool = False):
+        with self._stats_lock:
+            self.requests += 1
+            self.bytes_sent += size
+            if error:
+                self.errors += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    # Base handler applying the latency and error injection of the server config
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real services
+    # Send headers and body in one segment, otherwise delayed ACKs add ~40ms to every response
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def log_message(self, format, *args):
+        pass  # Keep the benchmark output readable
+
+    def send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(len(body), error=status >= 400)
+
+    def send_json(self, status: int, value):
+        self.send(status, json.dumps(value).encode("utf-8"), "application/json")
+
+    def handle_request(self, method: str):
+        config = self.server.config
+        time.sleep(config.delay())
+        if method == "POST":
+            # Drain the form body so the connection can be reused
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if config.should_fail():
+            self.send_json(config.error_status, {"error": {"status": config.error_status}})
+            return
+        url = urlparse(self.path)
+        self.route(method, url.path, {k: v[0] for k, v in parse_qs(url.query).items()})
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def route(self, method: str, path: str, query: dict):
+        self.send_json(404, {"error": {"status": 404, "message": "Not found"}})
+
+
+class FakeSpotifyHandler(FakeHandler):
+    # Token endpoint of the accounts service and the Web API endpoints used by statsCollector
+
+    def images(self, name: str) -> list:
+        cdn = self.server.cdn_url
+        return [
+            {"url": f"{cdn}/image/{name}-640.jpg", "width": 640, "height": 640},
+            {"url": f"{cdn}/image/{name}-300.jpg", "width": 300, "height": 300},
+            {"url": f"{cdn}/image/{name}-64.jpg", "width": 64, "height": 64},
+        ]
+
+    def artist(self, i: int) -> dict:
+        return {"name": f"Artist {i}", "genres": ["indie rock", "pop"], "images": self.images(f"artist{i}")}
+
+    def album(self, i: int) -> dict:
+        return {
+            "name": f"Album {i} (Deluxe Edition)",
+            "artists": [{"name": f"Artist {i}"}],
+            "images": self.images(f"album{i}"),
+        }
+
+    def send_page(self, items: list, nextPage: str):
+        self.send_json(200, {"items": items, "total": self.server.config.items, "next": nextPage})
+
+    def route(self, method: str, path: str, query: dict):
+        offset = int(query.get("offset", 0))
+        count = max(0, min(int(query.get("limit", 20)), self.server.config.items - offset))
+        indexes = range(offset, offset + count)
+        # Link to the next page while there are items left, like the Web API paging objects
+        nextPage = None
+        if offset + count < self.server.config.items:
+            nextPage = f"{path}?offset={offset + count}&limit={count}"
+        if method == "POST" and path == "/api/token":
+            self.send_json(
+                200,
+                {
+                    "access_token": f"fake-token-{time.time()}",
+                    "token_type": "Bearer",
+                    "expires_in": 3600,
+                    "scope": "user-library-read user-top-read",
+                },
+            )
+        elif path == "/v1/me/top/artists":
+            self.send_page([self.artist(i) for i in indexes], nextPage)
+        elif path == "/v1/me/top/tracks":
+            tracks = [
+                {"name": f"Song {i}", "artists": [{"name": f"Artist {i}"}], "album": self.album(i)}
+                for i in indexes
+            ]
+            self.send_page(tracks, nextPage)
+        elif path == "/v1/me/albums":
+            self.send_page([{"album": self.album(i)} for i in indexes], nextPage)
+        else:
+            super().route(method, path, query)
+
+
+# Generate the JPEG served by the CDN, noise so it doesn't compress to almost nothing
+def make_image(size: int, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    if Image is None:
+        return rng.randbytes(size * size // 4)
+    tile = Image.frombytes("RGB", (64, 64), rng.randbytes(64 * 64 * 3))
+    output = BytesIO()
+    tile.resize((size, size), Image.BILINEAR).save(output, format="JPEG", quality=85)
+    return output.getvalue()
+
+
+class FakeCdnHandler(FakeHandler):
+    # Serves the same generated image for every /image/<name> path
+
+    def route(self, method: str, path: str, query: dict):
+        if path.startswith("/image/"):
+            self.send(200, self.server.image, "image/jpeg")
+        else:
+            super().route(method, path, query)
+
+
+# Start the fake CDN
+def start_fake_cdn(config: FakeServerConfig = None) -> FakeServer:
+    server = FakeServer(FakeCdnHandler, config or FakeServerConfig())
+    server.image = make_image(server.config.image_size)
+    return server.start()
+
+
+# Start the fake Web API and accounts service, whose images point to cdn_url
+def start_fake_spotify(cdn_url: str, config: FakeServerConfig = None) -> FakeServer:
+    server = FakeServer(FakeSpotifyHandler, config or FakeServerConfig())
+    server.cdn_url = cdn_url
+    return server.start()
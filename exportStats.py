@@ -0,0 +1,102 @@
+## Render every /stats variant and the JSON stats to static files in one pass
+## Meant for deployments publishing the images through GitHub Actions instead of a live API
+import argparse, os, json, hashlib, tempfile
+import statsCollector
+import statsImageGenerator
+from fileUtils import FILE_MODE
+
+
+# Name of the file each /stats variant is exported to
+def get_variant_filename(section_type: str, time_range: str) -> str:
+    if section_type == "last_albums":
+        return "last_albums.svg"
+    return f"{section_type}_{time_range}.svg"
+
+
+# Atomically write content to path, unless the file already has the same content
+# Returns True if the file was written
+def write_if_changed(path: str, content: str) -> bool:
+    data = content.encode("utf-8")
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            if hashlib.sha256(f.read()).digest() == hashlib.sha256(data).digest():
+                return False
+
+    # Write to a temporary file in the same directory then rename it, so readers never see a partial file
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".", prefix=".", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_path, FILE_MODE)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return True
+
+
+# Download every image shown by any variant once, returns the images of each image size
+def fetch_all_images(stats: dict) -> dict:
+    urlsBySize = {}
+    for section_type, time_range in statsImageGenerator.STATS_VARIANTS:
+        num_columns, num_items, card_width, card_height = (
+            statsImageGenerator.get_section_layout(section_type)
+        )
+        records = statsImageGenerator.get_section_records(stats, section_type, time_range)
+        size = statsImageGenerator.get_image_render_size(card_width - 16)
+        urlsBySize.setdefault(size, []).extend(
+            record.image for record in records[:num_items]
+        )
+    return {
+        size: statsImageGenerator.fetch_images_as_base64(urls, size=size)
+        for size, urls in urlsBySize.items()
+    }
+
+
+def export_stats(output_dir: str, stats: dict = None) -> dict:
+    # Collect the stats once (unless given) and export every variant and the JSON to output_dir
+    # Returns a dict mapping each file name to whether it was written or unchanged
+    if stats is None:
+        stats = statsCollector.get_user_data(
+            statsCollector.setup_spotify_client(), concurrent=True
+        )
+    os.makedirs(output_dir, exist_ok=True)
+
+    imagesBySize = fetch_all_images(stats)
+    outputs = {"stats.json": json.dumps(stats, indent=2, ensure_ascii=False) + "\n"}
+    for section_type, time_range in statsImageGenerator.STATS_VARIANTS:
+        num_columns, num_items, card_width, card_height = (
+            statsImageGenerator.get_section_layout(section_type)
+        )
+        size = statsImageGenerator.get_image_render_size(card_width - 16)
+        outputs[get_variant_filename(section_type, time_range)] = (
+            statsImageGenerator.create_spotify_infographic(
+                stats, section_type, time_range, images=imagesBySize[size]
+            )
+        )
+
+    results = {}
+    for filename, content in outputs.items():
+        written = write_if_changed(os.path.join(output_dir, filename), content)
+        results[filename] = "written" if written else "unchanged"
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render every Spotify stats image and the JSON stats to static files"
+    )
+    parser.add_argument(
+        "-o", "--output", default="output", help="output directory (default: output)"
+    )
+    args = parser.parse_args()
+
+    results = export_stats(args.output)
+    for filename, result in results.items():
+        print(f"{result:>9}  {os.path.join(args.output, filename)}")
+
+
+if __name__ == "__main__":
+    main()
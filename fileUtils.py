@@ -0,0 +1,23 @@
+## Helpers shared by the modules writing files atomically (see exportStats and imageCache)
+import os
+
+
+# Get the umask of the process, read from /proc on Linux so the process-wide umask is never changed
+# Elsewhere it can only be read by setting it, which races with threads creating files, so it is
+# only done once, when this module is imported
+def get_umask() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError):
+        pass
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+# Mode of the files written through a temporary file, as if created with open()
+# (mkstemp creates them with 0600, which a web server serving them couldn't read)
+FILE_MODE = 0o666 & ~get_umask()
@@ -0,0 +1,91 @@
+## Shared HTTP sessions, so a warm worker reuses already open (keep-alive) connections
+## instead of doing a new TCP+TLS handshake for every image and Spotify request
+import os, random, threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Server errors worth retrying, rate limiting (429) is left to the caller
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+# Get the (retries, backoff_factor, backoff_jitter) of the requests, from the HTTP_RETRIES,
+# HTTP_BACKOFF_FACTOR and HTTP_BACKOFF_JITTER environment variables
+def get_retry_settings() -> tuple:
+    return (
+        int(os.environ.get("HTTP_RETRIES", "3")),
+        float(os.environ.get("HTTP_BACKOFF_FACTOR", "0.3")),
+        float(os.environ.get("HTTP_BACKOFF_JITTER", "0.2")),
+    )
+
+
+# Seconds to wait before retrying after `errors` consecutive failed attempts, as urllib3's Retry does:
+# no wait after the first one, then backoff_factor * 2^(errors - 1) plus up to backoff_jitter
+def get_backoff(errors: int, backoff_factor: float, backoff_jitter: float) -> float:
+    if errors <= 1:
+        return 0.0
+    return min(120.0, backoff_factor * 2 ** (errors - 1) + random.random() * backoff_jitter)
+
+
+# Create a session with a connection pool and retries with jittered exponential backoff
+# Settings default to the HTTP_POOL_SIZE environment variable and to get_retry_settings
+def create_session(
+    pool_size: int = None,
+    retries: int = None,
+    backoff_factor: float = None,
+    backoff_jitter: float = None,
+) -> requests.Session:
+    if pool_size is None:
+        pool_size = int(os.environ.get("HTTP_POOL_SIZE", "10"))
+    defaultRetries, defaultBackoffFactor, defaultBackoffJitter = get_retry_settings()
+    if retries is None:
+        retries = defaultRetries
+    if backoff_factor is None:
+        backoff_factor = defaultBackoffFactor
+    if backoff_jitter is None:
+        backoff_jitter = defaultBackoffJitter
+
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,  # Also covers connections reset while reading the response
+        status=retries,
+        status_forcelist=RETRY_STATUSES,
+        # Token refreshes are POST requests, retrying them is safe
+        allowed_methods=frozenset({"GET", "HEAD", "OPTIONS", "POST"}),
+        backoff_factor=backoff_factor,
+        backoff_jitter=backoff_jitter,
+        # Return the last response instead of raising, callers handle the status themselves
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+# Get the process wide session for a kind of traffic ("images", "spotify"), created on first use
+def get_session(name: str) -> requests.Session:
+    session = _sessions.get(name)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(name)
+            if session is None:
+                session = create_session()
+                _sessions[name] = session
+    return session
+
+
+# Close and forget every session, they are recreated from the environment on next use
+def reset_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
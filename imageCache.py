@@ -0,0 +1,211 @@
+## Two-tier cache for the base64 data URIs of images
+## Spotify CDN URLs are content addressed (i.scdn.co/image/<hash>) so cached entries never go stale
+import os, hashlib, tempfile, threading
+from collections import OrderedDict
+import snapshotStore
+from fileUtils import FILE_MODE
+
+
+class ImageCache:
+    # In-memory LRU limited in bytes, backed by an optional on-disk store with size based eviction
+    # and by an optional snapshot store (see snapshotStore) keeping the images across instances
+
+    def __init__(
+        self,
+        max_memory_bytes: int = 16 * 1024 * 1024,
+        disk_dir: str = None,
+        max_disk_bytes: int = 256 * 1024 * 1024,
+        snapshots: snapshotStore.SnapshotStore = None,
+    ):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.snapshots = snapshots
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "snapshot_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+        }
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, _, size in self._disk_entries())
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_memory_bytes=int(os.environ.get("IMAGE_CACHE_MAX_BYTES", 16 * 1024 * 1024)),
+            disk_dir=os.environ.get("IMAGE_CACHE_DIR") or None,
+            max_disk_bytes=int(
+                os.environ.get("IMAGE_CACHE_MAX_DISK_BYTES", 256 * 1024 * 1024)
+            ),
+            snapshots=snapshotStore.get_store(),
+        )
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def get(self, url: str):
+        key = self.key(url)
+        with self._lock:
+            data_uri = self._memory.get(key)
+            if data_uri is not None:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return data_uri
+
+            data_uri = self._read_disk(key)
+            if data_uri is not None:
+                self.stats["disk_hits"] += 1
+                self._store_memory(key, data_uri)
+                return data_uri
+
+        # The snapshot store has its own lock, it is read without holding the cache
+        if self.snapshots is not None:
+            data_uri = self.snapshots.get_image(key)
+        with self._lock:
+            if data_uri is not None:
+                self.stats["snapshot_hits"] += 1
+                self._store_memory(key, data_uri)
+                self._write_disk(key, data_uri)
+                return data_uri
+            self.stats["misses"] += 1
+            return None
+
+    # persist=False keeps the image out of the snapshot store, for images that are not rendered
+    # as is (the originals of resized images) and would only take its space
+    def set(self, url: str, data_uri: str, persist: bool = True):
+        key = self.key(url)
+        with self._lock:
+            self._store_memory(key, data_uri)
+            self._write_disk(key, data_uri)
+        if self.snapshots is not None:
+            if persist:
+                self.snapshots.set_image(key, data_uri)
+            else:
+                self.snapshots.delete_image(key)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            for path, _, _ in self._disk_entries():
+                os.remove(path)
+            self._disk_bytes = 0
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["memory_bytes"] = self._memory_bytes
+            stats["disk_bytes"] = self._disk_bytes
+        return stats
+
+    def _store_memory(self, key: str, data_uri: str):
+        size = len(data_uri)
+        if size > self.max_memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = data_uri
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.stats["memory_evictions"] += 1
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.b64")
+
+    # List the (path, last use time, size) of every image stored on disk
+    def _disk_entries(self) -> list:
+        entries = []
+        if not self.disk_dir:
+            return entries
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".b64"):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def _read_disk(self, key: str):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="ascii") as f:
+                data_uri = f.read()
+            os.utime(path)  # Mark as recently used for the eviction
+            return data_uri
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            print(f"Error reading cached image {path}: {e}")
+            return None
+
+    def _write_disk(self, key: str, data_uri: str):
+        if not self.disk_dir or len(data_uri) > self.max_disk_bytes:
+            return
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            return
+        try:
+            # Write to a temporary file first so readers never see a partial image
+            fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="ascii") as f:
+                f.write(data_uri)
+            os.chmod(tmp_path, FILE_MODE)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error caching image {path}: {e}")
+            return
+        self._disk_bytes += len(data_uri)
+        if self._disk_bytes > self.max_disk_bytes:
+            self._evict_disk()
+
+    # Remove the least recently used images until the disk store fits in its limit
+    def _evict_disk(self):
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[1])
+        self._disk_bytes = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._disk_bytes -= size
+            self.stats["disk_evictions"] += 1
+
+
+_image_cache = None
+_image_cache_lock = threading.Lock()
+
+
+# Get the process wide image cache, created from the environment on first use
+def get_image_cache() -> ImageCache:
+    global _image_cache
+    if _image_cache is None:
+        with _image_cache_lock:
+            if _image_cache is None:
+                _image_cache = ImageCache.from_env()
+    return _image_cache
+
+
+# Replace the process wide image cache (None to recreate it from the environment on next use)
+def set_image_cache(cache):
+    global _image_cache
+    _image_cache = cache
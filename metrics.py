@@ -0,0 +1,258 @@
+## Timing instrumentation of the hot path: token refresh, Spotify calls, image downloads and SVG rendering
+## Stage timings of the current request are sent in a Server-Timing header, and every measure is
+## aggregated in a process wide registry exposed in the Prometheus text format by the /metrics endpoint
+import time, threading, functools, contextlib, contextvars
+
+PREFIX = "spotify_stats_"
+
+# Histogram buckets of durations (in seconds) and response sizes (in bytes)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+HELP = {
+    "stage_duration_seconds": "Duration of each stage of the hot path",
+    "stage_errors_total": "Stages that raised an exception",
+    "upstream_errors_total": "Failed requests to Spotify and its image CDN",
+    "cache_lookups_total": "Cache lookups by cache and result",
+    "cache_hit_ratio": "Share of cache lookups that did not miss",
+    "request_duration_seconds": "Duration of the HTTP requests by endpoint",
+    "response_size_bytes": "Size of the HTTP responses by endpoint",
+    "rate_limit_wait_seconds": "Time Spotify requests waited for the rate limiter",
+    "rate_limited_total": "Spotify requests rate limited, by Spotify (429) or by the limiter (max_wait)",
+    "rate_limit_tokens": "Spotify requests that can be sent right away",
+    "rate_limit_blocked_seconds": "Time left until the Retry-After of the last 429 response is over",
+    "rate_limit_waiting_requests": "Spotify requests waiting for the rate limiter",
+    "single_flight_total": "Computations started (leader) or shared with a request in flight (follower)",
+}
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+def _format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    # Counters, gauges and histograms keyed by metric name and labels, safe to share between threads
+
+    def __init__(self):
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, labels: dict = None, amount=1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name: str, value: float, labels: dict = None):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, labels: dict = None, buckets=DURATION_BUCKETS):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {
+                    "buckets": buckets,
+                    "counts": [0] * len(buckets),
+                    "sum": 0,
+                    "count": 0,
+                }
+            for i, bound in enumerate(histogram["buckets"]):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def get_counter(self, name: str, labels: dict = None):
+        with self._lock:
+            return self._counters.get((name, tuple(sorted((labels or {}).items()))), 0)
+
+    def get_gauge(self, name: str, labels: dict = None):
+        with self._lock:
+            return self._gauges.get((name, tuple(sorted((labels or {}).items()))))
+
+    def get_histogram(self, name: str, labels: dict = None) -> dict:
+        with self._lock:
+            histogram = self._histograms.get((name, tuple(sorted((labels or {}).items()))))
+            return dict(histogram) if histogram else None
+
+    def _cache_hit_ratios(self, counters: dict) -> dict:
+        lookups = {}
+        for (name, labels), value in counters.items():
+            if name != "cache_lookups_total":
+                continue
+            labelsDict = dict(labels)
+            total, hits = lookups.get(labelsDict["cache"], (0, 0))
+            hit = labelsDict["result"] != "miss"
+            lookups[labelsDict["cache"]] = (total + value, hits + (value if hit else 0))
+        return {
+            (("cache", cache),): hits / total for cache, (total, hits) in lookups.items() if total
+        }
+
+    # Export every metric in the Prometheus text format
+    def render(self) -> str:
+        with self._lock:
+            counters = dict(self._counters)
+            storedGauges = dict(self._gauges)
+            histograms = {
+                key: dict(value, counts=list(value["counts"]))
+                for key, value in self._histograms.items()
+            }
+        gauges = {"cache_hit_ratio": self._cache_hit_ratios(counters)}
+        for (name, labels), value in storedGauges.items():
+            gauges.setdefault(name, {})[labels] = value
+
+        lines = []
+
+        def header(name, metricType):
+            lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name.replace('_', ' '))}")
+            lines.append(f"# TYPE {PREFIX}{name} {metricType}")
+
+        for name in sorted({name for name, _ in counters}):
+            header(name, "counter")
+            for (metricName, labels), value in sorted(counters.items()):
+                if metricName == name:
+                    lines.append(f"{PREFIX}{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for name in sorted({name for name, _ in histograms}):
+            header(name, "histogram")
+            for (metricName, labels), histogram in sorted(histograms.items()):
+                if metricName != name:
+                    continue
+                for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                    bucketLabels = _format_labels(labels + (("le", _format_value(bound)),))
+                    lines.append(f"{PREFIX}{name}_bucket{bucketLabels} {count}")
+                infLabels = _format_labels(labels + (("le", "+Inf"),))
+                lines.append(f"{PREFIX}{name}_bucket{infLabels} {histogram['count']}")
+                sumValue = _format_value(float(histogram["sum"]))
+                lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {sumValue}")
+                lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {histogram['count']}")
+
+        for name, values in sorted(gauges.items()):
+            if not values:
+                continue
+            header(name, "gauge")
+            for labels, value in sorted(values.items()):
+                lines.append(f"{PREFIX}{name}{_format_labels(labels)} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+_registry = Registry()
+
+
+def get_registry() -> Registry:
+    return _registry
+
+
+# Replace the process wide registry, mostly useful for tests
+def reset_registry():
+    global _registry
+    _registry = Registry()
+
+
+def inc(name: str, labels: dict = None, amount=1):
+    _registry.inc(name, labels, amount)
+
+
+def observe(name: str, value: float, labels: dict = None, buckets=DURATION_BUCKETS):
+    _registry.observe(name, value, labels, buckets)
+
+
+def set_gauge(name: str, value: float, labels: dict = None):
+    _registry.set_gauge(name, value, labels)
+
+
+# Count a lookup of one of the caches, result is "hit", "stale" or "miss"
+def cache_lookup(cache: str, result: str):
+    _registry.inc("cache_lookups_total", {"cache": cache, "result": result})
+
+
+def render_metrics() -> str:
+    return _registry.render()
+
+
+class Timings:
+    # Total duration and number of calls of each stage of a request, in the order the stages first ran
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, duration: float):
+        with self._lock:
+            total, calls = self.stages.get(stage, (0.0, 0))
+            self.stages[stage] = (total + duration, calls + 1)
+
+    # Format the stages as a Server-Timing header value, durations in milliseconds
+    # Stages running in parallel (e.g. image downloads) are summed, so they can exceed the total
+    def server_timing(self) -> str:
+        with self._lock:
+            stages = list(self.stages.items())
+        entries = []
+        for stage, (total, calls) in stages:
+            entry = f"{stage};dur={total * 1000:.1f}"
+            if calls > 1:
+                entry += f';desc="{calls} calls"'
+            entries.append(entry)
+        entries.append(f"total;dur={(time.perf_counter() - self.start_time) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_timings = contextvars.ContextVar("timings", default=None)
+
+
+# Start collecting the stage timings of a request in the current context
+def start_timings() -> Timings:
+    timings = Timings()
+    _timings.set(timings)
+    return timings
+
+
+def get_timings() -> Timings:
+    return _timings.get()
+
+
+# Run fn with the context of the caller, so stages timed in worker threads count for the current request
+def propagate(fn):
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+# Time a stage: its duration goes to the stage_duration_seconds histogram and to the current request timings
+@contextlib.contextmanager
+def timer(stage: str):
+    startTime = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        inc("stage_errors_total", {"stage": stage})
+        raise
+    finally:
+        duration = time.perf_counter() - startTime
+        observe("stage_duration_seconds", duration, {"stage": stage})
+        timings = _timings.get()
+        if timings is not None:
+            timings.add(stage, duration)
+
+
+# Decorator timing every call of a function as a stage
+def timed(stage: str):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,286 @@
+## Pacing of the Spotify Web API requests, shared by every account (see tenants) served by the process
+## A token bucket spaces the requests out, a 429 response holds every request back for its Retry-After,
+## and requests waiting for a token go by priority: interactive requests before background refreshes
+import os, time, heapq, asyncio, itertools, functools, threading, contextlib, contextvars
+import spotipy
+import metrics
+import tokenManager
+
+# Priorities of the requests, lower goes first
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+# Wait (in seconds) assumed when a 429 response has no Retry-After header
+DEFAULT_RETRY_AFTER = 5
+
+# Longest sleep (in seconds) of an async request waiting for a token before it checks the limiter again,
+# async waiters can't be woken up by the requests of other threads like the sync ones are
+ASYNC_POLL_INTERVAL = 0.05
+
+
+class RateLimitedError(Exception):
+    # Raised when a request can't be sent within the longest wait of its priority
+    # retry_after is how long (in seconds) until Spotify is expected to accept requests again
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"Spotify is rate limiting requests, retry in {retry_after:.1f}s")
+
+
+# Longest wait for a token (in seconds) of each priority, SPOTIFY_RATE_LIMIT_MAX_WAIT (default 2)
+# for interactive requests and SPOTIFY_RATE_LIMIT_BACKGROUND_MAX_WAIT (default 60) for background ones
+def get_max_wait(priority: int) -> float:
+    if priority == BACKGROUND:
+        return float(os.environ.get("SPOTIFY_RATE_LIMIT_BACKGROUND_MAX_WAIT", "60"))
+    return float(os.environ.get("SPOTIFY_RATE_LIMIT_MAX_WAIT", "2"))
+
+
+class RateLimiter:
+    # Token bucket refilled with rate tokens per second up to burst tokens, a rate of 0 disables it
+    # Requests are also held back until blocked_until, set from the Retry-After of 429 responses
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.blocked_until = 0.0
+        self._updated = time.monotonic()
+        self._waiters = []  # Heap of the (priority, arrival) of the waiting requests
+        self._arrivals = itertools.count()
+        self._condition = threading.Condition()
+
+    def _refill(self, now: float):
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    # Time until the next request can be sent, 0 if it can be sent right away
+    def _wait_time(self, now: float) -> float:
+        wait = max(0.0, self.blocked_until - now)
+        if self.rate and self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    # Take a token for the waiting request of ticket, with the lock held
+    # Returns None once the token is taken, otherwise how long to wait before trying again
+    def _take(self, ticket: tuple, deadline: float) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        wait = self._wait_time(now)
+        if wait <= 0 and self._waiters[0] == ticket:
+            self.tokens -= 1
+            return None
+        # Don't wait for a Retry-After that ends past the deadline
+        if now + wait > deadline or now >= deadline:
+            metrics.inc(
+                "rate_limited_total",
+                {"priority": PRIORITY_NAMES[ticket[0]], "reason": "max_wait"},
+            )
+            raise RateLimitedError(max(wait, 1 / self.rate if self.rate else 0))
+        return min(wait, deadline - now) if wait else deadline - now
+
+    def _leave(self, ticket: tuple):
+        self._waiters.remove(ticket)
+        heapq.heapify(self._waiters)
+        self._condition.notify_all()
+
+    # Wait for a token, returns how long it took
+    # Raises RateLimitedError if it can't be had within max_wait seconds (see get_max_wait)
+    def acquire(self, priority: int = None, max_wait: float = None) -> float:
+        if priority is None:
+            priority = get_priority()
+        if max_wait is None:
+            max_wait = get_max_wait(priority)
+        startTime = time.monotonic()
+        deadline = startTime + max_wait
+        ticket = (priority, next(self._arrivals))
+        with self._condition:
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    wait = self._take(ticket, deadline)
+                    if wait is None:
+                        break
+                    self._condition.wait(wait)
+            finally:
+                self._leave(ticket)
+
+        waited = time.monotonic() - startTime
+        metrics.observe("rate_limit_wait_seconds", waited, {"priority": PRIORITY_NAMES[priority]})
+        return waited
+
+    # Same as acquire for coroutines, the request sleeps on the event loop instead of blocking a thread
+    # It keeps its place among the waiting requests, the lock is only held to check the limiter
+    async def acquire_async(self, priority: int = None, max_wait: float = None) -> float:
+        if priority is None:
+            priority = get_priority()
+        if max_wait is None:
+            max_wait = get_max_wait(priority)
+        startTime = time.monotonic()
+        deadline = startTime + max_wait
+        ticket = (priority, next(self._arrivals))
+        with self._condition:
+            heapq.heappush(self._waiters, ticket)
+        try:
+            while True:
+                with self._condition:
+                    wait = self._take(ticket, deadline)
+                if wait is None:
+                    break
+                await asyncio.sleep(min(wait, ASYNC_POLL_INTERVAL))
+        finally:
+            with self._condition:
+                self._leave(ticket)
+
+        waited = time.monotonic() - startTime
+        metrics.observe("rate_limit_wait_seconds", waited, {"priority": PRIORITY_NAMES[priority]})
+        return waited
+
+    # Take a token if one is available and no request is waiting, without blocking
+    # Returns False if the request would have to wait, see acquire
+    def try_acquire(self, priority: int = None) -> bool:
+        if priority is None:
+            priority = get_priority()
+        with self._condition:
+            now = time.monotonic()
+            self._refill(now)
+            if self._waiters or self._wait_time(now) > 0:
+                return False
+            self.tokens -= 1
+        metrics.observe("rate_limit_wait_seconds", 0.0, {"priority": PRIORITY_NAMES[priority]})
+        return True
+
+    # Hold every request back for retry_after seconds, after a 429 response
+    def throttle(self, retry_after: float):
+        with self._condition:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            self._condition.notify_all()
+        metrics.inc("rate_limited_total", {"priority": PRIORITY_NAMES[get_priority()], "reason": "429"})
+        print(f"Spotify rate limit hit, holding requests back for {retry_after}s")
+
+    def is_throttled(self) -> bool:
+        return time.monotonic() < self.blocked_until
+
+    # Current state of the limiter, for /metrics
+    def get_state(self) -> dict:
+        with self._condition:
+            now = time.monotonic()
+            self._refill(now)
+            waiting = {name: 0 for name in PRIORITY_NAMES.values()}
+            for priority, _ in self._waiters:
+                waiting[PRIORITY_NAMES[priority]] += 1
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "tokens": self.tokens if self.rate else float(self.burst),
+                "blocked_for": max(0.0, self.blocked_until - now),
+                "waiting": waiting,
+            }
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+# Get the process wide limiter, created on first use from SPOTIFY_RATE_LIMIT (requests per second,
+# default 5, 0 only honors Retry-After) and SPOTIFY_RATE_LIMIT_BURST (default 25)
+def get_limiter() -> RateLimiter:
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter(
+                    float(os.environ.get("SPOTIFY_RATE_LIMIT", "5")),
+                    int(os.environ.get("SPOTIFY_RATE_LIMIT_BURST", "25")),
+                )
+    return _limiter
+
+
+# Forget the limiter, it is recreated from the environment on next use
+def reset_limiter():
+    global _limiter
+    with _limiter_lock:
+        _limiter = None
+
+
+# Export the state of the limiter as gauges of the metrics registry
+def record_state():
+    state = get_limiter().get_state()
+    metrics.set_gauge("rate_limit_tokens", state["tokens"])
+    metrics.set_gauge("rate_limit_blocked_seconds", state["blocked_for"])
+    for priority, count in state["waiting"].items():
+        metrics.set_gauge("rate_limit_waiting_requests", count, {"priority": priority})
+
+
+_priority = contextvars.ContextVar("rate_limit_priority", default=INTERACTIVE)
+
+
+def get_priority() -> int:
+    return _priority.get()
+
+
+# Run the Spotify requests of a block with another priority, e.g. priority(BACKGROUND) for refreshes
+# Worker threads started with metrics.propagate keep the priority of their caller
+@contextlib.contextmanager
+def priority(value: int):
+    token = _priority.set(value)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+# Get the Retry-After (in seconds) of a 429 SpotifyException
+def get_retry_after(error: spotipy.SpotifyException) -> float:
+    try:
+        return float((error.headers or {}).get("Retry-After"))
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+class RateLimitedSpotify:
+    # Proxy of a spotipy client taking a token of the limiter before each of its requests
+    # A request answered with 429 is sent again once its Retry-After is over, if it can wait that long
+    # A request answered with 401 is sent again once with a new access token (see tokenManager)
+
+    def __init__(self, sp: spotipy.Spotify, limiter: RateLimiter = None):
+        self.client = sp
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def call(*args, **kwargs):
+            limiter = self.limiter or get_limiter()
+            throttled = reauthenticated = False
+            while True:
+                limiter.acquire()
+                # The token the request is sent with, only this one is dropped if Spotify rejects it
+                accessToken = tokenManager.get_cached_token(self.client)
+                try:
+                    return attribute(*args, **kwargs)
+                except spotipy.SpotifyException as e:
+                    if e.http_status == 401 and not reauthenticated:
+                        reauthenticated = tokenManager.invalidate_token(self.client, accessToken)
+                        if reauthenticated:
+                            continue
+                    if e.http_status != 429:
+                        raise
+                    retryAfter = get_retry_after(e)
+                    limiter.throttle(retryAfter)
+                    if throttled:
+                        raise RateLimitedError(retryAfter) from e
+                    throttled = True
+
+        return call
+
+
+# Get a rate limited proxy of a client, clients that already are one are returned as is
+def limit(sp) -> RateLimitedSpotify:
+    if isinstance(sp, RateLimitedSpotify):
+        return sp
+    return RateLimitedSpotify(sp)
@@ -0,0 +1,48 @@
+## Plans of the work shared by the sync pipeline and the async one (see asyncPipeline)
+## A plan is a generator that yields each upstream request it needs and is sent its response (or thrown
+## its exception), its return value is the result. The paging, parsing, caching and resizing are written
+## once as plans, the sync and the async pipelines only differ in how they perform the requests
+import asyncio
+
+
+# Advance a plan with the response (or the exception) of its last request
+# Returns (True, result) once the plan is finished, (False, next request) otherwise
+def step(plan, response=None, error: Exception = None) -> tuple:
+    try:
+        if error is not None:
+            return False, plan.throw(error)
+        return False, plan.send(response)
+    except StopIteration as done:
+        return True, done.value
+
+
+# Run a plan to its result, perform(request) performs each request it yields
+def run(plan, perform):
+    finished, value = step(plan)
+    while not finished:
+        try:
+            response = perform(value)
+        except Exception as e:
+            finished, value = step(plan, error=e)
+        else:
+            finished, value = step(plan, response)
+    return value
+
+
+# Same as run with a coroutine function perform, so the requests don't block the event loop
+# With in_thread, the steps of the plan (e.g. cache lookups) run in worker threads too
+async def run_async(plan, perform, in_thread: bool = False):
+    async def advance(response=None, error=None):
+        if in_thread:
+            return await asyncio.to_thread(step, plan, response, error)
+        return step(plan, response, error)
+
+    finished, value = await advance()
+    while not finished:
+        try:
+            response = await perform(value)
+        except Exception as e:
+            finished, value = await advance(error=e)
+        else:
+            finished, value = await advance(response)
+    return value
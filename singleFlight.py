@@ -0,0 +1,126 @@
+## Request coalescing: concurrent callers needing the same result (a slice of the stats, an image)
+## wait on the one computation already in flight instead of repeating its upstream requests
+import asyncio, threading
+import metrics
+
+
+class Call:
+    # One computation in flight, its result or exception is shared with every caller waiting on it
+
+    def __init__(self):
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def set_result(self, result):
+        self.result = result
+        self._finish()
+
+    def set_error(self, error: Exception):
+        self.error = error
+        self._finish()
+
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    # Wait for the computation, raises its exception if it failed
+    def wait(self):
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    # Same as wait without blocking the event loop, the computation can run in any thread or task
+    async def wait_async(self):
+        loop = asyncio.get_running_loop()
+        finished = loop.create_future()
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(
+                    lambda: loop.call_soon_threadsafe(
+                        lambda: finished.done() or finished.set_result(None)
+                    )
+                )
+            else:
+                finished.set_result(None)
+        await finished
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class Group:
+    # Computations in flight keyed by what they compute, e.g. ("alice", "top_artists", "short_term")
+    # Keys are forgotten as soon as their computation is done, nothing is cached here
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    # Claim the keys that are not in flight yet, returns the (own, others) calls mapped by key:
+    # the caller must resolve (see resolve) its own calls, and can wait on the others
+    def claim(self, keys: list) -> tuple:
+        own = {}
+        others = {}
+        with self._lock:
+            for key in keys:
+                call = self._calls.get(key)
+                if call is None:
+                    call = own[key] = self._calls[key] = Call()
+                else:
+                    others[key] = call
+        if own:
+            metrics.inc("single_flight_total", {"group": self.name, "role": "leader"}, len(own))
+        if others:
+            metrics.inc("single_flight_total", {"group": self.name, "role": "follower"}, len(others))
+        return own, others
+
+    # Publish the result (or exception) of an own call to its waiters and forget its key
+    def resolve(self, key, result=None, error: Exception = None):
+        with self._lock:
+            call = self._calls.pop(key)
+        if error is not None:
+            call.set_error(error)
+        else:
+            call.set_result(result)
+
+    # Run fn unless the same key is already in flight, in which case its result is shared
+    def do(self, key, fn, *args, **kwargs):
+        own, others = self.claim([key])
+        if others:
+            return others[key].wait()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.resolve(key, error=e)
+            raise
+        self.resolve(key, result)
+        return result
+
+    # Same as do for coroutine functions, callers in threads and tasks share the same computations
+    async def do_async(self, key, fn, *args, **kwargs):
+        own, others = self.claim([key])
+        if others:
+            return await others[key].wait_async()
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException as e:
+            # Cancelled leaders fail their waiters instead of leaving them hanging
+            self.resolve(key, error=e if isinstance(e, Exception) else RuntimeError("Cancelled"))
+            raise
+        self.resolve(key, result)
+        return result
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,265 @@
+## Persistent SQLite store of the last known good output: versioned snapshots of the stats slices,
+## encoded images and rendered SVGs, so a new instance serves right away and Spotify errors never
+## turn into failed requests while a snapshot exists. The caches stay the fast path, this is read on misses
+## SNAPSHOT_DB_PATH sets the database file (in the temp directory by default), an empty value disables it
+import os, time, hashlib, sqlite3, tempfile, threading
+import metrics
+import statsModel
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stats_snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tenant TEXT NOT NULL,
+    section TEXT NOT NULL,
+    time_range TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    content_hash TEXT NOT NULL,
+    rows TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stats_snapshots_slice
+    ON stats_snapshots (tenant, section, time_range, fetched_at DESC);
+CREATE TABLE IF NOT EXISTS images (
+    key TEXT PRIMARY KEY,
+    data_uri TEXT NOT NULL,
+    stored_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS renders (
+    key TEXT PRIMARY KEY,
+    svg TEXT NOT NULL,
+    stored_at REAL NOT NULL
+);
+"""
+
+
+# Versions of each slice kept by the retention policy, overridable with SNAPSHOT_KEEP_VERSIONS
+def get_keep_versions() -> int:
+    return int(os.environ.get("SNAPSHOT_KEEP_VERSIONS", "10"))
+
+
+# Age (in seconds) past which snapshots, images and renders are dropped, SNAPSHOT_MAX_AGE (30 days)
+# The newest version of every slice is kept whatever its age, it is the last known good one
+def get_max_age() -> int:
+    return int(os.environ.get("SNAPSHOT_MAX_AGE", 30 * 24 * 60 * 60))
+
+
+# Bytes the images and renders may take together, SNAPSHOT_MAX_BYTES (256 MB like the disk image cache)
+# The oldest ones are dropped first
+def get_max_bytes() -> int:
+    return int(os.environ.get("SNAPSHOT_MAX_BYTES", 256 * 1024 * 1024))
+
+
+class SnapshotStore:
+    # SQLite database shared by the threads of the process, writes are serialized by a lock
+    # Stats are stored per tenant (the default account is ""), section and range (time_range is ""
+    # for sections without ranges), a new version is only added when the content of a slice changes
+    # Errors are printed and treated as misses, the store never fails a request
+
+    def __init__(self, path: str, compact_interval: float = 60 * 60):
+        self.path = path
+        self.compact_interval = compact_interval
+        self._lock = threading.Lock()
+        self._last_compaction = 0.0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+
+    def _execute(self, query: str, params: tuple = ()) -> list:
+        try:
+            with self._lock, self._connection:
+                return self._connection.execute(query, params).fetchall()
+        except sqlite3.Error as e:
+            print(f"Snapshot store unavailable: {e}")
+            return []
+
+    # Save the records (see statsModel) of slices collected at fetched_at,
+    # slices is a list of (section, sp_range, records)
+    def save_slices(self, user: str, slices: list, fetched_at: float = None):
+        if fetched_at is None:
+            fetched_at = time.time()
+        tenant = user or ""
+        try:
+            with self._lock, self._connection:
+                for section, sp_range, records in slices:
+                    rows = statsModel.dumps(records)
+                    contentHash = hashlib.sha256(rows.encode("utf-8")).hexdigest()[:32]
+                    latest = self._connection.execute(
+                        "SELECT id, content_hash FROM stats_snapshots"
+                        " WHERE tenant = ? AND section = ? AND time_range = ?"
+                        " ORDER BY fetched_at DESC LIMIT 1",
+                        (tenant, section, sp_range or ""),
+                    ).fetchone()
+                    # Unchanged slices only move the time of their newest version
+                    if latest is not None and latest[1] == contentHash:
+                        self._connection.execute(
+                            "UPDATE stats_snapshots SET fetched_at = ? WHERE id = ?",
+                            (fetched_at, latest[0]),
+                        )
+                        continue
+                    self._connection.execute(
+                        "INSERT INTO stats_snapshots"
+                        " (tenant, section, time_range, fetched_at, content_hash, rows)"
+                        " VALUES (?, ?, ?, ?, ?, ?)",
+                        (tenant, section, sp_range or "", fetched_at, contentHash, rows),
+                    )
+        except sqlite3.Error as e:
+            print(f"Snapshot store unavailable, could not save {user or 'default'} stats: {e}")
+            return
+        self._compact_if_due()
+
+    # Compact at most once every compact_interval seconds, called after every write
+    def _compact_if_due(self):
+        if time.time() - self._last_compaction > self.compact_interval:
+            self.compact()
+
+    # Get the (records, fetched_at) of the newest version of a slice, None if it was never saved
+    def load_slice(self, user: str, section: str, sp_range: str = None):
+        result = self._execute(
+            "SELECT rows, fetched_at FROM stats_snapshots"
+            " WHERE tenant = ? AND section = ? AND time_range = ?"
+            " ORDER BY fetched_at DESC LIMIT 1",
+            (user or "", section, sp_range or ""),
+        )
+        metrics.cache_lookup("snapshots", "hit" if result else "miss")
+        if not result:
+            return None
+        rows, fetchedAt = result[0]
+        return statsModel.loads(section, rows), fetchedAt
+
+    # Get the (fetched_at, content_hash) of the versions of a slice, newest first
+    def list_versions(self, user: str, section: str, sp_range: str = None) -> list:
+        return self._execute(
+            "SELECT fetched_at, content_hash FROM stats_snapshots"
+            " WHERE tenant = ? AND section = ? AND time_range = ?"
+            " ORDER BY fetched_at DESC",
+            (user or "", section, sp_range or ""),
+        )
+
+    def get_image(self, key: str):
+        result = self._execute("SELECT data_uri FROM images WHERE key = ?", (key,))
+        return result[0][0] if result else None
+
+    def set_image(self, key: str, data_uri: str):
+        self._execute(
+            "INSERT OR REPLACE INTO images (key, data_uri, stored_at) VALUES (?, ?, ?)",
+            (key, data_uri, time.time()),
+        )
+        self._compact_if_due()
+
+    def delete_image(self, key: str):
+        self._execute("DELETE FROM images WHERE key = ?", (key,))
+
+    def get_render(self, key: str):
+        result = self._execute("SELECT svg FROM renders WHERE key = ?", (key,))
+        return result[0][0] if result else None
+
+    def set_render(self, key: str, svg: str):
+        self._execute(
+            "INSERT OR REPLACE INTO renders (key, svg, stored_at) VALUES (?, ?, ?)",
+            (key, svg, time.time()),
+        )
+        self._compact_if_due()
+
+    # Apply the retention policy: keep the keep_versions newest versions of each slice,
+    # drop versions, images and renders older than max_age but never the newest version of a slice,
+    # then the oldest images and renders until they take at most max_bytes
+    # Returns the number of deleted rows of each table
+    def compact(
+        self, keep_versions: int = None, max_age: float = None, max_bytes: int = None
+    ) -> dict:
+        if keep_versions is None:
+            keep_versions = get_keep_versions()
+        if max_age is None:
+            max_age = get_max_age()
+        if max_bytes is None:
+            max_bytes = get_max_bytes()
+        cutoff = time.time() - max_age
+        self._last_compaction = time.time()
+        try:
+            with self._lock, self._connection:
+                snapshots = self._connection.execute(
+                    "DELETE FROM stats_snapshots WHERE id IN ("
+                    " SELECT id FROM ("
+                    "  SELECT id, fetched_at, ROW_NUMBER() OVER ("
+                    "   PARTITION BY tenant, section, time_range ORDER BY fetched_at DESC"
+                    "  ) AS version FROM stats_snapshots"
+                    " ) WHERE version > 1 AND (version > ? OR fetched_at < ?)"
+                    ")",
+                    (max(1, keep_versions), cutoff),
+                ).rowcount
+                images = self._connection.execute(
+                    "DELETE FROM images WHERE stored_at < ?", (cutoff,)
+                ).rowcount
+                renders = self._connection.execute(
+                    "DELETE FROM renders WHERE stored_at < ?", (cutoff,)
+                ).rowcount
+                # Running total of the sizes, newest first, everything past max_bytes is dropped
+                oversized = self._connection.execute(
+                    "SELECT kind, key FROM ("
+                    " SELECT kind, key, SUM(size) OVER (ORDER BY stored_at DESC, kind, key) AS total"
+                    " FROM ("
+                    "  SELECT 'images' AS kind, key, stored_at, LENGTH(CAST(data_uri AS BLOB)) AS size"
+                    "  FROM images"
+                    "  UNION ALL"
+                    "  SELECT 'renders', key, stored_at, LENGTH(CAST(svg AS BLOB)) FROM renders"
+                    " )"
+                    ") WHERE total > ?",
+                    (max_bytes,),
+                ).fetchall()
+                for kind, key in oversized:
+                    self._connection.execute(f"DELETE FROM {kind} WHERE key = ?", (key,))
+                    if kind == "images":
+                        images += 1
+                    else:
+                        renders += 1
+        except sqlite3.Error as e:
+            print(f"Snapshot store unavailable, could not compact: {e}")
+            return {}
+        deleted = {"stats_snapshots": snapshots, "images": images, "renders": renders}
+        print("Snapshots compacted:", deleted)
+        return deleted
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+_store_created = False
+
+
+# Path of the database, SNAPSHOT_DB_PATH or a file of the temp directory (the only writable
+# place on Vercel, kept as long as the instance), None when disabled with an empty SNAPSHOT_DB_PATH
+def get_db_path() -> str:
+    path = os.environ.get(
+        "SNAPSHOT_DB_PATH", os.path.join(tempfile.gettempdir(), "spotify-stats-snapshots.db")
+    )
+    return path or None
+
+
+# Get the process wide store, opened on first use, None if it is disabled or can't be opened
+def get_store() -> SnapshotStore:
+    global _store, _store_created
+    if not _store_created:
+        with _store_lock:
+            if not _store_created:
+                path = get_db_path()
+                if path:
+                    try:
+                        _store = SnapshotStore(path)
+                    except (sqlite3.Error, OSError) as e:
+                        print(f"Could not open the snapshot store at {path}: {e}")
+                _store_created = True
+    return _store
+
+
+# Replace the process wide store (None to open it from the environment on next use)
+def set_store(store: SnapshotStore):
+    global _store, _store_created
+    with _store_lock:
+        _store = store
+        _store_created = store is not None
@@ -0,0 +1,169 @@
+## Small pluggable TTL cache used to avoid calling the Spotify API on every request
+## Redis is used when a REDIS_URL (or Vercel KV_URL) is configured, otherwise an in-process LRU is used
+import os, json, time, hashlib, threading
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # Redis is optional, the in-memory backend is always available
+    redis = None
+
+
+# How long each section of the stats can be served from the cache (in seconds)
+DEFAULT_SECTION_TTLS = {
+    "top_artists": 6 * 60 * 60,
+    "top_songs": 6 * 60 * 60,
+    "last_albums": 10 * 60,
+}
+
+
+# Get the TTL of a stats section, overridable with STATS_TTL_<SECTION> environment variables
+def get_section_ttl(section: str) -> int:
+    env_value = os.environ.get(f"STATS_TTL_{section.upper()}")
+    if env_value:
+        try:
+            return int(env_value)
+        except ValueError:
+            print(f"Invalid TTL for {section}: {env_value}, using default")
+    return DEFAULT_SECTION_TTLS.get(section, 10 * 60)
+
+
+# How long sections are kept after their TTL to be served while they are refreshed (in seconds)
+def get_stale_ttl() -> int:
+    return int(os.environ.get("STATS_STALE_TTL", 7 * 24 * 60 * 60))
+
+
+# Whether expired sections are served right away while being refreshed in the background
+def serve_stale_enabled() -> bool:
+    return os.environ.get("STATS_SERVE_STALE", "1").lower() not in ("0", "false", "no")
+
+
+# Hash any JSON serializable value, used to key cached content and as ETag
+def content_hash(value) -> str:
+    serialized = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()[:32]
+
+
+class MemoryCacheBackend:
+    # In-process LRU cache with a per entry expiry, safe to share between threads
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl: int = None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# JSON turns the int keys used by statsCollector into strings, turn them back into ints
+def _restore_int_keys(obj: dict) -> dict:
+    return {int(k) if k.isdigit() else k: v for k, v in obj.items()}
+
+
+class RedisCacheBackend:
+    # Redis cache shared between instances, values are stored as compact JSON
+    # (no spaces, UTF-8 as is) like the rows of statsModel.dumps
+    # Falls back to an in-process cache whenever Redis can't be reached
+
+    def __init__(self, client, prefix: str = "spotify-stats:"):
+        self.client = client
+        self.prefix = prefix
+        self.fallback = MemoryCacheBackend()
+
+    @classmethod
+    def from_url(cls, url: str, prefix: str = "spotify-stats:"):
+        client = redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
+        return cls(client, prefix)
+
+    def get(self, key: str):
+        try:
+            raw_value = self.client.get(self.prefix + key)
+        except redis.RedisError as e:
+            print(f"Redis unavailable, using in-memory cache: {e}")
+            return self.fallback.get(key)
+        if raw_value is None:
+            return None
+        return json.loads(raw_value, object_hook=_restore_int_keys)
+
+    def set(self, key: str, value, ttl: int = None):
+        raw_value = json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+        try:
+            if ttl:
+                self.client.setex(self.prefix + key, ttl, raw_value)
+            else:
+                self.client.set(self.prefix + key, raw_value)
+        except redis.RedisError as e:
+            print(f"Redis unavailable, using in-memory cache: {e}")
+            self.fallback.set(key, value, ttl)
+
+    def delete(self, key: str):
+        self.fallback.delete(key)
+        try:
+            self.client.delete(self.prefix + key)
+        except redis.RedisError as e:
+            print(f"Redis unavailable, could not delete {key}: {e}")
+
+    def clear(self):
+        self.fallback.clear()
+        try:
+            for key in self.client.scan_iter(match=self.prefix + "*"):
+                self.client.delete(key)
+        except redis.RedisError as e:
+            print(f"Redis unavailable, could not clear the cache: {e}")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+# Create the cache backend from the environment, Redis if configured and installed, in-memory otherwise
+def create_cache():
+    redis_url = os.environ.get("REDIS_URL") or os.environ.get("KV_URL")
+    if redis_url and redis is not None:
+        return RedisCacheBackend.from_url(redis_url)
+    if redis_url:
+        print("REDIS_URL is set but redis is not installed, using in-memory cache")
+    max_entries = int(os.environ.get("STATS_CACHE_MAX_ENTRIES", "256"))
+    return MemoryCacheBackend(max_entries=max_entries)
+
+
+# Get the process wide cache, created on first use
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = create_cache()
+    return _cache
+
+
+# Replace the process wide cache (None to recreate it from the environment on next use)
+def set_cache(cache):
+    global _cache
+    _cache = cache
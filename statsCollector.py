@@ -1,111 +1,526 @@
 ## Inspired from https://github.com/ni5arga/spotify-stats-python, https://spotipy.readthedocs.io/en/2.25.1/, https://github.com/spotipy-dev/spotipy-examples/tree/c610a79705ef4aa55e4d61572a012f77b6f7245d/scripts and https://developer.spotify.com/documentation/web-api/reference/get-users-saved-albums
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth
-import os, json
+import os, json, time, threading
+from concurrent.futures import ThreadPoolExecutor
+import httpSessions
+import metrics
+import rateLimiter
+import requestPlans
+import singleFlight
+import snapshotStore
+import statsCache
+import statsModel
+import tenants
+import tokenManager
 
+# Sections of the stats, in the order they are collected
+SECTIONS = ["top_artists", "top_songs", "last_albums"]
+TIME_RANGES = ["short_term", "long_term"]
 
-def setup_spotify_client() -> spotipy.Spotify:
+
+# Cache key of the recently played albums history, and how many albums it keeps
+RECENTLY_PLAYED_HISTORY_KEY = "history:recently_played"
+RECENTLY_PLAYED_HISTORY_SIZE = 50
+
+# Most items a page of the Web API can hold, and most artists a single /artists request can get
+PAGE_SIZE = 50
+ARTISTS_BATCH_SIZE = 50
+
+
+# Spotify clients reused across requests, keyed by the credentials they were built with
+_spotify_clients = {}
+_spotify_clients_lock = threading.Lock()
+
+
+@metrics.timed("spotify_client")
+def setup_spotify_client(refresh_token: str = None) -> spotipy.Spotify:
+    # Clients are built once per refresh token (SPOTIFY_REFRESH_TOKEN by default) and reused
     SPOTIPY_CLIENT_ID = os.environ.get("SPOTIPY_CLIENT_ID")
     SPOTIPY_CLIENT_SECRET = os.environ.get("SPOTIPY_CLIENT_SECRET")
     SPOTIPY_REDIRECT_URI = os.environ.get("SPOTIPY_REDIRECT_URI")
     SCOPE = "user-library-read user-top-read user-read-recently-played user-read-playback-state"
     CACHE_HANDLER = spotipy.cache_handler.MemoryCacheHandler()
-    SPOTIFY_REFRESH_TOKEN = os.environ.get("SPOTIFY_REFRESH_TOKEN")
-
-    auth_manager = SpotifyOAuth(
-        client_id=SPOTIPY_CLIENT_ID,
-        client_secret=SPOTIPY_CLIENT_SECRET,
-        redirect_uri=SPOTIPY_REDIRECT_URI,
-        scope=SCOPE,
-        cache_handler=CACHE_HANDLER,
+    SPOTIFY_REFRESH_TOKEN = refresh_token or os.environ.get("SPOTIFY_REFRESH_TOKEN")
+    # Alternative Web API and accounts service base URLs, e.g. the stand-ins of the benchmarks
+    SPOTIFY_API_URL = os.environ.get("SPOTIFY_API_URL")
+    SPOTIFY_ACCOUNTS_URL = os.environ.get("SPOTIFY_ACCOUNTS_URL")
+
+    clientKey = (
+        SPOTIPY_CLIENT_ID,
+        SPOTIPY_CLIENT_SECRET,
+        SPOTIPY_REDIRECT_URI,
+        SPOTIFY_REFRESH_TOKEN,
+        SPOTIFY_API_URL,
+        SPOTIFY_ACCOUNTS_URL,
     )
+    with _spotify_clients_lock:
+        spClient = _spotify_clients.get(clientKey)
+        if spClient is not None:
+            return spClient
+
+        auth_manager = SpotifyOAuth(
+            client_id=SPOTIPY_CLIENT_ID,
+            client_secret=SPOTIPY_CLIENT_SECRET,
+            redirect_uri=SPOTIPY_REDIRECT_URI,
+            scope=SCOPE,
+            cache_handler=CACHE_HANDLER,
+            requests_session=httpSessions.get_session("spotify"),
+        )
+        if SPOTIFY_ACCOUNTS_URL:
+            auth_manager.OAUTH_TOKEN_URL = SPOTIFY_ACCOUNTS_URL.rstrip("/") + "/api/token"
+
+        # The refresh token is only used when the current access token is about to expire
+        token_manager = tokenManager.TokenManager(
+            auth_manager, SPOTIFY_REFRESH_TOKEN, store=statsCache.get_cache()
+        )
+
+        # Pooled keep-alive session with retries on server errors and connection resets
+        spClient = spotipy.Spotify(
+            auth_manager=token_manager,
+            requests_session=httpSessions.get_session("spotify"),
+        )
+        if SPOTIFY_API_URL:
+            spClient.prefix = SPOTIFY_API_URL.rstrip("/") + "/v1/"
+        _spotify_clients[clientKey] = spClient
+        return spClient
+
+
+def get_tenant_client(user: str = None) -> spotipy.Spotify:
+    # Get the client of a tenant (see tenants), the default account without a user key
+    if user is None:
+        return setup_spotify_client()
+    return setup_spotify_client(tenants.get_refresh_token(user))
 
-    # Use the refresh token to get a new access token
-    token_info = auth_manager.refresh_access_token(SPOTIFY_REFRESH_TOKEN)
 
-    return spotipy.Spotify(auth=token_info["access_token"])
+def reset_spotify_clients():
+    # Drop the reused clients, mostly useful for tests
+    with _spotify_clients_lock:
+        _spotify_clients.clear()
+
+
+def pick_image_url(images: list, min_size: int = None) -> str:
+    # Pick the smallest image at least min_size pixels wide (SPOTIFY_IMAGE_MIN_SIZE by default)
+    # Without a minimum size the first image, the largest one, is used
+    if min_size is None:
+        min_size = int(os.environ.get("SPOTIFY_IMAGE_MIN_SIZE", "0"))
+    bestImage = images[0]
+    if min_size:
+        for image in images:
+            width = image.get("width")
+            bestWidth = bestImage.get("width") or float("inf")
+            if width and min_size <= width < bestWidth:
+                bestImage = image
+    return bestImage["url"]
+
+
+# The collection of a slice is planned (see requestPlans): the plans yield lists of Spotify requests,
+# (method, args, kwargs) of the methods of spotipy.Spotify, and are sent the list of their responses
+# The requests of a list don't depend on each other, the async pipeline sends them concurrently
+def run_plan(sp: spotipy.Spotify, plan):
+    # Run a plan with a spotipy client, one request after the other
+    return requestPlans.run(
+        plan,
+        lambda requests: [getattr(sp, method)(*args, **kwargs) for method, args, kwargs in requests],
+    )
+
+
+def plan_items(method: str, count: int, **kwargs):
+    # Plan of the first count items of a paged endpoint (e.g. current_user_top_artists)
+    # Pages hold up to PAGE_SIZE items, so the next page is only requested for larger counts
+    items = []
+    while len(items) < count:
+        limit = min(count - len(items), PAGE_SIZE)
+        if items:
+            kwargs["offset"] = len(items)
+        [page] = yield [(method, (), dict(limit=limit, **kwargs))]
+        items.extend(page["items"][:limit])
+        if len(page["items"]) < limit or not page.get("next"):
+            break
+    return items
+
+
+def plan_artists(artist_ids: list):
+    # Plan of the full artist objects of several artists mapped by id, one request per ARTISTS_BATCH_SIZE artists
+    uniqueIds = list(dict.fromkeys(artist_ids))
+    with metrics.timer("spotify_artists"):
+        responses = yield [
+            ("artists", (uniqueIds[start : start + ARTISTS_BATCH_SIZE],), {})
+            for start in range(0, len(uniqueIds), ARTISTS_BATCH_SIZE)
+        ]
+    artists = {}
+    for response in responses:
+        for artist in response["artists"]:
+            if artist is not None:
+                artists[artist["id"]] = artist
+    return artists
+
+
+def get_artists(sp: spotipy.Spotify, artist_ids: list) -> dict:
+    return run_plan(sp, plan_artists(artist_ids))
+
+
+def get_coverless_artist_ids(songs: list) -> list:
+    # Ids of the artists of the songs without an album cover
+    return [
+        song["artists"][0]["id"]
+        for song in songs
+        if not song["album"]["images"] and song["artists"] and song["artists"][0].get("id")
+    ]
+
+
+def plan_top_artists(sp_range: str):
+    # Plan of User's Top Artists names and pictures for a single time range
+    # Top artists are full artist objects, artists without genres or pictures have none to look up
+    with metrics.timer("spotify_top_artists"):
+        topArtists = yield from plan_items(
+            "current_user_top_artists",
+            statsModel.get_section_size("top_artists"),
+            time_range=sp_range,
+        )
+        return parse_top_artists(topArtists)
+
+
+def get_user_top_artists_range(sp: spotipy.Spotify, sp_range: str) -> dict:
+    # Get User's Top Artists names and pictures for a single time range
+    return run_plan(sp, plan_top_artists(sp_range))
+
+
+def parse_top_artists(topArtists: list) -> dict:
+    # Get the names, pictures and first genres of Spotify artist objects, by rank
+    topArtistsDataRange = {}
+
+    for id, artist in enumerate(topArtists):
+        topArtistsDataRange[id] = {
+            "name": artist["name"],
+            "image": pick_image_url(artist["images"]),
+            "genre": artist["genres"][0] if artist["genres"] else "N/A",
+        }
+        print(
+            id,
+            artist["name"],
+            pick_image_url(artist["images"]),
+            artist["genres"][0] if artist["genres"] else "N/A",
+        )
+    return topArtistsDataRange
 
 
 def get_user_top_artists(sp: spotipy.Spotify) -> dict:
     # Get User's Top Artists names and pictures, both for short term and long term listening activities
     topArtistsData = {}
     print("|====== To Artists ======|")
-    for sp_range in ["short_term", "long_term"]:
+    for sp_range in TIME_RANGES:
         print("Range:", sp_range)
-
-        topArtists = sp.current_user_top_artists(time_range=sp_range, limit=5)
-        topArtistsDataRange = {}
-
-        for id, artist in enumerate(topArtists["items"]):
-            topArtistsDataRange[id] = {
-                "name": artist["name"],
-                "image": artist["images"][0]["url"],
-                "genre": artist["genres"][0] if artist["genres"] else "N/A",
-            }
-            print(
-                id,
-                artist["name"],
-                artist["images"][0]["url"],
-                artist["genres"][0] if artist["genres"] else "N/A",
-            )
+        topArtistsData[sp_range] = get_user_top_artists_range(sp, sp_range)
         print()
-        topArtistsData[sp_range] = topArtistsDataRange
 
     return topArtistsData
 
 
+def plan_top_songs(sp_range: str):
+    # Plan of User's Top Songs names, artists names and pictures for a single time range
+    with metrics.timer("spotify_top_songs"):
+        topSongs = yield from plan_items(
+            "current_user_top_tracks",
+            statsModel.get_section_size("top_songs"),
+            time_range=sp_range,
+        )
+        # Songs without an album cover get the picture of their artist, looked up in batches
+        coverlessArtistIds = get_coverless_artist_ids(topSongs)
+        artists = (yield from plan_artists(coverlessArtistIds)) if coverlessArtistIds else {}
+        return parse_top_songs(topSongs, artists)
+
+
+def get_user_top_songs_range(sp: spotipy.Spotify, sp_range: str) -> dict:
+    # Get User's Top Songs names, artists names and pictures for a single time range
+    return run_plan(sp, plan_top_songs(sp_range))
+
+
+def parse_top_songs(topSongs: list, artists: dict) -> dict:
+    # Get the names, artists names and pictures of Spotify track objects, by rank
+    # artists maps artist ids to the artist objects used for songs without an album cover
+    topSongsDataRange = {}
+    for id, song in enumerate(topSongs):
+        images = song["album"]["images"]
+        if not images and song["artists"]:
+            images = artists.get(song["artists"][0].get("id"), {}).get("images") or images
+        topSongsDataRange[id] = {
+            "name": song["name"],
+            "artist": song["artists"][0]["name"],
+            "image": pick_image_url(images),
+        }
+        print(
+            id,
+            song["name"],
+            "//",
+            song["artists"][0]["name"],
+            pick_image_url(images),
+        )
+    return topSongsDataRange
+
+
 def get_user_top_songs(sp: spotipy.Spotify) -> dict:
     # Get User's Top Songs names, artists names and pictures, both for short term and long term listening activities
     topSongsData = {}
     print("|====== Top Songs ======|")
-    for sp_range in ["short_term", "long_term"]:
+    for sp_range in TIME_RANGES:
         print("Range:", sp_range)
-
-        topSongs = sp.current_user_top_tracks(time_range=sp_range, limit=5)
-        topSongsDataRange = {}
-        for id, song in enumerate(topSongs["items"]):
-            topSongsDataRange[id] = {
-                "name": song["name"],
-                "artist": song["artists"][0]["name"],
-                "image": song["album"]["images"][0]["url"],
-            }
-            print(
-                id,
-                song["name"],
-                "//",
-                song["artists"][0]["name"],
-                song["album"]["images"][0]["url"],
-            )
+        topSongsData[sp_range] = get_user_top_songs_range(sp, sp_range)
         print()
-        topSongsData[sp_range] = topSongsDataRange
     return topSongsData
 
 
+def plan_saved_albums():
+    # Plan of User's Last Saved Albums names and cover art and artists names
+    with metrics.timer("spotify_saved_albums"):
+        savedAlbums = yield from plan_items(
+            "current_user_saved_albums", statsModel.get_section_size("last_albums")
+        )
+        return parse_saved_albums(savedAlbums)
+
+
 def get_user_last_listenedTo_albums(sp: spotipy.Spotify) -> dict:
     # Get User's Last Saved Albums names and cover art and artists names
+    return run_plan(sp, plan_saved_albums())
+
+
+def parse_saved_albums(savedAlbums: list) -> dict:
+    # Get the names, cover art and artists names of Spotify saved album objects, by rank
     lastSavedAlbumsData = {}
     print("|====== Last Played Albums ======|")
-    savedAlbums = sp.current_user_saved_albums(limit=3)
-    for id, item in enumerate(savedAlbums["items"]):
+    for id, item in enumerate(savedAlbums):
         album = item["album"]
         lastSavedAlbumsData[id] = {
             "name": album["name"],
             "artist": album["artists"][0]["name"],
-            "image": album["images"][0]["url"],
+            "image": pick_image_url(album["images"]),
         }
         print(
             id,
             album["name"],
             "//",
             album["artists"][0]["name"],
-            album["images"][0]["url"],
+            pick_image_url(album["images"]),
         )
     print()
     return lastSavedAlbumsData
 
 
-def get_user_data(sp: spotipy.Spotify) -> dict:
+def get_last_albums_source() -> str:
+    # Where the last albums come from: "saved" (the last saved albums, default)
+    # or "recently_played" (the albums of the last played tracks), set with LAST_ALBUMS_SOURCE
+    source = os.environ.get("LAST_ALBUMS_SOURCE", "saved")
+    if source not in ("saved", "recently_played"):
+        raise ValueError(f"Unknown LAST_ALBUMS_SOURCE: {source}")
+    return source
+
+
+def get_history_ttl() -> int:
+    # How long the recently played history is kept without being refreshed (in seconds)
+    return int(os.environ.get("RECENTLY_PLAYED_HISTORY_TTL", 30 * 24 * 60 * 60))
+
+
+@metrics.timed("spotify_recently_played")
+def get_user_recently_played_albums(
+    sp: spotipy.Spotify, history_store=None, num_albums: int = None
+) -> dict:
+    # Get User's Last Played Albums names, cover art and artists names from the recently played tracks
+    # Collected incrementally: only the plays after the newest known one (the after cursor) are
+    # downloaded, then merged into the history kept in history_store (the stats cache by default)
+    if history_store is None:
+        history_store = statsCache.get_cache()
+    if num_albums is None:
+        num_albums = statsModel.get_section_size("last_albums")
+    history = history_store.get(RECENTLY_PLAYED_HISTORY_KEY) or {"after": None, "albums": []}
+
+    recentlyPlayed = sp.current_user_recently_played(limit=50, after=history["after"])
+    albums = {album["id"]: album for album in history["albums"]}
+    for item in recentlyPlayed["items"]:
+        album = item["track"]["album"]
+        knownAlbum = albums.get(album["id"])
+        # ISO 8601 timestamps in the same format compare in chronological order
+        if knownAlbum is not None and knownAlbum["played_at"] >= item["played_at"]:
+            continue
+        albums[album["id"]] = {
+            "id": album["id"],
+            "name": album["name"],
+            "artist": album["artists"][0]["name"] if album["artists"] else "Unknown",
+            "image": pick_image_url(album["images"]) if album["images"] else None,
+            "played_at": item["played_at"],
+        }
+
+    lastPlayedAlbums = sorted(albums.values(), key=lambda album: album["played_at"], reverse=True)
+    cursors = recentlyPlayed.get("cursors") or {}
+    history_store.set(
+        RECENTLY_PLAYED_HISTORY_KEY,
+        {
+            # Without new plays there is no cursor, the previous one is kept
+            "after": cursors.get("after") or history["after"],
+            "albums": lastPlayedAlbums[:RECENTLY_PLAYED_HISTORY_SIZE],
+        },
+        get_history_ttl(),
+    )
+
+    lastPlayedAlbumsData = {}
+    print("|====== Last Played Albums ======|")
+    print(f"{len(recentlyPlayed['items'])} new plays")
+    for id, album in enumerate(lastPlayedAlbums[:num_albums]):
+        lastPlayedAlbumsData[id] = {
+            "name": album["name"],
+            "artist": album["artist"],
+            "image": album["image"],
+        }
+        print(id, album["name"], "//", album["artist"], album["image"])
+    print()
+    return lastPlayedAlbumsData
+
+
+class CollectionError(Exception):
+    # Raised when some sections could not be collected
+    # errors maps each failed section to its exception, data holds the slices that succeeded
+
+    def __init__(self, errors: dict, data: dict):
+        self.errors = errors
+        self.data = data
+        failed = ", ".join(f"{section}: {error!r}" for section, error in errors.items())
+        super().__init__(f"Could not collect {failed}")
+
+    @property
+    def retry_after(self) -> float:
+        # Seconds until every failed section can be collected again when they all failed
+        # because of the rate limit (see rateLimiter), None if some failed for another reason
+        if not all(isinstance(e, rateLimiter.RateLimitedError) for e in self.errors.values()):
+            return None
+        return max(e.retry_after for e in self.errors.values())
+
+
+def get_slices(sections: list = None, ranges: list = None) -> list:
+    # List the (section, range) slices of the stats, last_albums has no time range
+    if sections is None:
+        sections = SECTIONS
+    if ranges is None:
+        ranges = TIME_RANGES
+    slices = []
+    for section in SECTIONS:
+        if section not in sections:
+            continue
+        if section == "last_albums":
+            slices.append((section, None))
+        else:
+            slices.extend((section, sp_range) for sp_range in TIME_RANGES if sp_range in ranges)
+    return slices
+
+
+def _slice_request(section: str, sp_range: str, history_store=None):
+    # Get the (function, args) API request collecting a slice
+    if section == "top_artists":
+        return get_user_top_artists_range, (sp_range,)
+    if section == "top_songs":
+        return get_user_top_songs_range, (sp_range,)
+    if section == "last_albums":
+        if get_last_albums_source() == "recently_played":
+            return get_user_recently_played_albums, (history_store,)
+        return get_user_last_listenedTo_albums, ()
+    raise ValueError(f"Unknown stats section: {section}")
+
+
+def plan_slice(section: str, sp_range: str):
+    # Get the plan collecting a slice, None for the recently played albums, which are collected
+    # with the history kept in the cache (see get_user_recently_played_albums and collect_slice)
+    if section == "top_artists":
+        return plan_top_artists(sp_range)
+    if section == "top_songs":
+        return plan_top_songs(sp_range)
+    if section == "last_albums" and get_last_albums_source() == "saved":
+        return plan_saved_albums()
+    if section == "last_albums":
+        return None
+    raise ValueError(f"Unknown stats section: {section}")
+
+
+def collect_slice(sp: spotipy.Spotify, section: str, sp_range: str, history_store=None):
+    # Collect a single slice with a spotipy client
+    function, args = _slice_request(section, sp_range, history_store)
+    return function(sp, *args)
+
+
+def _set_slice(userDataJson: dict, section: str, sp_range: str, sliceData):
+    if sp_range is None:
+        userDataJson[section] = sliceData
+    else:
+        userDataJson.setdefault(section, {})[sp_range] = sliceData
+
+
+def _get_slice(userDataJson: dict, section: str, sp_range: str):
+    if sp_range is None:
+        return userDataJson.get(section)
+    return userDataJson.get(section, {}).get(sp_range)
+
+
+# Order the sections and ranges of the user data like the full collection does
+def _ordered(userDataJson: dict, slices: list) -> dict:
+    orderedData = {}
+    for section, sp_range in slices:
+        _set_slice(orderedData, section, sp_range, _get_slice(userDataJson, section, sp_range))
+    return orderedData
+
+
+def collect_slices_concurrently(
+    sp: spotipy.Spotify, slices: list, max_workers: int = None, history_store=None
+) -> dict:
+    # Collect the requested slices with every API request running in parallel
+    # Raises CollectionError with the partial data if any slice failed
+    # history_store keeps the recently played history (see get_user_recently_played_albums)
+    # Every request goes through the rate limiter shared by the process (see rateLimiter)
+    if max_workers is None:
+        max_workers = int(os.environ.get("STATS_COLLECTOR_WORKERS", "5"))
+    sp = rateLimiter.limit(sp)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(slices)))) as executor:
+        # Stages timed in the workers count for the request that started the collection
+        futures = [
+            executor.submit(metrics.propagate(collect_slice), sp, section, sp_range, history_store)
+            for section, sp_range in slices
+        ]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+    return merge_slices(slices, results)
+
+
+def merge_slices(slices: list, results: list) -> dict:
+    # Put collected slices together, results holds the data or the exception of each slice
+    # Raises CollectionError with the partial data if any slice failed
+    userDataJson = {}
+    errors = {}
+    for (section, sp_range), sliceData in zip(slices, results):
+        if isinstance(sliceData, Exception):
+            print(f"Error collecting {section} {sp_range or ''}: {sliceData}")
+            metrics.inc("upstream_errors_total", {"upstream": "spotify", "section": section})
+            errors[section] = sliceData
+            continue
+        _set_slice(userDataJson, section, sp_range, sliceData)
+
+    if errors:
+        raise CollectionError(errors, userDataJson)
+    return _ordered(userDataJson, slices)
+
+
+def get_user_data_concurrently(
+    sp: spotipy.Spotify, sections: list = None, max_workers: int = None
+) -> dict:
+    # Collect the requested sections with every API request running in parallel
+    return collect_slices_concurrently(sp, get_slices(sections), max_workers)
+
+
+def get_user_data(sp: spotipy.Spotify, concurrent: bool = False) -> dict:
     # Collect all user data and store it in a dictionnary to create a JSON file later
+    if concurrent:
+        return get_user_data_concurrently(sp)
+
     userDataJson = {}
 
     artistsData = get_user_top_artists(sp)
@@ -114,16 +529,312 @@ def get_user_data(sp: spotipy.Spotify) -> dict:
     songsData = get_user_top_songs(sp)
     userDataJson["top_songs"] = songsData
 
-    lastAlbums = get_user_last_listenedTo_albums(sp)
-    userDataJson["last_albums"] = lastAlbums
+    userDataJson["last_albums"] = collect_slice(sp, "last_albums", None)
     return userDataJson
 
 
+def _slice_cache_key(section: str, sp_range: str) -> str:
+    if sp_range is None:
+        return f"section:{section}"
+    return f"section:{section}:{sp_range}"
+
+
+def _cache_slices(cache, userDataJson: dict, user: str = None):
+    # Slices are stored with the time they were fetched and kept past their TTL
+    # for STATS_STALE_TTL seconds, so stale data can still be served while refreshing
+    # Items are stored as compact rows (see statsModel) rather than dicts
+    # Every slice is also saved as a new snapshot of the user (see snapshotStore)
+    fetchedAt = time.time()
+    snapshots = []
+    for section, sectionData in userDataJson.items():
+        if section == "last_albums":
+            slicesData = [(None, sectionData)]
+        else:
+            slicesData = sectionData.items()
+        for sp_range, sliceData in slicesData:
+            records = statsModel.from_legacy(section, sliceData)
+            cache.set(
+                _slice_cache_key(section, sp_range),
+                {"fetched_at": fetchedAt, "rows": statsModel.to_rows(records)},
+                statsCache.get_section_ttl(section) + statsCache.get_stale_ttl(),
+            )
+            snapshots.append((section, sp_range, records))
+
+    store = snapshotStore.get_store()
+    if snapshots and store is not None:
+        store.save_slices(user, snapshots, fetchedAt)
+
+
+def _read_snapshot(cache, section: str, sp_range: str, user: str = None):
+    # Get the cache entry of a slice from its newest snapshot, None if there is none
+    # The entry is put back in the cache, so a new instance only reads each snapshot once
+    store = snapshotStore.get_store()
+    if store is None:
+        return None
+    snapshot = store.load_slice(user, section, sp_range)
+    if snapshot is None:
+        return None
+    records, fetchedAt = snapshot
+    entry = {"fetched_at": fetchedAt, "rows": statsModel.to_rows(records)}
+    # Snapshots older than the stale TTL are still the last known good data, kept until refreshed
+    sectionTtl = statsCache.get_section_ttl(section)
+    ttl = sectionTtl + statsCache.get_stale_ttl() - (time.time() - fetchedAt)
+    cache.set(_slice_cache_key(section, sp_range), entry, int(max(ttl, sectionTtl)))
+    return entry
+
+
+def _read_cached_slice(cache, section: str, sp_range: str, user: str = None):
+    # Returns the (records, is_stale) of a cached slice, (None, False) if it isn't cached
+    # Slices missing from the cache are read from the snapshots of the user
+    entry = cache.get(_slice_cache_key(section, sp_range))
+    if entry is None:
+        entry = _read_snapshot(cache, section, sp_range, user)
+    if entry is None:
+        return None, False
+    age = time.time() - entry["fetched_at"]
+    if "rows" in entry:
+        sliceData = statsModel.from_rows(section, entry["rows"])
+    else:
+        sliceData = entry["data"]  # Cached before the compact model
+    return sliceData, age > statsCache.get_section_ttl(section)
+
+
+def refresh_slices(slices: list = None, cache=None, user: str = None) -> dict:
+    # Collect slices from Spotify even if they are cached and store them in the cache
+    # Raises CollectionError if some slices failed, the others are still cached
+    # With a user key, the slices of that tenant are collected and cached under its own keys
+    if slices is None:
+        slices = get_slices()
+    if cache is None:
+        cache = statsCache.get_cache()
+    cache = tenants.get_tenant_cache(cache, user)
+    try:
+        userDataJson = collect_slices_concurrently(
+            get_tenant_client(user), slices, history_store=cache
+        )
+    except CollectionError as e:
+        _cache_slices(cache, e.data, user)
+        raise
+    _cache_slices(cache, userDataJson, user)
+    return userDataJson
+
+
+# (user, slice) currently being refreshed in the background
+_refreshing_slices = set()
+_refreshing_slices_lock = threading.Lock()
+
+
+def refresh_slices_in_background(
+    slices: list, cache=None, user: str = None
+) -> threading.Thread:
+    # Collect slices in a background thread, slices already being refreshed are skipped
+    if cache is None:
+        cache = statsCache.get_cache()
+    with _refreshing_slices_lock:
+        slices = [s for s in slices if (user, s) not in _refreshing_slices]
+        _refreshing_slices.update((user, s) for s in slices)
+    if not slices:
+        return None
+
+    def refresh():
+        try:
+            # Background refreshes let requests waiting on Spotify go first
+            with rateLimiter.priority(rateLimiter.BACKGROUND):
+                refresh_slices(slices, cache, user)
+        except Exception as e:
+            print(f"Background refresh failed: {e}")
+        finally:
+            with _refreshing_slices_lock:
+                _refreshing_slices.difference_update((user, s) for s in slices)
+
+    thread = threading.Thread(target=refresh, daemon=True)
+    thread.start()
+    return thread
+
+
+# Slices being collected by a request, keyed by (user, section, range)
+_slice_flights = singleFlight.Group("stats")
+
+
+class SliceClaim:
+    # Slices of a user a request is about to collect, claimed so that concurrent requests, sync or async,
+    # share a single collection of each slice (see singleFlight): the request collects own_slices itself,
+    # then publishes them or aborts them if it failed, and waits on the others
+    # The (data, errors) of the claimed slices are gathered in data and errors
+
+    def __init__(self, slices: list, user: str = None):
+        self.user = user
+        self._own, others = _slice_flights.claim(
+            [(user, section, sp_range) for section, sp_range in slices]
+        )
+        self.own_slices = [(section, sp_range) for _, section, sp_range in self._own]
+        self._others = {(section, sp_range): call for (_, section, sp_range), call in others.items()}
+        self.data = {}
+        self.errors = {}
+
+    def publish(self, cache, ownData: dict, errors: dict):
+        # Cache the own slices and share them with the requests waiting on them
+        # Keep what was collected so the next request only retries the failed slices
+        self.errors.update(errors)
+        _cache_slices(cache, ownData, self.user)
+        for section, sp_range in self.own_slices:
+            sliceData = _get_slice(ownData, section, sp_range)
+            if sliceData is None:
+                _slice_flights.resolve((self.user, section, sp_range), error=errors[section])
+            else:
+                _slice_flights.resolve((self.user, section, sp_range), sliceData)
+                _set_slice(self.data, section, sp_range, sliceData)
+
+    def abort(self, error: Exception):
+        # Fail the own slices that were not published, so their waiters don't hang
+        for key, call in self._own.items():
+            if not call.done():
+                _slice_flights.resolve(key, error=error)
+
+    def wait(self):
+        # Wait on the slices collected by other requests
+        for (section, sp_range), call in self._others.items():
+            try:
+                _set_slice(self.data, section, sp_range, call.wait())
+            except Exception as e:
+                self.errors[section] = e
+
+    async def wait_async(self):
+        # Same as wait without blocking the event loop
+        for (section, sp_range), call in self._others.items():
+            try:
+                _set_slice(self.data, section, sp_range, await call.wait_async())
+            except Exception as e:
+                self.errors[section] = e
+
+
+def _collect_missing_slices(slices: list, cache, user: str = None) -> tuple:
+    # Collect slices from Spotify and cache them, returns the (data, errors) of the slices
+    # Slices another request is already collecting are not requested again, its result is waited on
+    # instead, so the images of a README loaded at once share a single cold collection
+    claim = SliceClaim(slices, user)
+    try:
+        if claim.own_slices:
+            errors = {}
+            try:
+                ownData = collect_slices_concurrently(
+                    get_tenant_client(user), claim.own_slices, history_store=cache
+                )
+            except CollectionError as e:
+                ownData, errors = e.data, e.errors
+            claim.publish(cache, ownData, errors)
+    except Exception as e:
+        claim.abort(e)
+        raise
+    claim.wait()
+    return claim.data, claim.errors
+
+
+def _read_cached_slices(cache, slices: list, user: str = None) -> tuple:
+    # Read the slices from the cache, returns the (data, stale data, missing slices) of the slices
+    # With STATS_SERVE_STALE, stale slices are part of the data and refreshed in the background,
+    # otherwise they are missing and their stale data is only used if they can't be collected
+    userDataJson = {}
+    staleData = {}
+    missingSlices = []
+    for section, sp_range in slices:
+        cachedData, isStale = _read_cached_slice(cache, section, sp_range, user)
+        if cachedData is None:
+            metrics.cache_lookup("stats", "miss")
+            missingSlices.append((section, sp_range))
+        elif isStale:
+            metrics.cache_lookup("stats", "stale")
+            staleData[(section, sp_range)] = cachedData
+        else:
+            metrics.cache_lookup("stats", "hit")
+            _set_slice(userDataJson, section, sp_range, cachedData)
+
+    if staleData and statsCache.serve_stale_enabled():
+        for (section, sp_range), sliceData in staleData.items():
+            _set_slice(userDataJson, section, sp_range, sliceData)
+        refresh_slices_in_background(list(staleData), cache, user)
+    else:
+        missingSlices += list(staleData)
+    return userDataJson, staleData, missingSlices
+
+
+def _add_collected_slices(
+    userDataJson: dict, missingSlices: list, collectedData: dict, errors: dict, staleData: dict
+):
+    # Add the collected slices to the data, slices that failed fall back to their stale data
+    # Raises CollectionError if a slice failed and was not cached at all
+    for section, sp_range in missingSlices:
+        if _get_slice(collectedData, section, sp_range) is not None:
+            continue
+        # Stale data is still better than an error
+        if (section, sp_range) not in staleData:
+            raise CollectionError(errors, collectedData)
+        print(f"Serving stale {section} {sp_range or ''}: {errors[section]}")
+        _set_slice(collectedData, section, sp_range, staleData[(section, sp_range)])
+    for section, sp_range in missingSlices:
+        sliceData = _get_slice(collectedData, section, sp_range)
+        _set_slice(userDataJson, section, sp_range, sliceData)
+
+
+def _shape_slices(userDataJson: dict, slices: list, compact: bool) -> dict:
+    # Cached slices are records, collected ones are legacy dicts
+    for section, sp_range in slices:
+        sliceData = _get_slice(userDataJson, section, sp_range)
+        if compact:
+            sliceData = statsModel.as_records(section, sliceData)
+        elif not isinstance(sliceData, dict):
+            sliceData = statsModel.to_legacy(sliceData)
+        _set_slice(userDataJson, section, sp_range, sliceData)
+    return _ordered(userDataJson, slices)
+
+
+def plan_collect_slices(slices: list, cache, user: str = None, compact: bool = False):
+    # Plan of collect_slices with the cache of the user: yields the slices missing from the cache
+    # and is sent their (data, errors), see _collect_missing_slices
+    userDataJson, staleData, missingSlices = _read_cached_slices(cache, slices, user)
+    if missingSlices:
+        collectedData, errors = yield missingSlices
+        _add_collected_slices(userDataJson, missingSlices, collectedData, errors, staleData)
+    return _shape_slices(userDataJson, slices, compact)
+
+
+def collect_slices(slices: list, cache=None, user: str = None, compact: bool = False) -> dict:
+    # Serve the requested slices from the cache, Spotify is only called for the slices that expired
+    # With STATS_SERVE_STALE (the default), expired slices are served right away
+    # and refreshed in the background, so only a cold cache waits on Spotify
+    # With a user key, the stats of that tenant are served (see tenants)
+    # With compact, each slice is a tuple of records (see statsModel) instead of the legacy dict
+    if cache is None:
+        cache = statsCache.get_cache()
+    cache = tenants.get_tenant_cache(cache, user)
+    return requestPlans.run(
+        plan_collect_slices(slices, cache, user, compact),
+        lambda missingSlices: _collect_missing_slices(missingSlices, cache, user),
+    )
+
+
+def collect(
+    sections: list = None,
+    ranges: list = None,
+    cache=None,
+    user: str = None,
+    compact: bool = False,
+) -> dict:
+    # Demand driven collection: only the requested sections and ranges are fetched (or read
+    # from the cache), e.g. collect(["last_albums"]) only calls the saved albums endpoint
+    return collect_slices(get_slices(sections, ranges), cache, user, compact)
+
+
+def get_cached_user_data(cache=None, user: str = None) -> dict:
+    # Serve all the user data from the cache, Spotify is only called for the slices that expired
+    return collect(cache=cache, user=user)
+
+
 def main():
     # Setup Spotify Client, collect all relevent info and return a JSON output
     spClient = setup_spotify_client()
 
-    data = get_user_data(spClient)
+    data = get_user_data(spClient, concurrent=True)
 
     # json_data = json.dumps(data)
     # print(json_data)
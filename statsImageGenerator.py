@@ -1,23 +1,219 @@
 import base64
-import requests
 import html
+import os
+import time
+from io import BytesIO
+from collections import Counter
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait
+import httpSessions
+import imageCache
+import metrics
+import requestPlans
+import singleFlight
+import snapshotStore
+import statsCache
+import statsModel
+import svgTemplates
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional, images are embedded as downloaded without it
+    Image = None
+
+# Bump when the SVG layout changes so cached renders and ETags are invalidated
+RENDER_VERSION = "2"
+
+# Section of the stats each section of the infographic is rendered from
+SECTION_STATS_KEYS = {
+    "artists": "top_artists",
+    "top_songs": "top_songs",
+    "last_albums": "last_albums",
+}
+
+# Every (section_type, time_range) variant served by /stats, last_albums has no time range
+STATS_VARIANTS = [
+    ("artists", "short_term"),
+    ("artists", "long_term"),
+    ("top_songs", "short_term"),
+    ("top_songs", "long_term"),
+    ("last_albums", "short_term"),
+]
+
+# Content types of the formats images can be re-encoded to
+IMAGE_FORMATS = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+# How long rendered SVGs are kept in the cache (in seconds)
+def get_render_ttl() -> int:
+    return int(os.environ.get("RENDER_CACHE_TTL", 24 * 60 * 60))
+
+
+# Get the size (in pixels) images are resized to for a card image of img_size
+# IMAGE_SCALE defaults to 2 to stay sharp on HiDPI screens, 0 disables resizing
+def get_image_render_size(img_size: int):
+    scale = float(os.environ.get("IMAGE_SCALE", "2"))
+    if scale <= 0:
+        return None
+    return int(img_size * scale)
+
+
+# Resize an image to a size x size square (center cropped like the SVG does) and re-encode it
+# Returns the new (content, content_type), or None if the original is already smaller
+def resize_image(content: bytes, size: int, image_format: str = None, quality: int = None):
+    if image_format is None:
+        image_format = os.environ.get("IMAGE_FORMAT", "JPEG").upper()
+    if quality is None:
+        quality = int(os.environ.get("IMAGE_QUALITY", "80"))
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unsupported image format: {image_format}")
+
+    with Image.open(BytesIO(content)) as img:
+        if img.width > size or img.height > size:
+            img = ImageOps.fit(img, (size, size), Image.LANCZOS)
+        if image_format == "JPEG" and img.mode != "RGB":
+            img = img.convert("RGB")
+        output = BytesIO()
+        img.save(output, format=image_format, quality=quality, optimize=True)
+
+    resized = output.getvalue()
+    if len(resized) >= len(content):
+        return None
+    return resized, IMAGE_FORMATS[image_format]
 
 
-# Fetch an image from URL and convert to base64 data URI to bypass Github hotlinking restrictions
-def fetch_image_as_base64(url):
+# Resize the image of a data URI, falls back to the original if it can't be processed
+def _resize_data_uri(data_uri: str, size: int) -> str:
+    header, img_base64 = data_uri.split(",", 1)
     try:
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
+        resized = resize_image(base64.b64decode(img_base64), size)
+    except Exception as e:
+        print(f"Error resizing image: {e}")
+        return data_uri
+    if resized is None:
+        return data_uri
+    content, content_type = resized
+    return f"data:{content_type};base64,{base64.b64encode(content).decode('utf-8')}"
+
+
+# Download an image and convert it to a base64 data URI, None if the download failed
+def _download_image_as_base64(url):
+    try:
+        # Shared keep-alive session, so images reuse open connections to the CDN
+        with metrics.timer("image_download"):
+            response = httpSessions.get_session("images").get(url, timeout=5)
+            response.raise_for_status()
         img_base64 = base64.b64encode(response.content).decode("utf-8")
 
         # Determine image type from URL or content-type
         content_type = response.headers.get("content-type", "image/jpeg")
         return f"data:{content_type};base64,{img_base64}"
     except Exception as e:
+        metrics.inc("upstream_errors_total", {"upstream": "images"})
         print(f"Error fetching image from {url}: {e}")
         return None
 
 
+# Plan (see requestPlans) of the original image of a URL, from the image cache or downloaded:
+# yields the URL to download and is sent its data URI, returns (data_uri, cache_hit)
+# Originals that are only downloaded to be resized are kept out of the snapshot store (persist=False)
+def _plan_original_image(cache, url, persist: bool = True):
+    data_uri = cache.get(url)
+    if data_uri is not None:
+        return data_uri, True
+    data_uri = yield url
+    if data_uri is not None:
+        cache.set(url, data_uri, persist=persist)
+    return data_uri, False
+
+
+# Images being fetched, keyed by (url, size), shared with the async pipeline (see asyncPipeline)
+image_flights = singleFlight.Group("images")
+
+
+# Fetch an image from URL and convert to base64 data URI to bypass Github hotlinking restrictions
+# If size is given the image is downscaled to size x size pixels before being encoded
+# Encoded images are cached by URL so the same artists and covers are only downloaded once,
+# and concurrent requests for an image that is being fetched wait for it instead of downloading it again
+def fetch_image_as_base64(url, size: int = None):
+    return image_flights.do((url, size), _fetch_image_as_base64, url, size)
+
+
+# Key of the resized image of a URL in the image cache, None if images are not resized
+# The resized image is cached next to the original, under its own key
+def get_resized_image_key(url, size: int = None):
+    if not size or Image is None:
+        return None
+    imageFormat = os.environ.get("IMAGE_FORMAT", "JPEG").upper()
+    imageQuality = os.environ.get("IMAGE_QUALITY", "80")
+    return f"{url}#{size}:{imageFormat}:{imageQuality}"
+
+
+# Plan of fetch_image_as_base64: yields the URL of the image to download and is sent its data URI
+# The image cache lookups and the resizing are shared by the sync and the async pipelines
+def plan_image(url, size: int = None):
+    cache = imageCache.get_image_cache()
+    resizedKey = get_resized_image_key(url, size)
+    if resizedKey is not None:
+        data_uri = cache.get(resizedKey)
+        metrics.cache_lookup("images", "miss" if data_uri is None else "hit")
+        if data_uri is None:
+            data_uri, _ = yield from _plan_original_image(cache, url, persist=False)
+            if data_uri is None:
+                return None
+            with metrics.timer("image_resize"):
+                data_uri = _resize_data_uri(data_uri, size)
+            cache.set(resizedKey, data_uri)
+        return data_uri
+
+    data_uri, cacheHit = yield from _plan_original_image(cache, url)
+    metrics.cache_lookup("images", "hit" if cacheHit else "miss")
+    return data_uri
+
+
+def _fetch_image_as_base64(url, size: int = None):
+    return requestPlans.run(plan_image(url, size), _download_image_as_base64)
+
+
+# Start fetching several images concurrently with IMAGE_FETCH_WORKERS threads
+# Returns the executor and a dict mapping each URL to the future of its data URI
+def submit_image_fetches(urls, max_workers: int = None, size: int = None) -> tuple:
+    uniqueUrls = list(dict.fromkeys(url for url in urls if url))
+    if max_workers is None:
+        max_workers = int(os.environ.get("IMAGE_FETCH_WORKERS", "10"))
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(uniqueUrls))))
+    futures = {
+        url: executor.submit(metrics.propagate(fetch_image_as_base64), url, size)
+        for url in uniqueUrls
+    }
+    return executor, futures
+
+
+# Fetch several images concurrently, returns a dict mapping each URL to its data URI
+# Images that are not downloaded before the deadline (in seconds) are mapped to None
+def fetch_images_as_base64(
+    urls, deadline: float = None, max_workers: int = None, size: int = None
+) -> dict:
+    if not any(urls):
+        return {}
+    if deadline is None:
+        deadline = float(os.environ.get("IMAGE_FETCH_DEADLINE", "8"))
+
+    executor, futures = submit_image_fetches(urls, max_workers, size)
+    done, _ = wait(futures.values(), timeout=deadline)
+    # Don't wait for late downloads, they finish in the background and are discarded
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    images = {}
+    for url, future in futures.items():
+        if future in done:
+            images[url] = future.result()
+        else:
+            print(f"Image {url} missed the {deadline}s deadline, using placeholder")
+            images[url] = None
+    return images
+
+
 # Wrap text to fit within max_width characters, returns list of lines
 def wrap_text(text, max_width):
     words = text.split()
@@ -48,22 +244,279 @@ def escape_xml(text):
     return html.escape(text, quote=False)
 
 
-# Create an SVG infographic for the requested content type and time range
-def create_spotify_infographic(
-    stats_data: dict, section_type: str = "artists", time_range: str = "short_term"
+# Get the (num_columns, num_items, card_width, card_height) layout of a section
+# Items that don't fit in a row wrap to the next ones
+def get_section_layout(section_type: str) -> tuple:
+    if section_type == "last_albums":
+        return 3, statsModel.get_section_size("last_albums"), 150, 210
+    if section_type == "top_songs":
+        return 5, statsModel.get_section_size("top_songs"), 130, 190
+    return 5, statsModel.get_section_size("top_artists"), 130, 190  # artists
+
+
+# Get the part of the stats a section of the infographic is rendered from
+def get_section_data(
+    stats_data: dict, section_type: str, time_range: str = "short_term"
+) -> dict:
+    sp_range = "short_term" if time_range == "short_term" else "long_term"
+    if section_type == "artists":
+        return stats_data.get("top_artists", {}).get(sp_range, {})
+    if section_type == "top_songs":
+        return stats_data.get("top_songs", {}).get(sp_range, {})
+    if section_type == "last_albums":
+        return stats_data.get("last_albums", {})
+    return None
+
+
+# Get the records (see statsModel) of the items of a section, whatever the shape of the stats
+def get_section_records(
+    stats_data: dict, section_type: str, time_range: str = "short_term"
+) -> tuple:
+    data = get_section_data(stats_data, section_type, time_range)
+    if data is None:
+        return None
+    return statsModel.as_records(SECTION_STATS_KEYS[section_type], data)
+
+
+# Get the strong ETag of an infographic, derived from the stats it is rendered from
+# and the settings that change its output, so it is known without rendering anything
+def get_infographic_etag(
+    stats_data: dict, section_type: str, time_range: str = "short_term"
 ) -> str:
+    sp_range = "short_term" if time_range == "short_term" else "long_term"
+    if section_type == "last_albums":
+        sp_range = None
+    records = get_section_records(stats_data, section_type, time_range) or ()
+    if records:
+        # Only the items that are rendered count
+        records = records[: get_section_layout(section_type)[1]]
+    return statsCache.content_hash(
+        [
+            RENDER_VERSION,
+            section_type,
+            sp_range,
+            # Hashed as rows, so both shapes of the same stats get the same ETag
+            statsModel.to_rows(records),
+            os.environ.get("IMAGE_SCALE", "2"),
+            os.environ.get("IMAGE_FORMAT", "JPEG"),
+            os.environ.get("IMAGE_QUALITY", "80"),
+        ]
+    )
 
-    # Determine number of items and columns based on section type
+
+# Key of a rendered SVG in the stats cache
+def get_render_cache_key(
+    stats_data: dict, section_type: str, time_range: str = "short_term"
+) -> str:
+    return f"svg:{section_type}:{get_infographic_etag(stats_data, section_type, time_range)}"
+
+
+# Get an already rendered SVG from the stats cache, None if it was not rendered yet
+# Renders missing from the cache are read from the snapshot store (see snapshotStore)
+def get_cached_render(
+    stats_data: dict,
+    section_type: str = "artists",
+    time_range: str = "short_term",
+    cache=None,
+) -> str:
+    if cache is None:
+        cache = statsCache.get_cache()
+    renderKey = get_render_cache_key(stats_data, section_type, time_range)
+    svgImage = cache.get(renderKey)
+    store = snapshotStore.get_store()
+    if svgImage is None and store is not None:
+        svgImage = store.get_render(renderKey)
+        if svgImage is not None:
+            cache.set(renderKey, svgImage, get_render_ttl())
+    metrics.cache_lookup("renders", "miss" if svgImage is None else "hit")
+    return svgImage
+
+
+# Keep a render in the stats cache and in the snapshot store
+def cache_render(
+    stats_data: dict, section_type: str, time_range: str, svg_image: str, cache=None
+):
+    if cache is None:
+        cache = statsCache.get_cache()
+    renderKey = get_render_cache_key(stats_data, section_type, time_range)
+    cache.set(renderKey, svg_image, get_render_ttl())
+    store = snapshotStore.get_store()
+    if store is not None:
+        store.set_render(renderKey, svg_image)
+
+
+# Same as create_spotify_infographic, but rendered SVGs are kept in the stats cache
+# and only rendered again when the stats they are built from change
+# Downloads the images itself so renders with missing images are not cached
+def get_cached_infographic(
+    stats_data: dict,
+    section_type: str = "artists",
+    time_range: str = "short_term",
+    cache=None,
+) -> str:
+    return render_cached_infographic(stats_data, section_type, time_range, cache)[0]
+
+
+# Same as get_cached_infographic, returns the (svg, complete) of the render, complete is False
+# when an image is missing, so the response is not kept by the HTTP caches either
+def render_cached_infographic(
+    stats_data: dict,
+    section_type: str = "artists",
+    time_range: str = "short_term",
+    cache=None,
+) -> tuple:
+    if cache is None:
+        cache = statsCache.get_cache()
+    return requestPlans.run(
+        plan_cached_infographic(stats_data, section_type, time_range, cache),
+        lambda request: fetch_images_as_base64(request[0], size=request[1]),
+    )
+
+
+# Plan of render_cached_infographic: yields the (urls, size) of the images of the render
+# and is sent the dict mapping each URL to its data URI (see fetch_images_as_base64)
+def plan_cached_infographic(stats_data: dict, section_type: str, time_range: str, cache):
+    svgImage = get_cached_render(stats_data, section_type, time_range, cache=cache)
+    if svgImage is not None:
+        return svgImage, True
+
+    records = get_section_records(stats_data, section_type, time_range)
+    if records is None:
+        return None, False
+    num_columns, num_items, card_width, card_height = get_section_layout(section_type)
+    imageUrls = [record.image for record in records[:num_items]]
+    images = yield imageUrls, get_image_render_size(card_width - 16)
+    svgImage = create_spotify_infographic(
+        stats_data, section_type, time_range, images=images
+    )
+    # Renders with placeholders for images that failed are not kept, the next request retries them
+    complete = all(images.values())
+    if complete:
+        cache_render(stats_data, section_type, time_range, svgImage, cache)
+    return svgImage, complete
+
+
+# Get the SVG fragment of the title and subtitle of a card
+# Cached, as the same names are rendered again and again at the same positions
+@lru_cache(maxsize=1024)
+def render_card_texts(center_x, text_y, name, subtitle, max_chars) -> str:
+    # Wrap text instead of truncating
+    name_lines = wrap_text(name, max_chars)
+    subtitle_lines = wrap_text(subtitle, max_chars)
+    parts = []
+
+    # Title (up to 2 lines)
+    for line_idx, line in enumerate(name_lines):
+        parts.append(
+            svgTemplates.render_card_text(
+                center_x=center_x,
+                line_y=text_y + (line_idx * 13),
+                text_class="card-title",
+                text=escape_xml(line),
+            )
+        )
+
+    # Subtitle (artist/genre - 1 line)
+    subtitle_y = text_y + (len(name_lines) * 13) + 10
+    if subtitle_lines:
+        parts.append(
+            svgTemplates.render_card_text(
+                center_x=center_x,
+                line_y=subtitle_y,
+                text_class="card-subtitle",
+                text=escape_xml(subtitle_lines[0]),
+            )
+        )
+    return "".join(parts)
+
+
+# Get the SVG fragments of a single card
+# Images shown by several cards are embedded once: image_id names the shared image, which is
+# defined by the card given its base64_image and only referenced by the cards given None
+def render_card(
+    x, y, card_width, card_height, name, subtitle, max_chars, base64_image, image_id=None
+) -> list:
+    # Image dimensions
+    img_size = card_width - 16
+    img_y_offset = 8
+    center_x = x + card_width / 2
+
+    parts = [svgTemplates.render_card_start(x, y, card_width, card_height)]
+
+    # Embed image as base64 if available, placeholder if there is no image or the fetch failed
+    if image_id is not None:
+        if base64_image:
+            parts += (
+                svgTemplates.render_image_def_start(image_id, img_size),
+                base64_image,
+                svgTemplates.IMAGE_DEF_END,
+            )
+        parts.append(
+            svgTemplates.render_image_use(image_id=image_id, image_x=x + 8, image_y=y + img_y_offset)
+        )
+    elif base64_image:
+        parts += (
+            svgTemplates.render_image_start(x + 8, y + img_y_offset, img_size),
+            base64_image,
+            svgTemplates.IMAGE_END,
+        )
+    else:
+        parts.append(
+            svgTemplates.render_placeholder(
+                x + 8,
+                y + img_y_offset,
+                img_size,
+                center_x,
+                y + img_y_offset + img_size / 2 + 5,
+            )
+        )
+
+    # Text section with wrapped text
+    text_y = y + img_y_offset + img_size + 18
+    parts.append(render_card_texts(center_x, text_y, name, subtitle, max_chars))
+    parts.append(svgTemplates.CARD_END)
+    return parts
+
+
+# Get the title of an infographic, None for unknown content types
+def get_infographic_title(section_type: str, time_range: str = "short_term") -> str:
+    if section_type == "artists":
+        if time_range == "short_term":
+            return "My Recent Top Artists"
+        return "My All-Time Top Artists"
+    if section_type == "top_songs":
+        if time_range == "short_term":
+            return "My Recent Top Songs"
+        return "My All-Time Top Songs"
     if section_type == "last_albums":
-        num_columns = 3
-        num_items = 3
-        card_width = 150
-        card_height = 210
-    else:  # artists or songs
-        num_columns = 5
-        num_items = 5
-        card_width = 130
-        card_height = 190
+        return "Last Played Albums"
+    return None
+
+
+# Whether /stats streams renders that are not cached yet, set STATS_STREAMING=0 to send them whole
+def streaming_enabled() -> bool:
+    return os.environ.get("STATS_STREAMING", "1") != "0"
+
+
+# Render an SVG infographic piece by piece: the header and title first, then each card, then the footer
+# Without images, the images are downloaded concurrently once the header is yielded, IMAGE_FETCH_WORKERS
+# (default 10) cards ahead of the card being yielded, and each card is yielded in order as soon as its
+# image is there. Only these images are held at a time, never the whole document. Images still missing
+# image_deadline seconds (IMAGE_FETCH_DEADLINE by default) after the header get the placeholder
+# Returns whether every image made it in, so callers can tell a complete render from a degraded one
+def iter_spotify_infographic(
+    stats_data: dict,
+    section_type: str = "artists",
+    time_range: str = "short_term",
+    image_deadline: float = None,
+    images: dict = None,
+):
+    title = get_infographic_title(section_type, time_range)
+    if title is None:
+        return
+
+    # Determine number of items and columns based on section type
+    num_columns, num_items, card_width, card_height = get_section_layout(section_type)
 
     # Calculate SVG dimensions - COMPACT
     padding = 12
@@ -72,204 +525,147 @@ def create_spotify_infographic(
     total_width = (
         (card_width * num_columns) + (card_spacing * (num_columns - 1)) + (padding * 2)
     )
-    total_height = card_height + title_height + padding
-
-    # SVG header with enhanced styles
-    svg_header = f"""<svg width="{total_width}" height="{total_height}" xmlns="http://www.w3.org/2000/svg">
-    <defs>
-        <style type="text/css">
-            .title {{ 
-                fill: #1DB954; 
-                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', 'Helvetica Neue', Arial, sans-serif; 
-                font-size: 22px; 
-                font-weight: 700; 
-            }}
-            .card-title {{ 
-                fill: #FFFFFF; 
-                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Arial, sans-serif; 
-                font-size: 11px; 
-                font-weight: 600;
-                line-height: 1.3;
-            }}
-            .card-subtitle {{ 
-                fill: #B3B3B3; 
-                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Arial, sans-serif; 
-                font-size: 9px; 
-                font-weight: 400; 
-            }}
-        </style>
-        <!-- Dark gradient background -->
-        <linearGradient id="bgGradient" x1="0%" y1="0%" x2="0%" y2="100%">
-            <stop offset="0%" style="stop-color:#1a1a1a;stop-opacity:1" />
-            <stop offset="100%" style="stop-color:#0a0a0a;stop-opacity:1" />
-        </linearGradient>
-        <!-- Card gradient -->
-        <linearGradient id="cardGradient" x1="0%" y1="0%" x2="0%" y2="100%">
-            <stop offset="0%" style="stop-color:#2a2a2a;stop-opacity:1" />
-            <stop offset="100%" style="stop-color:#1e1e1e;stop-opacity:1" />
-        </linearGradient>
-        <!-- Green accent gradient -->
-        <linearGradient id="accentGradient" x1="0%" y1="0%" x2="100%" y2="100%">
-            <stop offset="0%" style="stop-color:#1DB954;stop-opacity:0.15" />
-            <stop offset="100%" style="stop-color:#1ed760;stop-opacity:0.05" />
-        </linearGradient>
-        <!-- Subtle glow effect -->
-        <filter id="glow" x="-50%" y="-50%" width="200%" height="200%">
-            <feGaussianBlur in="SourceGraphic" stdDeviation="1" result="blur"/>
-            <feComponentTransfer in="blur" result="glow">
-                <feFuncA type="linear" slope="1.5"/>
-            </feComponentTransfer>
-            <feMerge>
-                <feMergeNode in="glow"/>
-                <feMergeNode in="SourceGraphic"/>
-            </feMerge>
-        </filter>
-        <!-- Card shadow -->
-        <filter id="cardShadow" x="-20%" y="-20%" width="140%" height="140%">
-            <feGaussianBlur in="SourceAlpha" stdDeviation="3"/>
-            <feOffset dx="0" dy="2" result="offsetblur"/>
-            <feComponentTransfer>
-                <feFuncA type="linear" slope="0.3"/>
-            </feComponentTransfer>
-            <feMerge>
-                <feMergeNode/>
-                <feMergeNode in="SourceGraphic"/>
-            </feMerge>
-        </filter>
-    </defs>
-    
-    <!-- Background with gradient -->
-    <rect width="{total_width}" height="{total_height}" fill="url(#bgGradient)"/>
-    """
-
-    # Title section (NO SUBTITLE IN HEADER)
-    svg_content = ""
-
-    if section_type == "artists":
-        if time_range == "short_term":
-            title = "My Recent Top Artists"
-            data = stats_data.get("top_artists", {}).get("short_term", {})
-        else:
-            title = "My All-Time Top Artists"
-            data = stats_data.get("top_artists", {}).get("long_term", {})
-
-    elif section_type == "top_songs":
-        if time_range == "short_term":
-            title = "My Recent Top Songs"
-            data = stats_data.get("top_songs", {}).get("short_term", {})
-        else:
-            title = "My All-Time Top Songs"
-            data = stats_data.get("top_songs", {}).get("long_term", {})
-
-    elif section_type == "last_albums":
-        title = "Last Played Albums"
-        data = stats_data.get("last_albums", {})
-    else:
-        return None
+    records = get_section_records(stats_data, section_type, time_range)[:num_items]
+    num_rows = max(1, -(-len(records) // num_columns))
+    total_height = (
+        (card_height * num_rows) + (card_spacing * (num_rows - 1)) + title_height + padding
+    )
 
-    # Add title with glow (NO SUBTITLE)
-    svg_content += f"""
-    <g filter="url(#glow)">
-        <text x="{padding}" y="32" class="title">{escape_xml(title)}</text>
-    </g>
-    """
+    yield svgTemplates.render_header(
+        total_width, total_height
+    ) + svgTemplates.render_title(padding=padding, title=escape_xml(title))
 
     # Create cards
     y_start = title_height
+    executor = None
+    if images is None:
+        if image_deadline is None:
+            image_deadline = float(os.environ.get("IMAGE_FETCH_DEADLINE", "8"))
+        deadlineTime = time.monotonic() + image_deadline
+        window = max(1, int(os.environ.get("IMAGE_FETCH_WORKERS", "10")))
+        executor = ThreadPoolExecutor(max_workers=window)
+        imageSize = get_image_render_size(card_width - 16)
+        pendingUrls = iter(dict.fromkeys(record.image for record in records if record.image))
+        futures = {}
+
+    # Start the downloads of the next images, so at most window of them are in flight or waiting for their card
+    def fill_window():
+        while len(futures) < window:
+            url = next(pendingUrls, None)
+            if url is None:
+                return
+            futures[url] = executor.submit(metrics.propagate(fetch_image_as_base64), url, imageSize)
+
+    # Wrap text instead of truncating
+    max_chars = 18 if section_type == "last_albums" else 16
+
+    # Images of several cards are fetched and embedded once, then referenced with <use>
+    sharedUrls = {
+        url for url, count in Counter(record.image for record in records).items() if url and count > 1
+    }
+    sharedImages = {}
+    complete = True
+
+    if executor is not None:
+        fill_window()
+    try:
+        for i, record in enumerate(records):
+            # Calculate position
+            row, col = divmod(i, num_columns)
+            x = padding + (col * (card_width + card_spacing))
+            y = y_start + (row * (card_height + card_spacing))
+
+            # Get item data, subtitle is the genre for artists and the artist name otherwise
+            if section_type == "artists":
+                subtitle = record.genre
+            else:
+                subtitle = record.artist
+            image_url = record.image
+
+            base64_image = None
+            image_id = None
+            if image_url in sharedImages:
+                image_id = sharedImages[image_url]
+            elif image_url and images is not None:
+                base64_image = images.get(image_url)
+            elif image_url:
+                # Every card waits against the same deadline, a slow image never delays it
+                # Its download is dropped once its card is rendered, the next one takes its place
+                fill_window()
+                future = futures.pop(image_url)
+                fill_window()
+                try:
+                    base64_image = future.result(timeout=max(0, deadlineTime - time.monotonic()))
+                except TimeoutError:
+                    print(f"Image {image_url} missed the {image_deadline}s deadline, using placeholder")
+            if image_url and image_id is None and not base64_image:
+                complete = False
+            if image_url in sharedUrls and image_id is None:
+                # Failed shared images are not fetched again, their cards all get the placeholder
+                image_id = sharedImages[image_url] = f"image-{len(sharedImages)}" if base64_image else None
+
+            yield "".join(
+                render_card(
+                    x,
+                    y,
+                    card_width,
+                    card_height,
+                    "Unknown" if record.name is None else record.name,
+                    "Unknown" if subtitle is None else subtitle,
+                    max_chars,
+                    base64_image,
+                    image_id,
+                )
+            )
+    finally:
+        # Late downloads finish in the background and are discarded, also when the client went away
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    yield svgTemplates.SVG_FOOTER
+    return complete
+
+
+# Same as iter_spotify_infographic, but once every image made it in, the render is kept like
+# get_cached_infographic keeps its renders, so the next requests send it whole
+# The streamed chunks are not kept, the render is built again by render_cached_infographic
+# from the images the stream left in the image cache, after the last chunk was sent
+def iter_cached_infographic(
+    stats_data: dict,
+    section_type: str = "artists",
+    time_range: str = "short_term",
+    cache=None,
+):
+    complete = yield from iter_spotify_infographic(stats_data, section_type, time_range)
+    if complete:
+        render_cached_infographic(stats_data, section_type, time_range, cache)
 
-    for i, (idx, item) in enumerate(list(data.items())[:num_items]):
-        # Calculate position
-        col = i % num_columns
-        x = padding + (col * (card_width + card_spacing))
-        y = y_start
-
-        # Get item data
-        name = item.get("name", "Unknown")
-        image_url = item.get("image", None)
 
-        # Wrap text instead of truncating
-        max_chars = 18 if section_type == "last_albums" else 16
-        name_lines = wrap_text(name, max_chars)
+# Create an SVG infographic for the requested content type and time range
+def create_spotify_infographic(
+    stats_data: dict,
+    section_type: str = "artists",
+    time_range: str = "short_term",
+    image_deadline: float = None,
+    images: dict = None,
+) -> str:
+    if get_infographic_title(section_type, time_range) is None:
+        return None
 
-        # Get subtitle (artist name or genre)
-        if section_type == "artists":
-            subtitle_text = item.get("genre", "Unknown")
-            subtitle_lines = wrap_text(subtitle_text, max_chars)
-        else:
-            artist_name = item.get("artist", "Unknown")
-            subtitle_lines = wrap_text(artist_name, max_chars)
-
-        # Image dimensions
-        img_size = card_width - 16
-        img_y_offset = 8
-
-        # Card container with shadow and gradient
-        svg_content += f"""
-    <g class="card" filter="url(#cardShadow)">
-        <!-- Card background with gradient -->
-        <rect x="{x}" y="{y}" width="{card_width}" height="{card_height}" 
-              fill="url(#cardGradient)" rx="10" ry="10"/>
-        
-        <!-- Subtle accent overlay -->
-        <rect x="{x}" y="{y}" width="{card_width}" height="{card_height}" 
-              fill="url(#accentGradient)" rx="10" ry="10" opacity="0.3"/>
-        
-        <!-- Top accent line -->
-        <rect x="{x}" y="{y}" width="{card_width}" height="2" 
-              fill="#1DB954" rx="10" ry="10" opacity="0.6"/>
-        """
-
-        # Fetch and embed image as base64 if available
-        if image_url:
-            base64_image = fetch_image_as_base64(image_url)
-            if base64_image:
-                svg_content += f"""
-        <!-- Album/Artist Image (embedded as base64) -->
-        <image x="{x + 8}" y="{y + img_y_offset}" width="{img_size}" height="{img_size}" 
-               href="{base64_image}" preserveAspectRatio="xMidYMid slice"
-               style="clip-path: inset(0% round 8px);"/>
-        """
-            else:
-                # Placeholder if image fetch failed
-                svg_content += f"""
-        <rect x="{x + 8}" y="{y + img_y_offset}" width="{img_size}" height="{img_size}" 
-              fill="#333333" rx="8" ry="8"/>
-        <text x="{x + card_width/2}" y="{y + img_y_offset + img_size/2 + 5}" 
-              class="card-title" text-anchor="middle" opacity="0.3" font-size="24">♪</text>
-        """
-        else:
-            # Placeholder if no image URL
-            svg_content += f"""
-        <rect x="{x + 8}" y="{y + img_y_offset}" width="{img_size}" height="{img_size}" 
-              fill="#333333" rx="8" ry="8"/>
-        <text x="{x + card_width/2}" y="{y + img_y_offset + img_size/2 + 5}" 
-              class="card-title" text-anchor="middle" opacity="0.3" font-size="24">♪</text>
-        """
-
-        # Text section with wrapped text
-        text_y = y + img_y_offset + img_size + 18
-
-        # Title (up to 2 lines)
-        for line_idx, line in enumerate(name_lines):
-            escaped_line = escape_xml(line)
-            svg_content += f"""
-        <text x="{x + card_width/2}" y="{text_y + (line_idx * 13)}" class="card-title" text-anchor="middle">
-            {escaped_line}
-        </text>
-        """
-
-        # Subtitle (artist/genre - 1 line)
-        subtitle_y = text_y + (len(name_lines) * 13) + 10
-        if subtitle_lines:
-            escaped_subtitle = escape_xml(subtitle_lines[0])
-            svg_content += f"""
-        <text x="{x + card_width/2}" y="{subtitle_y}" class="card-subtitle" text-anchor="middle">
-            {escaped_subtitle}
-        </text>
-        """
-
-        svg_content += "</g>"
-
-    svg_footer = "</svg>"
-
-    return svg_header + svg_content + svg_footer
+    # Download every card image at once before the layout, within the deadline
+    if images is None:
+        num_columns, num_items, card_width, card_height = get_section_layout(
+            section_type
+        )
+        records = get_section_records(stats_data, section_type, time_range)
+        images = fetch_images_as_base64(
+            [record.image for record in records[:num_items]],
+            deadline=image_deadline,
+            size=get_image_render_size(card_width - 16),
+        )
+
+    # The fragments are joined once at the end
+    with metrics.timer("render"):
+        return "".join(
+            iter_spotify_infographic(stats_data, section_type, time_range, images=images)
+        )
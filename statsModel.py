@@ -0,0 +1,97 @@
+## Compact model of the stats: each slice is a tuple of records (named tuples) in rank order,
+## holding only the fields the images and /json use, instead of a dict of dicts keyed by rank
+## Cached slices are stored as rows (lists of field values), the legacy {0: {...}, 1: {...}} shape
+## is only rebuilt at the edges for the renderer and /json
+import json, os
+from typing import NamedTuple
+
+
+class Artist(NamedTuple):
+    name: str
+    image: str
+    genre: str
+
+
+# Tracks and albums share the same fields
+class Track(NamedTuple):
+    name: str
+    artist: str
+    image: str
+
+
+Album = Track
+
+# Record type of the items of each section
+SECTION_RECORDS = {
+    "top_artists": Artist,
+    "top_songs": Track,
+    "last_albums": Album,
+}
+
+# Most items of a section that can be collected and rendered, two pages of the Spotify API
+MAX_ITEMS = 100
+
+# Number of items of each section without a STATS_<SECTION>_ITEMS setting
+DEFAULT_ITEMS = {
+    "top_artists": 5,
+    "top_songs": 5,
+    "last_albums": 3,
+}
+
+
+def get_record_type(section: str):
+    try:
+        return SECTION_RECORDS[section]
+    except KeyError:
+        raise ValueError(f"Unknown stats section: {section}") from None
+
+
+# Number of items of a section that are collected and rendered, e.g. STATS_TOP_ARTISTS_ITEMS=20
+def get_section_size(section: str) -> int:
+    get_record_type(section)
+    size = int(os.environ.get(f"STATS_{section.upper()}_ITEMS", DEFAULT_ITEMS[section]))
+    return max(1, min(size, MAX_ITEMS))
+
+
+# Convert a legacy slice ({rank: {field: value}}) to a tuple of records in rank order
+# Missing fields are set to None, unused fields are dropped
+def from_legacy(section: str, sliceData: dict) -> tuple:
+    record = get_record_type(section)
+    return tuple(
+        record._make(item.get(field) for field in record._fields)
+        for item in sliceData.values()
+    )
+
+
+# Get the records of a slice in either shape
+def as_records(section: str, sliceData) -> tuple:
+    if isinstance(sliceData, dict):
+        return from_legacy(section, sliceData)
+    return tuple(sliceData)
+
+
+# Convert records back to the legacy {rank: {field: value}} shape, fields set to None are left out
+def to_legacy(records) -> dict:
+    return {
+        rank: {field: value for field, value in zip(record._fields, record) if value is not None}
+        for rank, record in enumerate(records)
+    }
+
+
+# Rows are the JSON friendly form of records, e.g. [["Artist", "https://i.scdn.co/...", "pop"], ...]
+def to_rows(records) -> list:
+    return [list(record) for record in records]
+
+
+def from_rows(section: str, rows: list) -> tuple:
+    record = get_record_type(section)
+    return tuple(record._make(row) for row in rows)
+
+
+# Serialize a slice to compact JSON, about half the size of the legacy shape
+def dumps(records) -> str:
+    return json.dumps(to_rows(records), separators=(",", ":"), ensure_ascii=False)
+
+
+def loads(section: str, data) -> tuple:
+    return from_rows(section, json.loads(data))
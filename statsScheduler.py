@@ -0,0 +1,106 @@
+## Background pre-warming of the caches, so requests only read precomputed output
+## Run it as a long running worker (python -m statsScheduler) or trigger it from the /cron/refresh endpoint
+import os, time
+from concurrent.futures import ThreadPoolExecutor
+import rateLimiter
+import statsCollector
+import statsImageGenerator
+import tenants
+
+
+def refresh_all(cache=None, user: str = None) -> dict:
+    # Refresh the stats from Spotify, then download the new images and pre-render every /stats variant
+    # Returns a summary of the refresh
+    startTime = time.monotonic()
+    errors = {}
+    try:
+        # Pre-warming yields to the requests waiting on Spotify, and can wait out a Retry-After
+        with rateLimiter.priority(rateLimiter.BACKGROUND):
+            stats = statsCollector.refresh_slices(cache=cache, user=user)
+    except statsCollector.CollectionError as e:
+        # Render what we have, the failed sections are served from the cache
+        errors = {section: repr(error) for section, error in e.errors.items()}
+        print(f"Pre-warming with cached data: {e}")
+        try:
+            stats = statsCollector.collect(cache=cache, user=user)
+        except statsCollector.CollectionError as e:
+            # Nothing cached to render either, report the failure instead of raising
+            errors.update({section: repr(error) for section, error in e.errors.items()})
+            summary = {
+                "rendered": [],
+                "errors": errors,
+                "duration": round(time.monotonic() - startTime, 3),
+            }
+            print(f"Pre-warming failed{f' for {user}' if user else ''}:", summary)
+            return summary
+
+    # get_cached_infographic downloads the images into the image cache and stores the render
+    rendered = []
+    for section_type, time_range in statsImageGenerator.STATS_VARIANTS:
+        svgImage = statsImageGenerator.get_cached_infographic(
+            stats, section_type, time_range, cache=cache
+        )
+        if svgImage is not None:
+            rendered.append(f"{section_type}:{time_range}")
+
+    summary = {
+        "rendered": rendered,
+        "errors": errors,
+        "duration": round(time.monotonic() - startTime, 3),
+    }
+    print(f"Pre-warming done{f' for {user}' if user else ''}:", summary)
+    return summary
+
+
+def refresh_tenants(cache=None, max_workers: int = None) -> dict:
+    # Pre-warm every tenant (see tenants) with a bounded pool of TENANT_REFRESH_WORKERS threads,
+    # each tenant collects its slices with STATS_COLLECTOR_WORKERS parallel requests,
+    # so at most TENANT_REFRESH_WORKERS * STATS_COLLECTOR_WORKERS Spotify requests run at once
+    # Returns the summary of each tenant
+    if max_workers is None:
+        max_workers = int(os.environ.get("TENANT_REFRESH_WORKERS", "4"))
+    users = list(tenants.get_tenants())
+    if not users:
+        return {}
+
+    def refresh(user):
+        try:
+            return refresh_all(cache, user)
+        except Exception as e:
+            print(f"Pre-warming {user} failed: {e}")
+            return {"rendered": [], "errors": {"all": repr(e)}, "duration": None}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(users)))) as executor:
+        return dict(zip(users, executor.map(refresh, users)))
+
+
+# Pre-warm every tenant when a registry is configured, the single account otherwise
+# With a registry, the SPOTIFY_REFRESH_TOKEN account still served by /stats and /json is refreshed
+# too when it is set, the summaries are then {"tenants": {user: summary}, "default": summary}
+def refresh_everything(cache=None) -> dict:
+    if not tenants.get_tenants():
+        return refresh_all(cache)
+    summaries = {"tenants": refresh_tenants(cache)}
+    if os.environ.get("SPOTIFY_REFRESH_TOKEN"):
+        try:
+            summaries["default"] = refresh_all(cache)
+        except Exception as e:
+            print(f"Pre-warming the default account failed: {e}")
+            summaries["default"] = {"rendered": [], "errors": {"all": repr(e)}, "duration": None}
+    return summaries
+
+
+def run_forever(interval: float = None):
+    # Refresh everything every PREWARM_INTERVAL seconds (15 minutes by default)
+    if interval is None:
+        interval = float(os.environ.get("PREWARM_INTERVAL", 15 * 60))
+    while True:
+        try:
+            refresh_everything()
+        except Exception as e:
+            print(f"Pre-warming failed: {e}")
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    run_forever()
@@ -0,0 +1,178 @@
+## Precompiled fragments of the SVG infographic
+## The templates are plain str.format templates whose format methods are bound once at import,
+## and the static header (styles, gradients, filters) is only built once per layout size
+from functools import lru_cache
+
+# SVG header with enhanced styles
+HEADER_TEMPLATE = """<svg width="{total_width}" height="{total_height}" xmlns="http://www.w3.org/2000/svg">
+    <defs>
+        <style type="text/css">
+            .title {{ 
+                fill: #1DB954; 
+                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', 'Helvetica Neue', Arial, sans-serif; 
+                font-size: 22px; 
+                font-weight: 700; 
+            }}
+            .card-title {{ 
+                fill: #FFFFFF; 
+                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Arial, sans-serif; 
+                font-size: 11px; 
+                font-weight: 600;
+                line-height: 1.3;
+            }}
+            .card-subtitle {{ 
+                fill: #B3B3B3; 
+                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Arial, sans-serif; 
+                font-size: 9px; 
+                font-weight: 400; 
+            }}
+        </style>
+        <!-- Dark gradient background -->
+        <linearGradient id="bgGradient" x1="0%" y1="0%" x2="0%" y2="100%">
+            <stop offset="0%" style="stop-color:#1a1a1a;stop-opacity:1" />
+            <stop offset="100%" style="stop-color:#0a0a0a;stop-opacity:1" />
+        </linearGradient>
+        <!-- Card gradient -->
+        <linearGradient id="cardGradient" x1="0%" y1="0%" x2="0%" y2="100%">
+            <stop offset="0%" style="stop-color:#2a2a2a;stop-opacity:1" />
+            <stop offset="100%" style="stop-color:#1e1e1e;stop-opacity:1" />
+        </linearGradient>
+        <!-- Green accent gradient -->
+        <linearGradient id="accentGradient" x1="0%" y1="0%" x2="100%" y2="100%">
+            <stop offset="0%" style="stop-color:#1DB954;stop-opacity:0.15" />
+            <stop offset="100%" style="stop-color:#1ed760;stop-opacity:0.05" />
+        </linearGradient>
+        <!-- Subtle glow effect -->
+        <filter id="glow" x="-50%" y="-50%" width="200%" height="200%">
+            <feGaussianBlur in="SourceGraphic" stdDeviation="1" result="blur"/>
+            <feComponentTransfer in="blur" result="glow">
+                <feFuncA type="linear" slope="1.5"/>
+            </feComponentTransfer>
+            <feMerge>
+                <feMergeNode in="glow"/>
+                <feMergeNode in="SourceGraphic"/>
+            </feMerge>
+        </filter>
+        <!-- Card shadow -->
+        <filter id="cardShadow" x="-20%" y="-20%" width="140%" height="140%">
+            <feGaussianBlur in="SourceAlpha" stdDeviation="3"/>
+            <feOffset dx="0" dy="2" result="offsetblur"/>
+            <feComponentTransfer>
+                <feFuncA type="linear" slope="0.3"/>
+            </feComponentTransfer>
+            <feMerge>
+                <feMergeNode/>
+                <feMergeNode in="SourceGraphic"/>
+            </feMerge>
+        </filter>
+    </defs>
+    
+    <!-- Background with gradient -->
+    <rect width="{total_width}" height="{total_height}" fill="url(#bgGradient)"/>
+    """
+
+# Title with glow (NO SUBTITLE)
+TITLE_TEMPLATE = """
+    <g filter="url(#glow)">
+        <text x="{padding}" y="32" class="title">{title}</text>
+    </g>
+    """
+
+# Card container with shadow and gradient
+CARD_TEMPLATE = """
+    <g class="card" filter="url(#cardShadow)">
+        <!-- Card background with gradient -->
+        <rect x="{x}" y="{y}" width="{card_width}" height="{card_height}" 
+              fill="url(#cardGradient)" rx="10" ry="10"/>
+        
+        <!-- Subtle accent overlay -->
+        <rect x="{x}" y="{y}" width="{card_width}" height="{card_height}" 
+              fill="url(#accentGradient)" rx="10" ry="10" opacity="0.3"/>
+        
+        <!-- Top accent line -->
+        <rect x="{x}" y="{y}" width="{card_width}" height="2" 
+              fill="#1DB954" rx="10" ry="10" opacity="0.6"/>
+        """
+
+# Album/Artist image embedded as base64
+IMAGE_TEMPLATE = """
+        <!-- Album/Artist Image (embedded as base64) -->
+        <image x="{image_x}" y="{image_y}" width="{img_size}" height="{img_size}" 
+               href="{href}" preserveAspectRatio="xMidYMid slice"
+               style="clip-path: inset(0% round 8px);"/>
+        """
+
+# Image shown by several cards (e.g. songs of the same album), embedded once and placed by each card
+IMAGE_DEF_TEMPLATE = """
+        <!-- Album/Artist Image shared by several cards (embedded once as base64) -->
+        <defs>
+            <image id="{image_id}" width="{img_size}" height="{img_size}" 
+                   href="{href}" preserveAspectRatio="xMidYMid slice"
+                   style="clip-path: inset(0% round 8px);"/>
+        </defs>"""
+
+# Reference to a shared image, at the position of the image of the card
+IMAGE_USE_TEMPLATE = """
+        <use href="#{image_id}" x="{image_x}" y="{image_y}"/>
+        """
+
+# Placeholder if there is no image or the image fetch failed
+PLACEHOLDER_TEMPLATE = """
+        <rect x="{image_x}" y="{image_y}" width="{img_size}" height="{img_size}" 
+              fill="#333333" rx="8" ry="8"/>
+        <text x="{center_x}" y="{placeholder_y}" 
+              class="card-title" text-anchor="middle" opacity="0.3" font-size="24">♪</text>
+        """
+
+# One line of the card title or subtitle
+CARD_TEXT_TEMPLATE = """
+        <text x="{center_x}" y="{line_y}" class="{text_class}" text-anchor="middle">
+            {text}
+        </text>
+        """
+
+CARD_END = "</g>"
+SVG_FOOTER = "</svg>"
+
+# The image data URI is not formatted into the template but emitted as its own fragment,
+# so the large base64 payload is only copied once, when the document is joined
+IMAGE_START_TEMPLATE, IMAGE_END = IMAGE_TEMPLATE.split("{href}")
+IMAGE_DEF_START_TEMPLATE, IMAGE_DEF_END = IMAGE_DEF_TEMPLATE.split("{href}")
+
+render_title = TITLE_TEMPLATE.format
+render_card_text = CARD_TEXT_TEMPLATE.format
+render_image_use = IMAGE_USE_TEMPLATE.format
+
+
+@lru_cache(maxsize=16)
+def render_header(total_width: int, total_height: int) -> str:
+    return HEADER_TEMPLATE.format(total_width=total_width, total_height=total_height)
+
+
+# Fragments that only depend on the position of the card are built once per layout
+
+
+@lru_cache(maxsize=64)
+def render_card_start(x, y, card_width, card_height) -> str:
+    return CARD_TEMPLATE.format(x=x, y=y, card_width=card_width, card_height=card_height)
+
+
+@lru_cache(maxsize=64)
+def render_image_start(image_x, image_y, img_size) -> str:
+    return IMAGE_START_TEMPLATE.format(image_x=image_x, image_y=image_y, img_size=img_size)
+
+
+@lru_cache(maxsize=64)
+def render_image_def_start(image_id, img_size) -> str:
+    return IMAGE_DEF_START_TEMPLATE.format(image_id=image_id, img_size=img_size)
+
+
+@lru_cache(maxsize=64)
+def render_placeholder(image_x, image_y, img_size, center_x, placeholder_y) -> str:
+    return PLACEHOLDER_TEMPLATE.format(
+        image_x=image_x,
+        image_y=image_y,
+        img_size=img_size,
+        center_x=center_x,
+        placeholder_y=placeholder_y,
+    )
@@ -0,0 +1,93 @@
+## Registry of the Spotify accounts served by one deployment
+## Each user key maps to a refresh token, read from SPOTIFY_TENANTS (a JSON object) or from the JSON file at TENANTS_FILE
+## e.g. SPOTIFY_TENANTS='{"alice": "<refresh token>", "bob": "<refresh token>"}'
+import os, json, re, threading
+
+# User keys are used in URLs and cache keys
+USER_KEY_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+class UnknownTenantError(KeyError):
+    # Raised when a user key is not in the registry
+    pass
+
+
+# Read the tenants from the environment, returns a dict mapping each user key to its refresh token
+def load_tenants() -> dict:
+    tenantsJson = os.environ.get("SPOTIFY_TENANTS")
+    tenantsFile = os.environ.get("TENANTS_FILE")
+    if tenantsJson:
+        tenants = json.loads(tenantsJson)
+    elif tenantsFile:
+        with open(tenantsFile, encoding="utf-8") as f:
+            tenants = json.load(f)
+    else:
+        return {}
+
+    if not isinstance(tenants, dict):
+        raise ValueError("Tenants must be a JSON object mapping user keys to refresh tokens")
+    for user, refreshToken in tenants.items():
+        if not USER_KEY_PATTERN.match(user):
+            raise ValueError(f"Invalid user key: {user!r}")
+        if not isinstance(refreshToken, str) or not refreshToken:
+            raise ValueError(f"Invalid refresh token for {user}")
+    return tenants
+
+
+_tenants = None
+_tenants_lock = threading.Lock()
+
+
+# Get the process wide registry, loaded on first use
+def get_tenants() -> dict:
+    global _tenants
+    if _tenants is None:
+        with _tenants_lock:
+            if _tenants is None:
+                _tenants = load_tenants()
+    return _tenants
+
+
+# Forget the registry, it is reloaded from the environment on next use
+def reset_tenants():
+    global _tenants
+    with _tenants_lock:
+        _tenants = None
+
+
+# Get the refresh token of a tenant, raises UnknownTenantError if the user key is not registered
+def get_refresh_token(user: str) -> str:
+    refreshToken = get_tenants().get(user)
+    if refreshToken is None:
+        raise UnknownTenantError(user)
+    return refreshToken
+
+
+class TenantCache:
+    # View of a cache backend (see statsCache) where every key is prefixed with the user key,
+    # so tenants sharing a backend never read each other's stats
+
+    def __init__(self, backend, user: str):
+        self.backend = backend
+        self.user = user
+        self.prefix = f"tenant:{user}:"
+
+    def get(self, key: str):
+        return self.backend.get(self.prefix + key)
+
+    def set(self, key: str, value, ttl: int = None):
+        self.backend.set(self.prefix + key, value, ttl)
+
+    def delete(self, key: str):
+        self.backend.delete(self.prefix + key)
+
+
+# Get the view of a cache for a tenant, the cache itself when there is no tenant
+def get_tenant_cache(cache, user: str = None):
+    if user is None:
+        return cache
+    if isinstance(cache, TenantCache):
+        if cache.user == user:
+            return cache
+        cache = cache.backend
+    return TenantCache(cache, user)
@@ -0,0 +1,13 @@
+# Fixtures shared by the whole test suite
+
+import pytest
+import snapshotStore
+
+
+@pytest.fixture(autouse=True)
+def no_snapshots(monkeypatch):
+    """Tests run without the snapshot store, so they never read what other tests or the app saved"""
+    monkeypatch.setenv("SNAPSHOT_DB_PATH", "")
+    snapshotStore.set_store(None)
+    yield
+    snapshotStore.set_store(None)
@@ -0,0 +1,216 @@
+# Test suite for the Flask API in api/index.py
+
+import pytest
+import statsCache
+import statsImageGenerator
+from api import index
+
+
+STATS = {
+    "top_artists": {
+        "short_term": {0: {"name": "Artist", "image": "http://test.com/a.jpg", "genre": "pop"}},
+        "long_term": {},
+    },
+    "top_songs": {"short_term": {}, "long_term": {}},
+    "last_albums": {0: {"name": "Album", "artist": "Artist", "image": "http://test.com/b.jpg"}},
+}
+
+
+@pytest.fixture
+def client(mocker):
+    """Fixture to create a test client serving fixed stats with fresh caches"""
+    statsCache.set_cache(statsCache.MemoryCacheBackend())
+    mocker.patch("statsCollector.collect_slices", return_value=STATS)
+    mocker.patch(
+        "statsImageGenerator.fetch_image_as_base64",
+        return_value="data:image/jpeg;base64,AAAA",
+    )
+    yield index.app.test_client()
+    statsCache.set_cache(None)
+
+
+@pytest.fixture
+def no_streaming(monkeypatch):
+    """Fixture rendering /stats whole, streamed renders are sent without an ETag"""
+    monkeypatch.setenv("STATS_STREAMING", "0")
+
+
+@pytest.mark.usefixtures("no_streaming")
+class TestConditionalRequests:
+    """Tests for the ETag and 304 Not Modified support"""
+
+    def test_stats_sends_etag(self, client):
+        response = client.get("/stats?type=artists")
+
+        assert response.status_code == 200
+        assert response.headers["ETag"]
+        assert response.mimetype == "image/svg+xml"
+
+    def test_stats_answers_304_without_rendering(self, client, mocker):
+        """Test that a matching If-None-Match skips the render entirely"""
+        etag = client.get("/stats?type=last_albums").headers["ETag"]
+        render = mocker.patch("statsImageGenerator.create_spotify_infographic")
+
+        response = client.get("/stats?type=last_albums", headers={"If-None-Match": etag})
+
+        assert response.status_code == 304
+        assert response.data == b""
+        render.assert_not_called()
+
+    def test_weak_etag_answers_304(self, client):
+        """Test that the ETag weakened by a compressing proxy still matches"""
+        etag = client.get("/stats?type=last_albums").headers["ETag"]
+
+        response = client.get("/stats?type=last_albums", headers={"If-None-Match": f"W/{etag}"})
+
+        assert response.status_code == 304
+
+    def test_etag_differs_between_variants(self, client):
+        artists = client.get("/stats?type=artists").headers["ETag"]
+        albums = client.get("/stats?type=last_albums").headers["ETag"]
+
+        assert artists != albums
+
+    def test_json_answers_304(self, client):
+        etag = client.get("/json").headers["ETag"]
+
+        response = client.get("/json", headers={"If-None-Match": etag})
+
+        assert response.status_code == 304
+
+    def test_render_with_missing_image_has_no_etag(self, client, mocker):
+        """Test that a render with placeholders is neither revalidated nor kept by caches"""
+        mocker.patch("statsImageGenerator.fetch_image_as_base64", return_value=None)
+
+        response = client.get("/stats?type=artists")
+
+        assert response.status_code == 200
+        assert "ETag" not in response.headers
+        assert response.headers["Cache-Control"] == "no-store"
+
+
+@pytest.mark.usefixtures("no_streaming")
+class TestRenderCache:
+    """Tests for the cache of rendered SVGs"""
+
+    def test_render_is_reused(self, client, mocker):
+        first = client.get("/stats?type=artists").data
+        render = mocker.spy(statsImageGenerator, "create_spotify_infographic")
+
+        second = client.get("/stats?type=artists").data
+
+        assert first == second
+        render.assert_not_called()
+
+    def test_render_with_missing_image_is_not_cached(self, client, mocker):
+        mocker.patch("statsImageGenerator.fetch_image_as_base64", return_value=None)
+        client.get("/stats?type=artists")
+        render = mocker.spy(statsImageGenerator, "create_spotify_infographic")
+
+        client.get("/stats?type=artists")
+
+        render.assert_called_once()
+
+
+class TestStreaming:
+    """Tests for the streamed /stats responses"""
+
+    def test_uncached_render_is_streamed(self, client):
+        response = client.get("/stats?type=artists")
+
+        # Without a Content-Length the server sends the body with chunked transfer encoding
+        assert "Content-Length" not in response.headers
+        # Images could still be missing when the headers are sent
+        assert "ETag" not in response.headers
+        assert response.headers["Cache-Control"] == "no-store"
+        assert response.data.decode() == statsImageGenerator.create_spotify_infographic(
+            STATS, "artists", "short_term"
+        )
+
+    def test_streamed_render_is_cached(self, client, mocker):
+        streamed = client.get("/stats?type=artists").data
+        render = mocker.spy(statsImageGenerator, "iter_spotify_infographic")
+
+        response = client.get("/stats?type=artists")
+
+        assert response.data == streamed
+        assert response.headers["Content-Length"] == str(len(streamed))
+        assert response.headers["ETag"]
+        render.assert_not_called()
+
+    def test_streamed_render_with_missing_image_is_not_cached(self, client, mocker):
+        mocker.patch("statsImageGenerator.fetch_image_as_base64", return_value=None)
+        client.get("/stats?type=artists").get_data()
+
+        assert "Content-Length" not in client.get("/stats?type=artists").headers
+
+    def test_cached_render_is_sent_whole(self, client):
+        statsImageGenerator.get_cached_infographic(STATS, "last_albums", "short_term")
+
+        response = client.get("/stats?type=last_albums")
+
+        assert response.headers["Content-Length"] == str(len(response.data))
+
+    def test_streaming_can_be_disabled(self, client, monkeypatch):
+        monkeypatch.setenv("STATS_STREAMING", "0")
+
+        assert "Content-Length" in client.get("/stats?type=artists").headers
+
+
+@pytest.mark.usefixtures("no_streaming")
+class TestCacheControl:
+    """Tests for the Cache-Control policies"""
+
+    def test_stats_policy(self, client):
+        cache_control = client.get("/stats").headers["Cache-Control"]
+
+        assert "public" in cache_control
+        assert "s-maxage=3600" in cache_control
+        assert "stale-while-revalidate=86400" in cache_control
+        assert "stale-if-error=604800" in cache_control
+
+    def test_policy_is_configurable(self, client, monkeypatch):
+        monkeypatch.setenv("CACHE_JSON_S_MAXAGE", "42")
+
+        assert "s-maxage=42" in client.get("/json").headers["Cache-Control"]
+
+    def test_not_modified_keeps_policy(self, client):
+        etag = client.get("/stats").headers["ETag"]
+
+        response = client.get("/stats", headers={"If-None-Match": etag})
+
+        assert response.headers["Cache-Control"] == index.get_cache_control("stats")
+
+
+class TestLazyCollection:
+    """Tests for the section-scoped collection of the endpoints"""
+
+    def test_stats_only_collects_requested_slice(self, client):
+        import statsCollector
+
+        client.get("/stats?type=last_albums")
+
+        statsCollector.collect_slices.assert_called_once_with(
+            [("last_albums", None)], None, None, True
+        )
+
+    def test_json_fields(self, client):
+        import statsCollector
+
+        response = client.get("/json?fields=last_albums,top_artists.long_term")
+
+        assert response.status_code == 200
+        statsCollector.collect_slices.assert_called_once_with(
+            [("top_artists", "long_term"), ("last_albums", None)], user=None
+        )
+
+    def test_json_section_field_includes_both_ranges(self):
+        assert index.parse_fields("top_songs") == [
+            ("top_songs", "short_term"),
+            ("top_songs", "long_term"),
+        ]
+
+    def test_json_unknown_field(self, client):
+        response = client.get("/json?fields=playlists")
+
+        assert response.status_code == 400
@@ -0,0 +1,324 @@
+# Test suite for the async API in api/asgi.py and asyncPipeline.py
+
+import asyncio
+import time
+import pytest
+import asyncPipeline
+import imageCache
+import metrics
+import rateLimiter
+import statsCache
+import statsCollector
+import tokenManager
+from api import asgi, index
+
+
+ARTIST = {
+    "id": "a1",
+    "name": "Artist",
+    "images": [{"url": "http://test.com/a.jpg"}],
+    "genres": ["pop"],
+}
+ALBUM = {"name": "Album", "artists": [{"name": "Artist"}], "images": [{"url": "http://test.com/c.jpg"}]}
+TRACK = {"name": "Song", "artists": [{"name": "Artist"}], "album": ALBUM}
+PAGES = {
+    "me/top/artists": {"items": [ARTIST] * 5},
+    "me/top/tracks": {"items": [TRACK] * 5},
+    "me/albums": {"items": [{"album": ALBUM}] * 3},
+}
+
+
+class FakeResponse:
+    """Response of FakeClient, with the attributes of an httpx.Response used by asyncPipeline"""
+
+    def __init__(self, url, status_code=200, payload=None, content=b"", headers=None):
+        self.url = url
+        self.status_code = status_code
+        self.payload = payload
+        self.content = content
+        self.text = str(payload)
+        self.headers = headers or {}
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class FakeClient:
+    """Async HTTP client answering the Spotify endpoints and the images after latency seconds"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = []
+        self.responses = {}
+
+    async def get(self, url, params=None, headers=None, timeout=None):
+        self.requests.append(url)
+        await asyncio.sleep(self.latency)
+        path = url.removeprefix("https://api.spotify.com/v1/")
+        if self.responses.get(path):
+            return self.responses[path].pop(0)
+        if path in PAGES:
+            return FakeResponse(url, payload=PAGES[path])
+        return FakeResponse(url, content=b"\x00\x00\x00", headers={"content-type": "image/jpeg"})
+
+    async def aclose(self):
+        pass
+
+
+def request(path: str, headers: dict = None, method: str = "GET") -> tuple:
+    """Send one request to the ASGI app, returns its (status, headers, body)"""
+    return asyncio.run(send_requests([(path, headers, method)]))[0]
+
+
+async def send_requests(requests: list) -> list:
+    """Send requests concurrently to the ASGI app, returns their (status, headers, body)"""
+
+    async def send_request(path, headers=None, method="GET"):
+        path, _, query = path.partition("?")
+        scope = {
+            "type": "http",
+            "method": method,
+            "path": path,
+            "query_string": query.encode(),
+            "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+        }
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        await asgi.app(scope, receive, send)
+        start, body = messages
+        return (
+            start["status"],
+            {name.decode(): value.decode() for name, value in start["headers"]},
+            body["body"],
+        )
+
+    return await asyncio.gather(*(send_request(*r) for r in requests))
+
+
+@pytest.fixture
+def spotify(mocker, monkeypatch):
+    """Fixture serving the same account to both APIs, the async one through a FakeClient"""
+    monkeypatch.setenv("IMAGE_SCALE", "0")
+    monkeypatch.setenv("SPOTIFY_RATE_LIMIT", "0")
+    # The async API sends renders whole, so does the Flask one to compare their headers
+    monkeypatch.setenv("STATS_STREAMING", "0")
+    rateLimiter.reset_limiter()
+    statsCache.set_cache(statsCache.MemoryCacheBackend())
+    imageCache.set_image_cache(imageCache.ImageCache())
+    sp = mocker.Mock()
+    sp.prefix = "https://api.spotify.com/v1/"
+    sp.auth_manager.get_access_token.return_value = "token"
+    sp.current_user_top_artists.return_value = PAGES["me/top/artists"]
+    sp.current_user_top_tracks.return_value = PAGES["me/top/tracks"]
+    sp.current_user_saved_albums.return_value = PAGES["me/albums"]
+    mocker.patch("statsCollector.get_tenant_client", return_value=sp)
+    mocker.patch(
+        "statsImageGenerator._download_image_as_base64",
+        return_value="data:image/jpeg;base64,AAAA",
+    )
+    client = FakeClient()
+    asyncPipeline.set_client(client)
+    yield client
+    asyncPipeline.set_client(None)
+    statsCache.set_cache(None)
+    imageCache.set_image_cache(None)
+    rateLimiter.reset_limiter()
+
+
+def reset_caches():
+    statsCache.set_cache(statsCache.MemoryCacheBackend())
+    imageCache.set_image_cache(imageCache.ImageCache())
+
+
+class TestSameResponses:
+    """Tests that the async API answers the same bodies and headers as the Flask one"""
+
+    @pytest.mark.parametrize(
+        "path",
+        [
+            "/json",
+            "/json?fields=top_artists.short_term,last_albums",
+            "/stats?type=artists",
+            "/stats?type=top_songs&range=long_term",
+            "/stats?type=last_albums",
+        ],
+    )
+    def test_body_and_etag_match_flask(self, spotify, path):
+        expected = index.app.test_client().get(path)
+        expectedBody = expected.get_data()
+        reset_caches()
+
+        status, headers, body = request(path)
+
+        assert status == expected.status_code == 200
+        assert body == expectedBody
+        assert headers["etag"] == expected.headers["ETag"]
+        assert headers["cache-control"] == expected.headers["Cache-Control"]
+        assert headers["content-type"] == expected.headers["Content-Type"]
+
+    def test_spotify_requests_use_the_account_token(self, spotify):
+        request("/json?fields=last_albums")
+
+        assert spotify.requests == ["https://api.spotify.com/v1/me/albums"]
+
+    def test_render_with_missing_image_has_no_etag(self, spotify, mocker):
+        mocker.patch("asyncPipeline.fetch_image_as_base64", return_value=None)
+
+        _, headers, _ = request("/stats?type=last_albums")
+
+        assert "etag" not in headers
+        assert headers["cache-control"] == "no-store"
+
+    def test_home_redirects(self, spotify):
+        status, headers, _ = request("/")
+
+        assert status == 302
+        assert headers["location"] == "https://github.com/JohanVerne/SpotifyREADMEStats"
+
+    def test_head_has_no_body(self, spotify):
+        status, headers, body = request("/json", method="HEAD")
+
+        assert status == 200
+        assert headers["etag"]
+        assert body == b""
+
+    def test_server_timing(self, spotify):
+        metrics.reset_registry()
+        _, headers, _ = request("/stats?type=last_albums")
+
+        assert "spotify_saved_albums;dur=" in headers["server-timing"]
+        assert "image_download;dur=" in headers["server-timing"]
+        assert metrics.get_registry().get_counter(
+            "cache_lookups_total", {"cache": "images", "result": "miss"}
+        ) == 1
+
+
+class TestErrors:
+    """Tests for the error responses of the async API"""
+
+    def test_not_modified(self, spotify):
+        _, headers, _ = request("/stats?type=artists")
+
+        status, notModified, body = request("/stats?type=artists", {"If-None-Match": headers["etag"]})
+
+        assert status == 304
+        assert body == b""
+        assert notModified["etag"] == headers["etag"]
+        assert notModified["cache-control"] == headers["cache-control"]
+
+    def test_unknown_path(self, spotify):
+        assert request("/unknown")[0] == 404
+
+    def test_unknown_user(self, spotify):
+        status, _, body = request("/json/nobody")
+
+        assert status == 404
+        assert b"Unknown user: nobody" in body
+
+    def test_unknown_field(self, spotify):
+        assert request("/json?fields=nope")[0] == 400
+
+    def test_rate_limited(self, spotify):
+        """Test that a second 429 answers 503 with the Retry-After of Spotify"""
+        spotify.responses["me/albums"] = [
+            FakeResponse("me/albums", 429, headers={"Retry-After": "0"}),
+            FakeResponse("me/albums", 429, headers={"Retry-After": "3"}),
+        ]
+
+        status, headers, _ = request("/json?fields=last_albums")
+
+        assert status == 503
+        assert headers["retry-after"] == "3"
+        assert headers["cache-control"] == "no-store"
+
+    def test_rejected_token_is_refreshed(self, spotify, mocker):
+        manager = mocker.Mock(spec=tokenManager.TokenManager)
+        manager.get_cached_access_token.return_value = None
+        manager.get_access_token.side_effect = ["revoked", "token"]
+        statsCollector.get_tenant_client().auth_manager = manager
+        spotify.responses["me/albums"] = [FakeResponse("me/albums", 401)]
+
+        status, _, body = request("/json?fields=last_albums")
+
+        assert status == 200
+        assert b"Album" in body
+        manager.invalidate.assert_called_once_with("revoked")
+
+    def test_cached_token_is_read_without_a_thread(self, spotify, mocker):
+        manager = tokenManager.TokenManager(mocker.Mock(), "refresh")
+        manager._token_info = {"access_token": "token", "expires_at": time.time() + 3600}
+        mocker.patch.object(manager, "get_access_token", side_effect=AssertionError("blocking call"))
+        statsCollector.get_tenant_client().auth_manager = manager
+
+        status, _, _ = request("/json?fields=last_albums")
+
+        assert status == 200
+
+    def test_server_errors_are_retried(self, spotify, monkeypatch):
+        """Test that 5xx answers are retried like by the sync sessions"""
+        monkeypatch.setenv("HTTP_BACKOFF_FACTOR", "0")
+        spotify.responses["me/albums"] = [FakeResponse("me/albums", 503), FakeResponse("me/albums", 502)]
+
+        status, _, body = request("/json?fields=last_albums")
+
+        assert status == 200
+        assert b"Album" in body
+        assert len(spotify.requests) == 3
+
+    def test_server_errors_give_up_after_retries(self, spotify, monkeypatch):
+        monkeypatch.setenv("HTTP_RETRIES", "1")
+        monkeypatch.setenv("HTTP_BACKOFF_FACTOR", "0")
+        spotify.responses["me/albums"] = [FakeResponse("me/albums", 500), FakeResponse("me/albums", 500)]
+
+        with pytest.raises(statsCollector.CollectionError):
+            request("/json?fields=last_albums")
+
+        assert len(spotify.requests) == 2
+
+    def test_rate_limit_retry(self, spotify):
+        spotify.responses["me/albums"] = [FakeResponse("me/albums", 429, headers={"Retry-After": "0"})]
+
+        status, _, body = request("/json?fields=last_albums")
+
+        assert status == 200
+        assert b"Album" in body
+        assert len(spotify.requests) == 2
+
+
+class TestConcurrency:
+    """Tests for the concurrency of the async API"""
+
+    def test_concurrent_requests_are_not_serialized(self, spotify, monkeypatch):
+        """Test that 100 cold requests wait on their upstream requests at the same time"""
+        spotify.latency = 0.05
+        users = [f"user{i}" for i in range(100)]
+        tenants = {user: {"refresh_token": user} for user in users}
+        monkeypatch.setattr("tenants.get_tenants", lambda: tenants)
+
+        startTime = time.perf_counter()
+        responses = asyncio.run(
+            send_requests([(f"/stats/{user}?type=last_albums", None, "GET") for user in users])
+        )
+        duration = time.perf_counter() - startTime
+
+        assert [status for status, _, _ in responses] == [200] * 100
+        # Each request waits on one Spotify call and one image, 10s if they were serialized
+        assert duration < 3
+
+    def test_concurrent_images_are_downloaded_once(self, spotify):
+        spotify.latency = 0.05
+
+        asyncio.run(send_requests([("/stats?type=last_albums", None, "GET")] * 10))
+
+        assert spotify.requests.count("http://test.com/c.jpg") == 1
+        assert spotify.requests.count("https://api.spotify.com/v1/me/albums") == 1
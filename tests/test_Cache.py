@@ -0,0 +1,194 @@
+# Test suite for statsCache.py and the cached collection path of statsCollector.py
+
+import pytest
+import statsCache
+import statsCollector
+
+
+class TestMemoryCacheBackend:
+    """Tests for the in-process LRU cache"""
+
+    def test_get_returns_stored_value(self):
+        """Test that a stored value can be read back"""
+        cache = statsCache.MemoryCacheBackend()
+        cache.set("key", {"a": 1}, ttl=60)
+
+        assert cache.get("key") == {"a": 1}
+
+    def test_expired_entries_are_dropped(self, mocker):
+        """Test that entries are not served after their TTL"""
+        clock = mocker.patch("statsCache.time.monotonic", return_value=100.0)
+        cache = statsCache.MemoryCacheBackend()
+        cache.set("key", "value", ttl=10)
+
+        clock.return_value = 111.0
+
+        assert cache.get("key") is None
+
+    def test_least_recently_used_entry_is_evicted(self):
+        """Test that the LRU entry is evicted once max_entries is reached"""
+        cache = statsCache.MemoryCacheBackend(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+
+
+class TestRedisCacheBackend:
+    """Tests for the Redis backend using a mocked client"""
+
+    def test_int_keys_are_restored(self, mocker):
+        """Test that the int keys of the stats survive the JSON round trip"""
+        client = mocker.Mock()
+        client.get.return_value = b'{"short_term": {"0": {"name": "A"}}}'
+        cache = statsCache.RedisCacheBackend(client)
+
+        assert cache.get("section:top_artists") == {"short_term": {0: {"name": "A"}}}
+
+    def test_falls_back_to_memory_when_redis_fails(self, mocker):
+        """Test that a Redis outage doesn't break the cache"""
+        client = mocker.Mock()
+        client.setex.side_effect = statsCache.redis.ConnectionError("down")
+        client.get.side_effect = statsCache.redis.ConnectionError("down")
+        cache = statsCache.RedisCacheBackend(client)
+
+        cache.set("key", "value", ttl=60)
+
+        assert cache.get("key") == "value"
+
+
+class TestSectionTtl:
+    """Tests for the per-section TTL configuration"""
+
+    def test_env_overrides_default(self, monkeypatch):
+        monkeypatch.setenv("STATS_TTL_LAST_ALBUMS", "42")
+
+        assert statsCache.get_section_ttl("last_albums") == 42
+
+    def test_albums_expire_sooner_than_top_items(self, monkeypatch):
+        monkeypatch.delenv("STATS_TTL_LAST_ALBUMS", raising=False)
+        monkeypatch.delenv("STATS_TTL_TOP_ARTISTS", raising=False)
+
+        assert statsCache.get_section_ttl("last_albums") < statsCache.get_section_ttl(
+            "top_artists"
+        )
+
+
+class TestGetCachedUserData:
+    """Tests for statsCollector.get_cached_user_data"""
+
+    @pytest.fixture
+    def collectors(self, mocker):
+        mocker.patch("statsCollector.setup_spotify_client")
+        return {
+            "top_artists": mocker.patch(
+                "statsCollector.get_user_top_artists_range", return_value={}
+            ),
+            "top_songs": mocker.patch(
+                "statsCollector.get_user_top_songs_range", return_value={}
+            ),
+            "last_albums": mocker.patch(
+                "statsCollector.get_user_last_listenedTo_albums", return_value={}
+            ),
+        }
+
+    def test_warm_cache_skips_spotify(self, collectors):
+        """Test that a second call is served without calling Spotify"""
+        cache = statsCache.MemoryCacheBackend()
+
+        first = statsCollector.get_cached_user_data(cache)
+        second = statsCollector.get_cached_user_data(cache)
+
+        assert first == second
+        assert collectors["top_artists"].call_count == 2  # one call per range
+        assert collectors["top_songs"].call_count == 2
+        assert collectors["last_albums"].call_count == 1
+
+    def test_only_expired_sections_are_collected(self, collectors):
+        """Test that only the missing sections are fetched again"""
+        cache = statsCache.MemoryCacheBackend()
+        statsCollector.get_cached_user_data(cache)
+        cache.delete("section:last_albums")
+
+        statsCollector.get_cached_user_data(cache)
+
+        assert collectors["top_artists"].call_count == 2
+        assert collectors["last_albums"].call_count == 2
+
+    def test_collect_only_fetches_requested_slices(self, collectors):
+        """Test that a single section and range only makes one API call"""
+        cache = statsCache.MemoryCacheBackend()
+
+        result = statsCollector.collect(["top_songs"], ["long_term"], cache=cache)
+
+        assert result == {"top_songs": {"long_term": {}}}
+        assert collectors["top_songs"].call_count == 1
+        collectors["top_artists"].assert_not_called()
+        collectors["last_albums"].assert_not_called()
+
+    def test_collect_merges_into_cached_snapshot(self, collectors):
+        """Test that slices collected on demand are reused by a full collection"""
+        cache = statsCache.MemoryCacheBackend()
+        statsCollector.collect(["last_albums"], cache=cache)
+        statsCollector.collect(["top_artists"], ["short_term"], cache=cache)
+
+        statsCollector.get_cached_user_data(cache)
+
+        assert collectors["last_albums"].call_count == 1
+        assert collectors["top_artists"].call_count == 2
+        assert collectors["top_songs"].call_count == 2
+
+    def test_failed_section_is_retried_next_time(self, collectors):
+        """Test that sections collected before a failure are kept in the cache"""
+        cache = statsCache.MemoryCacheBackend()
+        collectors["last_albums"].side_effect = RuntimeError("boom")
+
+        with pytest.raises(statsCollector.CollectionError):
+            statsCollector.get_cached_user_data(cache)
+
+        assert statsCollector._read_cached_slice(cache, "top_artists", "long_term") == (
+            (),
+            False,
+        )
+        assert cache.get("section:last_albums") is None
+
+    def test_stale_section_is_served_and_refreshed_in_background(
+        self, collectors, mocker, monkeypatch
+    ):
+        """Test that an expired section doesn't make the request wait on Spotify"""
+        monkeypatch.setenv("STATS_SERVE_STALE", "1")
+        clock = mocker.patch("statsCollector.time.time", return_value=1000.0)
+        cache = statsCache.MemoryCacheBackend()
+        statsCollector.get_cached_user_data(cache)
+        collectors["last_albums"].return_value = {0: {"name": "New"}}
+        clock.return_value = 1000.0 + statsCache.get_section_ttl("last_albums") + 1
+        refresh = mocker.spy(statsCollector, "refresh_slices_in_background")
+
+        result = statsCollector.get_cached_user_data(cache)
+
+        assert result["last_albums"] == {}
+        refresh.assert_called_once_with([("last_albums", None)], cache, None)
+        refresh.spy_return.join(timeout=5)
+        assert statsCollector.get_cached_user_data(cache)["last_albums"] == {
+            0: {"name": "New"}
+        }
+
+    def test_stale_section_is_served_when_spotify_fails(
+        self, collectors, mocker, monkeypatch
+    ):
+        """Test that stale data is used instead of an error without serve-stale mode"""
+        monkeypatch.setenv("STATS_SERVE_STALE", "0")
+        clock = mocker.patch("statsCollector.time.time", return_value=1000.0)
+        cache = statsCache.MemoryCacheBackend()
+        statsCollector.get_cached_user_data(cache)
+        collectors["last_albums"].side_effect = RuntimeError("boom")
+        clock.return_value = 1000.0 + statsCache.get_section_ttl("last_albums") + 1
+
+        result = statsCollector.get_cached_user_data(cache)
+
+        assert result["last_albums"] == {}
+        assert collectors["last_albums"].call_count == 2
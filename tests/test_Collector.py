@@ -2,7 +2,9 @@
 # Mostly written by Claude Sonnet 4.5 because I can't be bothered
 
 import pytest
+import statsCache
 import statsCollector
+import statsModel
 
 
 def test_import_spotify_client(mocker, monkeypatch):
@@ -37,6 +39,23 @@ def test_import_spotify_client(mocker, monkeypatch):
     assert spClient == mock_client
 
 
+def test_spotify_client_alternative_urls(mocker, monkeypatch):
+    """Test that the Web API and accounts service URLs can point to a stand-in"""
+    monkeypatch.setenv("SPOTIPY_CLIENT_ID", "fake_client_id")
+    monkeypatch.setenv("SPOTIPY_CLIENT_SECRET", "fake_secret")
+    monkeypatch.setenv("SPOTIPY_REDIRECT_URI", "http://localhost:8080")
+    monkeypatch.setenv("SPOTIFY_REFRESH_TOKEN", "fake_refresh_token")
+    monkeypatch.setenv("SPOTIFY_API_URL", "http://127.0.0.1:8000/")
+    monkeypatch.setenv("SPOTIFY_ACCOUNTS_URL", "http://127.0.0.1:8000")
+    statsCollector.reset_spotify_clients()
+
+    spClient = statsCollector.setup_spotify_client()
+
+    assert spClient.prefix == "http://127.0.0.1:8000/v1/"
+    assert spClient.auth_manager.auth_manager.OAUTH_TOKEN_URL == "http://127.0.0.1:8000/api/token"
+    statsCollector.reset_spotify_clients()
+
+
 class TestGetUserTopArtistsExtended:
     """Extended test suite for get_user_top_artists with edge cases"""
 
@@ -486,3 +505,249 @@ class TestCallSequence:
 
         # Verify order
         assert call_order == ["artists", "songs", "albums"]
+
+
+class TestConcurrentCollection:
+    """Test suite for the concurrent collection mode of get_user_data"""
+
+    @pytest.fixture
+    def mock_spotify(self, mocker):
+        """Fixture to create a mocked Spotify client returning one item per call"""
+        sp = mocker.Mock()
+        sp.current_user_top_artists.return_value = {
+            "items": [
+                {
+                    "name": "Artist",
+                    "images": [{"url": "http://test.com/a.jpg"}],
+                    "genres": ["pop"],
+                }
+            ]
+        }
+        sp.current_user_top_tracks.return_value = {
+            "items": [
+                {
+                    "name": "Song",
+                    "artists": [{"name": "Artist"}],
+                    "album": {"images": [{"url": "http://test.com/s.jpg"}]},
+                }
+            ]
+        }
+        sp.current_user_saved_albums.return_value = {
+            "items": [
+                {
+                    "album": {
+                        "name": "Album",
+                        "artists": [{"name": "Artist"}],
+                        "images": [{"url": "http://test.com/al.jpg"}],
+                    }
+                }
+            ]
+        }
+        return sp
+
+    def test_concurrent_mode_returns_same_shape(self, mock_spotify):
+        """Test that both modes return identical data"""
+        sequential = statsCollector.get_user_data(mock_spotify)
+        concurrent = statsCollector.get_user_data(mock_spotify, concurrent=True)
+
+        assert concurrent == sequential
+        assert list(concurrent["top_artists"].keys()) == ["short_term", "long_term"]
+
+    def test_concurrent_mode_runs_requests_in_parallel(self, mock_spotify):
+        """Test that the five API requests overlap instead of running one after another"""
+        import threading
+
+        barrier = threading.Barrier(5, timeout=5)
+
+        def wait_for_others(*args, **kwargs):
+            barrier.wait()
+            return {"items": []}
+
+        mock_spotify.current_user_top_artists.side_effect = wait_for_others
+        mock_spotify.current_user_top_tracks.side_effect = wait_for_others
+        mock_spotify.current_user_saved_albums.side_effect = wait_for_others
+
+        result = statsCollector.get_user_data_concurrently(mock_spotify, max_workers=5)
+
+        assert result["last_albums"] == {}
+
+    def test_concurrent_mode_reports_errors_per_section(self, mock_spotify):
+        """Test that a failing section doesn't hide the sections that succeeded"""
+        from spotipy.exceptions import SpotifyException
+
+        mock_spotify.current_user_top_tracks.side_effect = SpotifyException(
+            http_status=500, code=-1, msg="Server error"
+        )
+
+        with pytest.raises(statsCollector.CollectionError) as exc_info:
+            statsCollector.get_user_data(mock_spotify, concurrent=True)
+
+        assert list(exc_info.value.errors) == ["top_songs"]
+        assert "top_artists" in exc_info.value.data
+        assert "last_albums" in exc_info.value.data
+        assert "top_songs" not in exc_info.value.data
+
+
+class TestRecentlyPlayedAlbums:
+    """Test suite for the incremental collection of the last played albums"""
+
+    @staticmethod
+    def play(album_id, played_at):
+        return {
+            "played_at": played_at,
+            "track": {
+                "album": {
+                    "id": album_id,
+                    "name": f"Album {album_id}",
+                    "artists": [{"name": "Artist"}],
+                    "images": [{"url": f"http://test.com/{album_id}.jpg"}],
+                }
+            },
+        }
+
+    @pytest.fixture
+    def mock_spotify(self, mocker):
+        sp = mocker.Mock()
+        sp.current_user_recently_played.return_value = {
+            "items": [
+                self.play("b", "2024-01-01T12:10:00.000Z"),
+                self.play("a", "2024-01-01T12:05:00.000Z"),
+                self.play("b", "2024-01-01T12:00:00.000Z"),
+            ],
+            "cursors": {"after": "1704111000000", "before": "1704110400000"},
+        }
+        return sp
+
+    def test_first_collection_builds_history(self, mock_spotify):
+        store = statsCache.MemoryCacheBackend()
+
+        result = statsCollector.get_user_recently_played_albums(mock_spotify, store)
+
+        mock_spotify.current_user_recently_played.assert_called_once_with(limit=50, after=None)
+        assert [album["name"] for album in result.values()] == ["Album b", "Album a"]
+        assert result[0] == {"name": "Album b", "artist": "Artist", "image": "http://test.com/b.jpg"}
+        assert store.get(statsCollector.RECENTLY_PLAYED_HISTORY_KEY)["after"] == "1704111000000"
+
+    def test_only_new_plays_are_fetched_and_merged(self, mock_spotify):
+        store = statsCache.MemoryCacheBackend()
+        statsCollector.get_user_recently_played_albums(mock_spotify, store)
+        mock_spotify.current_user_recently_played.return_value = {
+            "items": [self.play("a", "2024-01-01T13:00:00.000Z")],
+            "cursors": {"after": "1704114000000"},
+        }
+
+        result = statsCollector.get_user_recently_played_albums(mock_spotify, store)
+
+        mock_spotify.current_user_recently_played.assert_called_with(
+            limit=50, after="1704111000000"
+        )
+        assert [album["name"] for album in result.values()] == ["Album a", "Album b"]
+
+    def test_no_new_plays_keeps_cursor(self, mock_spotify):
+        store = statsCache.MemoryCacheBackend()
+        statsCollector.get_user_recently_played_albums(mock_spotify, store)
+        mock_spotify.current_user_recently_played.return_value = {"items": [], "cursors": None}
+
+        result = statsCollector.get_user_recently_played_albums(mock_spotify, store)
+
+        assert len(result) == 2
+        assert store.get(statsCollector.RECENTLY_PLAYED_HISTORY_KEY)["after"] == "1704111000000"
+
+    def test_source_is_opt_in(self, monkeypatch):
+        assert statsCollector._slice_request("last_albums", None)[0] is (
+            statsCollector.get_user_last_listenedTo_albums
+        )
+        monkeypatch.setenv("LAST_ALBUMS_SOURCE", "recently_played")
+        store = statsCache.MemoryCacheBackend()
+
+        function, args = statsCollector._slice_request("last_albums", None, store)
+
+        assert function is statsCollector.get_user_recently_played_albums
+        assert args == (store,)
+
+    def test_unknown_source(self, monkeypatch):
+        monkeypatch.setenv("LAST_ALBUMS_SOURCE", "playlists")
+
+        with pytest.raises(ValueError):
+            statsCollector.get_last_albums_source()
+
+
+class TestLargerCharts:
+    """Test suite for the paginated collection and the batched artist lookups"""
+
+    @staticmethod
+    def artist(i, complete=True):
+        return {
+            "id": f"artist{i}",
+            "name": f"Artist {i}",
+            "images": [{"url": f"http://test.com/{i}.jpg"}],
+            "genres": ["pop"] if complete else [],
+        }
+
+    @pytest.fixture
+    def mock_spotify(self, mocker):
+        sp = mocker.Mock()
+
+        def top_artists(time_range, limit, offset=0):
+            items = [self.artist(i, complete=i % 10) for i in range(offset, min(offset + limit, 80))]
+            return {"items": items, "next": "next" if offset + limit < 80 else None}
+
+        sp.current_user_top_artists.side_effect = top_artists
+        sp.artists.side_effect = lambda ids: {
+            "artists": [self.artist(int(id.removeprefix("artist"))) for id in ids]
+        }
+        return sp
+
+    def test_default_is_a_single_page(self, mock_spotify):
+        result = statsCollector.get_user_top_artists_range(mock_spotify, "short_term")
+
+        mock_spotify.current_user_top_artists.assert_called_once_with(
+            time_range="short_term", limit=5
+        )
+        assert len(result) == 5
+
+    def test_larger_counts_are_paginated(self, mock_spotify, monkeypatch):
+        monkeypatch.setenv("STATS_TOP_ARTISTS_ITEMS", "100")
+
+        result = statsCollector.get_user_top_artists_range(mock_spotify, "short_term")
+
+        assert mock_spotify.current_user_top_artists.call_count == 2
+        mock_spotify.current_user_top_artists.assert_called_with(
+            time_range="short_term", limit=50, offset=50
+        )
+        assert len(result) == 80
+
+    def test_top_artists_are_not_looked_up_again(self, mock_spotify, monkeypatch):
+        """Test that top artists without genres, already full objects, cost no extra call"""
+        monkeypatch.setenv("STATS_TOP_ARTISTS_ITEMS", "80")
+
+        result = statsCollector.get_user_top_artists_range(mock_spotify, "short_term")
+
+        mock_spotify.artists.assert_not_called()
+        assert result[10] == {"name": "Artist 10", "image": "http://test.com/10.jpg", "genre": "N/A"}
+
+    def test_artist_lookups_are_batched(self, mock_spotify):
+        statsCollector.get_artists(mock_spotify, [f"artist{i}" for i in range(120)] + ["artist0"])
+
+        assert [len(call.args[0]) for call in mock_spotify.artists.call_args_list] == [50, 50, 20]
+
+    def test_coverless_songs_get_their_artist_picture(self, mock_spotify):
+        mock_spotify.current_user_top_tracks.return_value = {
+            "items": [
+                {
+                    "name": "Single",
+                    "artists": [{"id": "artist3", "name": "Artist 3"}],
+                    "album": {"images": []},
+                }
+            ]
+        }
+
+        result = statsCollector.get_user_top_songs_range(mock_spotify, "short_term")
+
+        mock_spotify.artists.assert_called_once_with(["artist3"])
+        assert result[0]["image"] == "http://test.com/3.jpg"
+
+    def test_item_count_is_capped(self, monkeypatch):
+        monkeypatch.setenv("STATS_LAST_ALBUMS_ITEMS", "500")
+
+        assert statsModel.get_section_size("last_albums") == statsModel.MAX_ITEMS
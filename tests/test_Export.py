@@ -0,0 +1,91 @@
+# Test suite for exportStats.py
+
+import os
+import pytest
+import exportStats
+import statsImageGenerator
+
+
+STATS = {
+    "top_artists": {
+        "short_term": {0: {"name": "A", "image": "http://test.com/a.jpg", "genre": "pop"}},
+        "long_term": {0: {"name": "A", "image": "http://test.com/a.jpg", "genre": "pop"}},
+    },
+    "top_songs": {
+        "short_term": {0: {"name": "S", "artist": "A", "image": "http://test.com/s.jpg"}},
+        "long_term": {0: {"name": "T", "artist": "A", "image": "http://test.com/t.jpg"}},
+    },
+    "last_albums": {0: {"name": "Al", "artist": "A", "image": "http://test.com/al.jpg"}},
+}
+
+
+@pytest.fixture
+def fetch(mocker):
+    return mocker.patch(
+        "statsImageGenerator.fetch_image_as_base64",
+        return_value="data:image/jpeg;base64,AAAA",
+    )
+
+
+class TestExportStats:
+    """Tests for the static export of every variant"""
+
+    def test_every_variant_and_json_is_exported(self, tmp_path, fetch):
+        results = exportStats.export_stats(str(tmp_path), STATS)
+
+        assert sorted(results) == sorted(os.listdir(tmp_path))
+        assert "stats.json" in results
+        assert "last_albums.svg" in results
+        assert "top_songs_long_term.svg" in results
+        assert len(results) == len(statsImageGenerator.STATS_VARIANTS) + 1
+
+    def test_collects_once(self, tmp_path, fetch, mocker):
+        """Test that a single collection produces every output"""
+        mocker.patch("statsCollector.setup_spotify_client")
+        get_user_data = mocker.patch(
+            "statsCollector.get_user_data", return_value=STATS
+        )
+
+        exportStats.export_stats(str(tmp_path))
+
+        get_user_data.assert_called_once()
+
+    def test_images_are_fetched_once(self, tmp_path, fetch):
+        exportStats.export_stats(str(tmp_path), STATS)
+
+        urls = [call.args[0] for call in fetch.call_args_list]
+        assert sorted(urls) == [
+            "http://test.com/a.jpg",
+            "http://test.com/al.jpg",
+            "http://test.com/s.jpg",
+            "http://test.com/t.jpg",
+        ]
+
+    def test_unchanged_files_are_skipped(self, tmp_path, fetch):
+        exportStats.export_stats(str(tmp_path), STATS)
+        mtime = os.stat(tmp_path / "stats.json").st_mtime_ns
+
+        results = exportStats.export_stats(str(tmp_path), STATS)
+
+        assert set(results.values()) == {"unchanged"}
+        assert os.stat(tmp_path / "stats.json").st_mtime_ns == mtime
+
+
+def test_write_if_changed_leaves_no_temporary_file(tmp_path):
+    path = str(tmp_path / "file.svg")
+
+    assert exportStats.write_if_changed(path, "<svg/>") is True
+    assert exportStats.write_if_changed(path, "<svg/>") is False
+    assert exportStats.write_if_changed(path, "<svg></svg>") is True
+    assert os.listdir(tmp_path) == ["file.svg"]
+
+
+
+def test_write_if_changed_keeps_files_readable(tmp_path, monkeypatch):
+    """Test that exported files get the usual mode instead of the 0600 of temporary files"""
+    monkeypatch.setattr("exportStats.FILE_MODE", 0o644)
+    path = str(tmp_path / "file.svg")
+
+    exportStats.write_if_changed(path, "<svg/>")
+
+    assert os.stat(path).st_mode & 0o777 == 0o644
@@ -0,0 +1,25 @@
+# Test suite for fileUtils.py
+
+import os
+import pytest
+import fileUtils
+
+
+class TestUmask:
+    """Tests for the umask the written files get their mode from"""
+
+    @pytest.mark.skipif(not os.path.exists("/proc/self/status"), reason="Linux only")
+    def test_umask_is_read_without_changing_it(self, mocker):
+        umask = os.umask(0o027)
+        os.umask(0o027)
+        try:
+            setUmask = mocker.patch("os.umask")
+
+            assert fileUtils.get_umask() == 0o027
+            setUmask.assert_not_called()
+        finally:
+            mocker.stopall()
+            os.umask(umask)
+
+    def test_file_mode_follows_umask(self):
+        assert fileUtils.FILE_MODE == 0o666 & ~fileUtils.get_umask()
@@ -0,0 +1,50 @@
+# Test suite for httpSessions.py
+
+import httpSessions
+
+
+class TestHttpSessions:
+    """Tests for the shared pooled sessions"""
+
+    def test_session_is_shared(self):
+        httpSessions.reset_sessions()
+
+        assert httpSessions.get_session("images") is httpSessions.get_session("images")
+        assert httpSessions.get_session("images") is not httpSessions.get_session("spotify")
+
+    def test_pool_and_retry_settings(self, monkeypatch):
+        monkeypatch.setenv("HTTP_POOL_SIZE", "4")
+        monkeypatch.setenv("HTTP_RETRIES", "2")
+
+        adapter = httpSessions.create_session().get_adapter("https://i.scdn.co/image/x")
+
+        assert adapter._pool_maxsize == 4
+        assert adapter.max_retries.total == 2
+        assert 503 in adapter.max_retries.status_forcelist
+        assert 429 not in adapter.max_retries.status_forcelist
+        assert adapter.max_retries.backoff_jitter > 0
+
+    def test_backoff_matches_urllib3(self):
+        """Test that the backoff of the async retries is the one of the sync sessions"""
+        from urllib3.util.retry import RequestHistory, Retry
+
+        retry = Retry(total=5, backoff_factor=0.3)
+        error = RequestHistory("GET", "/", None, 503, None)
+        for errors in range(1, 5):
+            expected = retry.new(history=(error,) * errors).get_backoff_time()
+
+            assert httpSessions.get_backoff(errors, 0.3, 0) == expected
+
+    def test_spotify_client_uses_shared_session(self, mocker, monkeypatch):
+        import statsCollector
+
+        monkeypatch.setenv("SPOTIPY_CLIENT_ID", "session_client_id")
+        statsCollector.reset_spotify_clients()
+        mock_oauth = mocker.patch("statsCollector.SpotifyOAuth")
+        mock_spotify = mocker.patch("statsCollector.spotipy.Spotify")
+
+        statsCollector.setup_spotify_client()
+
+        session = httpSessions.get_session("spotify")
+        assert mock_spotify.call_args[1]["requests_session"] is session
+        assert mock_oauth.call_args[1]["requests_session"] is session
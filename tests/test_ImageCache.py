@@ -0,0 +1,86 @@
+# Test suite for imageCache.py and its use in statsImageGenerator.py
+
+import pytest
+import imageCache
+import statsImageGenerator
+
+
+class TestImageCache:
+    """Tests for the two-tier image cache"""
+
+    def test_memory_hit(self):
+        cache = imageCache.ImageCache()
+        cache.set("http://test.com/a.jpg", "data:image/jpeg;base64,AAAA")
+
+        assert cache.get("http://test.com/a.jpg") == "data:image/jpeg;base64,AAAA"
+        assert cache.get_stats()["memory_hits"] == 1
+
+    def test_miss_is_counted(self):
+        cache = imageCache.ImageCache()
+
+        assert cache.get("http://test.com/a.jpg") is None
+        assert cache.get_stats()["misses"] == 1
+
+    def test_memory_is_limited_in_bytes(self):
+        """Test that the least recently used images are evicted past the byte limit"""
+        cache = imageCache.ImageCache(max_memory_bytes=10)
+        cache.set("a", "x" * 6)
+        cache.set("b", "y" * 6)
+
+        assert cache.get_stats()["memory_evictions"] == 1
+        assert cache.get_stats()["memory_bytes"] == 6
+
+    def test_disk_tier_survives_a_new_process(self, tmp_path):
+        """Test that images written to disk are found by a fresh cache"""
+        imageCache.ImageCache(disk_dir=str(tmp_path)).set("a", "data:AAAA")
+
+        cache = imageCache.ImageCache(disk_dir=str(tmp_path))
+
+        assert cache.get("a") == "data:AAAA"
+        assert cache.get_stats()["disk_hits"] == 1
+        assert cache.get("a") == "data:AAAA"
+        assert cache.get_stats()["memory_hits"] == 1
+
+    def test_disk_files_are_readable(self, tmp_path, monkeypatch):
+        monkeypatch.setattr("imageCache.FILE_MODE", 0o644)
+        imageCache.ImageCache(disk_dir=str(tmp_path)).set("a", "data:AAAA")
+
+        assert [path.stat().st_mode & 0o777 for path in tmp_path.iterdir()] == [0o644]
+
+    def test_disk_tier_is_limited_in_bytes(self, tmp_path):
+        cache = imageCache.ImageCache(disk_dir=str(tmp_path), max_disk_bytes=10)
+        cache.set("a", "x" * 6)
+        cache.set("b", "y" * 6)
+
+        assert cache.get_stats()["disk_evictions"] == 1
+        assert cache.get_stats()["disk_bytes"] <= 10
+        assert len(list(tmp_path.iterdir())) == 1
+
+
+class TestFetchImageAsBase64Caching:
+    """Tests for the cache in front of fetch_image_as_base64"""
+
+    @pytest.fixture(autouse=True)
+    def fresh_cache(self):
+        imageCache.set_image_cache(imageCache.ImageCache())
+        yield
+        imageCache.set_image_cache(None)
+
+    def test_second_fetch_does_no_network_io(self, mocker):
+        response = mocker.Mock(content=b"image", headers={"content-type": "image/jpeg"})
+        get = mocker.patch("httpSessions.get_session").return_value.get
+        get.return_value = response
+
+        first = statsImageGenerator.fetch_image_as_base64("http://test.com/a.jpg")
+        second = statsImageGenerator.fetch_image_as_base64("http://test.com/a.jpg")
+
+        assert first == second == "data:image/jpeg;base64,aW1hZ2U="
+        get.assert_called_once()
+
+    def test_failed_fetch_is_not_cached(self, mocker):
+        get = mocker.patch("httpSessions.get_session").return_value.get
+        get.side_effect = ConnectionError("down")
+
+        assert statsImageGenerator.fetch_image_as_base64("http://test.com/a.jpg") is None
+        assert statsImageGenerator.fetch_image_as_base64("http://test.com/a.jpg") is None
+        assert get.call_count == 2
@@ -0,0 +1,368 @@
+# Test suite for statsImageGenerator.py
+
+import json
+import os
+import threading
+import time
+from io import BytesIO
+import pytest
+import imageCache
+import statsCollector
+import statsImageGenerator
+
+
+def make_stats(num_items=5):
+    return {
+        "top_artists": {
+            "short_term": {
+                i: {"name": f"Artist {i}", "image": f"http://test.com/{i}.jpg", "genre": "pop"}
+                for i in range(num_items)
+            },
+            "long_term": {},
+        },
+        "top_songs": {"short_term": {}, "long_term": {}},
+        "last_albums": {},
+    }
+
+
+class TestFetchImagesAsBase64:
+    """Tests for the concurrent image download"""
+
+    def test_images_are_fetched_in_parallel(self, mocker):
+        """Test that all images are downloaded at the same time"""
+        barrier = threading.Barrier(5, timeout=5)
+
+        def fetch(url, size=None):
+            barrier.wait()
+            return f"data:image/jpeg;base64,{url}"
+
+        mocker.patch("statsImageGenerator.fetch_image_as_base64", side_effect=fetch)
+        urls = [f"http://test.com/{i}.jpg" for i in range(5)]
+
+        images = statsImageGenerator.fetch_images_as_base64(urls, deadline=5)
+
+        assert images == {url: f"data:image/jpeg;base64,{url}" for url in urls}
+
+    def test_duplicate_urls_are_fetched_once(self, mocker):
+        fetch = mocker.patch(
+            "statsImageGenerator.fetch_image_as_base64", return_value="data:"
+        )
+
+        statsImageGenerator.fetch_images_as_base64(["http://a", "http://a", None])
+
+        fetch.assert_called_once_with("http://a", None)
+
+    def test_late_images_are_none(self, mocker):
+        """Test that images missing the deadline don't block the result"""
+
+        def fetch(url, size=None):
+            if "slow" in url:
+                time.sleep(1)
+            return "data:image/jpeg;base64,AAAA"
+
+        mocker.patch("statsImageGenerator.fetch_image_as_base64", side_effect=fetch)
+
+        start = time.monotonic()
+        images = statsImageGenerator.fetch_images_as_base64(
+            ["http://fast", "http://slow"], deadline=0.2
+        )
+
+        assert time.monotonic() - start < 0.9
+        assert images["http://fast"] is not None
+        assert images["http://slow"] is None
+
+
+class TestCreateSpotifyInfographic:
+    """Tests for the SVG rendering"""
+
+    def test_missed_deadline_renders_placeholder(self, mocker):
+        """Test that a card whose image missed the deadline gets the placeholder"""
+
+        def fetch(url, size=None):
+            if url.endswith("0.jpg"):
+                time.sleep(1)
+            return "data:image/jpeg;base64,AAAA"
+
+        mocker.patch("statsImageGenerator.fetch_image_as_base64", side_effect=fetch)
+
+        svg = statsImageGenerator.create_spotify_infographic(
+            make_stats(), "artists", "short_term", image_deadline=0.2
+        )
+
+        assert svg.count('href="data:image/jpeg;base64,AAAA"') == 4
+        assert svg.count("♪") == 1
+
+    def test_unknown_section_returns_none(self):
+        assert statsImageGenerator.create_spotify_infographic(make_stats(), "nope") is None
+
+    @pytest.mark.parametrize("section_type,time_range", statsImageGenerator.STATS_VARIANTS)
+    def test_output_matches_golden_files(self, section_type, time_range):
+        """Test that the templates render byte-identical SVGs to the previous renderer"""
+        fixtures = os.path.join(os.path.dirname(__file__), "fixtures")
+        with open(os.path.join(fixtures, "render_stats.json"), encoding="utf-8") as f:
+            fixture = json.load(f)
+        name = "last_albums" if section_type == "last_albums" else f"{section_type}_{time_range}"
+        with open(os.path.join(fixtures, f"{name}.svg"), encoding="utf-8") as f:
+            expected = f.read()
+
+        svg = statsImageGenerator.create_spotify_infographic(
+            fixture["stats"], section_type, time_range, images=fixture["images"]
+        )
+
+        assert svg == expected
+
+
+class TestMultiRowLayout:
+    """Tests for the layout of sections with more items than columns"""
+
+    def test_cards_wrap_to_new_rows(self, monkeypatch):
+        monkeypatch.setenv("STATS_TOP_ARTISTS_ITEMS", "12")
+
+        svg = statsImageGenerator.create_spotify_infographic(
+            make_stats(12), "artists", images={}
+        )
+
+        # 3 rows of 190px cards with 8px between them, under the title
+        assert '<svg width="706" height="643"' in svg
+        assert svg.count("♪") == 12
+        # First card of the third row
+        assert '<rect x="12" y="441" width="130" height="190"' in svg
+
+    def test_items_past_the_setting_are_not_rendered(self):
+        svg = statsImageGenerator.create_spotify_infographic(
+            make_stats(8), "artists", images={}
+        )
+
+        assert svg.count("♪") == 5
+        assert statsImageGenerator.get_infographic_etag(
+            make_stats(8), "artists"
+        ) == statsImageGenerator.get_infographic_etag(make_stats(5), "artists")
+
+
+class TestIterSpotifyInfographic:
+    """Tests for the streamed SVG rendering"""
+
+    def test_header_is_yielded_before_images_are_fetched(self, mocker):
+        fetch = mocker.patch(
+            "statsImageGenerator.fetch_image_as_base64",
+            return_value="data:image/jpeg;base64,AAAA",
+        )
+        chunks = statsImageGenerator.iter_spotify_infographic(make_stats(), "artists")
+
+        assert next(chunks).startswith("<svg")
+        fetch.assert_not_called()
+        list(chunks)
+        assert sorted(call.args for call in fetch.call_args_list) == [
+            (f"http://test.com/{i}.jpg", 228) for i in range(5)
+        ]
+
+    def test_one_chunk_per_card(self, mocker):
+        mocker.patch(
+            "statsImageGenerator.fetch_image_as_base64",
+            return_value="data:image/jpeg;base64,AAAA",
+        )
+        chunks = list(statsImageGenerator.iter_spotify_infographic(make_stats(), "artists"))
+
+        # Header, five cards and the footer
+        assert len(chunks) == 7
+        assert all(chunk.count("data:image/jpeg;base64,AAAA") == 1 for chunk in chunks[1:6])
+        assert "".join(chunks) == statsImageGenerator.create_spotify_infographic(
+            make_stats(), "artists"
+        )
+
+    def test_downloads_stay_ahead_of_the_cards(self, mocker, monkeypatch):
+        """Test that only IMAGE_FETCH_WORKERS images are downloaded ahead of the card being yielded"""
+        monkeypatch.setenv("IMAGE_FETCH_WORKERS", "2")
+        released = threading.Event()
+        started = []
+
+        def fetch(url, size=None):
+            started.append(url)
+            if url != "http://test.com/0.jpg":
+                released.wait(timeout=5)
+            return "data:image/jpeg;base64,AAAA"
+
+        mocker.patch("statsImageGenerator.fetch_image_as_base64", side_effect=fetch)
+        chunks = statsImageGenerator.iter_spotify_infographic(make_stats(), "artists")
+        next(chunks)
+        next(chunks)
+        time.sleep(0.1)
+
+        assert sorted(started) == [f"http://test.com/{i}.jpg" for i in range(3)]
+        released.set()
+        assert "".join(chunks).count('href="data:image/jpeg;base64,AAAA"') == 4
+
+    def test_images_missing_the_deadline_get_placeholder(self, mocker):
+        """Test that slow images only cost the deadline once, whatever their number"""
+
+        def fetch(url, size=None):
+            time.sleep(1 if url in ("http://test.com/1.jpg", "http://test.com/3.jpg") else 0.05)
+            return "data:image/jpeg;base64,AAAA"
+
+        mocker.patch("statsImageGenerator.fetch_image_as_base64", side_effect=fetch)
+
+        startTime = time.monotonic()
+        svg = "".join(
+            statsImageGenerator.iter_spotify_infographic(
+                make_stats(), "artists", image_deadline=0.2
+            )
+        )
+
+        assert time.monotonic() - startTime < 0.5
+        assert svg.count('href="data:image/jpeg;base64,AAAA"') == 3
+        assert svg.count("♪") == 2
+
+    def test_returns_whether_every_image_made_it(self, mocker):
+        fetch = mocker.patch(
+            "statsImageGenerator.fetch_image_as_base64",
+            return_value="data:image/jpeg;base64,AAAA",
+        )
+
+        def render():
+            chunks = statsImageGenerator.iter_spotify_infographic(make_stats(), "artists")
+            while True:
+                try:
+                    next(chunks)
+                except StopIteration as done:
+                    return done.value
+
+        assert render() is True
+        fetch.return_value = None
+        assert render() is False
+
+
+class TestSharedImages:
+    """Tests for the images shown by several cards, embedded once and referenced with <use>"""
+
+    @pytest.fixture
+    def stats(self):
+        """Top songs where the first, third and fourth songs are from the same album"""
+        covers = ["album", "single", "album", "album", "other"]
+        songs = {
+            i: {"name": f"Song {i}", "artist": "Artist", "image": f"http://test.com/{cover}.jpg"}
+            for i, cover in enumerate(covers)
+        }
+        return {
+            "top_artists": {"short_term": {}, "long_term": {}},
+            "top_songs": {"short_term": songs, "long_term": {}},
+            "last_albums": {},
+        }
+
+    def fetch(self, url, size=None):
+        return f"data:image/jpeg;base64,{url.split('/')[-1]}"
+
+    def test_shared_image_is_embedded_once(self, stats):
+        urls = ["http://test.com/album.jpg", "http://test.com/single.jpg", "http://test.com/other.jpg"]
+
+        svg = statsImageGenerator.create_spotify_infographic(
+            stats, "top_songs", images={url: self.fetch(url) for url in urls}
+        )
+
+        assert svg.count("data:image/jpeg;base64,album.jpg") == 1
+        assert svg.count('<image id="image-0"') == 1
+        assert svg.count('<use href="#image-0"') == 3
+        # The covers shown once are still inlined in their card
+        assert svg.count('href="data:image/jpeg;base64,single.jpg"') == 1
+        assert "<use" not in svg.replace('<use href="#image-0"', "")
+        # The card of the fourth song places the shared image where its own image would be
+        assert '<use href="#image-0" x="434" y="53"/>' in svg
+
+    def test_shared_image_is_fetched_once_when_streamed(self, stats, mocker):
+        fetch = mocker.patch("statsImageGenerator.fetch_image_as_base64", side_effect=self.fetch)
+
+        svg = "".join(statsImageGenerator.iter_spotify_infographic(stats, "top_songs"))
+
+        assert sorted(call.args[0] for call in fetch.call_args_list) == [
+            "http://test.com/album.jpg",
+            "http://test.com/other.jpg",
+            "http://test.com/single.jpg",
+        ]
+        assert svg == statsImageGenerator.create_spotify_infographic(stats, "top_songs")
+
+    def test_failed_shared_image_gets_placeholders(self, stats, mocker):
+        fetch = mocker.patch(
+            "statsImageGenerator.fetch_image_as_base64",
+            side_effect=lambda url, size=None: None if "album" in url else self.fetch(url),
+        )
+
+        svg = "".join(statsImageGenerator.iter_spotify_infographic(stats, "top_songs"))
+
+        assert svg.count("♪") == 3
+        assert "<use" not in svg
+        assert fetch.call_count == 3
+
+
+class TestImageResizing:
+    """Tests for the downscaling of images before they are embedded"""
+
+    @pytest.fixture(autouse=True)
+    def fresh_cache(self):
+        imageCache.set_image_cache(imageCache.ImageCache())
+        yield
+        imageCache.set_image_cache(None)
+
+    @pytest.fixture
+    def large_jpeg(self):
+        from PIL import Image
+
+        output = BytesIO()
+        Image.effect_noise((640, 640), 64).convert("RGB").save(output, format="JPEG")
+        return output.getvalue()
+
+    def test_resize_image_fits_requested_size(self, large_jpeg):
+        from PIL import Image
+
+        content, content_type = statsImageGenerator.resize_image(
+            large_jpeg, 128, "JPEG", 80
+        )
+
+        assert content_type == "image/jpeg"
+        assert len(content) < len(large_jpeg)
+        assert Image.open(BytesIO(content)).size == (128, 128)
+
+    def test_resize_image_to_webp(self, large_jpeg):
+        content, content_type = statsImageGenerator.resize_image(
+            large_jpeg, 128, "WEBP", 80
+        )
+
+        assert content_type == "image/webp"
+
+    def test_fetch_caches_original_and_resized_image(self, mocker, large_jpeg):
+        """Test that both variants are cached and a new size doesn't download again"""
+        response = mocker.Mock(content=large_jpeg, headers={"content-type": "image/jpeg"})
+        get = mocker.patch("httpSessions.get_session").return_value.get
+        get.return_value = response
+
+        small = statsImageGenerator.fetch_image_as_base64("http://test.com/a.jpg", 128)
+        statsImageGenerator.fetch_image_as_base64("http://test.com/a.jpg", 128)
+        statsImageGenerator.fetch_image_as_base64("http://test.com/a.jpg", 256)
+        original = statsImageGenerator.fetch_image_as_base64("http://test.com/a.jpg")
+
+        get.assert_called_once()
+        assert len(small) < len(original)
+
+
+class TestPickImageUrl:
+    """Tests for the choice of the Spotify image variant"""
+
+    images = [
+        {"url": "http://test.com/640.jpg", "width": 640, "height": 640},
+        {"url": "http://test.com/300.jpg", "width": 300, "height": 300},
+        {"url": "http://test.com/64.jpg", "width": 64, "height": 64},
+    ]
+
+    def test_largest_image_by_default(self, monkeypatch):
+        monkeypatch.delenv("SPOTIFY_IMAGE_MIN_SIZE", raising=False)
+
+        assert statsCollector.pick_image_url(self.images) == "http://test.com/640.jpg"
+
+    def test_smallest_image_above_min_size(self):
+        assert (
+            statsCollector.pick_image_url(self.images, min_size=268)
+            == "http://test.com/300.jpg"
+        )
+
+    def test_falls_back_to_first_image_without_sizes(self):
+        images = [{"url": "http://test.com/a.jpg"}, {"url": "http://test.com/b.jpg"}]
+
+        assert statsCollector.pick_image_url(images, min_size=268) == "http://test.com/a.jpg"
@@ -0,0 +1,148 @@
+# Test suite for metrics.py and the Server-Timing header and /metrics endpoint
+
+import threading
+import pytest
+import metrics
+import statsCache
+import statsCollector
+
+
+@pytest.fixture(autouse=True)
+def registry():
+    """Fixture giving each test an empty registry"""
+    metrics.reset_registry()
+    yield metrics.get_registry()
+    metrics.reset_registry()
+
+
+class TestRegistry:
+    """Tests for the counters, histograms and their Prometheus export"""
+
+    def test_histogram_export(self, registry):
+        registry.observe("stage_duration_seconds", 0.02, {"stage": "render"})
+        registry.observe("stage_duration_seconds", 3.0, {"stage": "render"})
+
+        text = registry.render()
+
+        assert "# TYPE spotify_stats_stage_duration_seconds histogram" in text
+        assert 'spotify_stats_stage_duration_seconds_bucket{stage="render",le="0.025"} 1' in text
+        assert 'spotify_stats_stage_duration_seconds_bucket{stage="render",le="+Inf"} 2' in text
+        assert 'spotify_stats_stage_duration_seconds_count{stage="render"} 2' in text
+
+    def test_cache_hit_ratio(self, registry):
+        metrics.cache_lookup("stats", "hit")
+        metrics.cache_lookup("stats", "stale")
+        metrics.cache_lookup("stats", "miss")
+        metrics.cache_lookup("stats", "hit")
+
+        text = registry.render()
+
+        assert 'spotify_stats_cache_lookups_total{cache="stats",result="hit"} 2' in text
+        assert 'spotify_stats_cache_hit_ratio{cache="stats"} 0.75' in text
+
+
+class TestTimer:
+    """Tests for the timing of the stages"""
+
+    def test_stage_is_recorded(self, registry):
+        timings = metrics.start_timings()
+
+        with metrics.timer("render"):
+            pass
+
+        assert registry.get_histogram("stage_duration_seconds", {"stage": "render"})["count"] == 1
+        assert timings.server_timing().startswith("render;dur=")
+
+    def test_errors_are_counted(self, registry):
+        @metrics.timed("spotify_top_artists")
+        def fail():
+            raise RuntimeError("down")
+
+        with pytest.raises(RuntimeError):
+            fail()
+
+        assert registry.get_counter("stage_errors_total", {"stage": "spotify_top_artists"}) == 1
+
+    def test_worker_threads_count_for_the_request(self):
+        timings = metrics.start_timings()
+
+        @metrics.timed("image_download")
+        def download():
+            pass
+
+        threads = [threading.Thread(target=metrics.propagate(download)) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert timings.stages["image_download"][1] == 3
+        assert 'image_download;dur=' in timings.server_timing()
+        assert 'desc="3 calls"' in timings.server_timing()
+
+
+class TestCollectorInstrumentation:
+    """Tests for the instrumentation of the collection"""
+
+    def test_api_calls_and_errors_are_recorded(self, registry, mocker):
+        sp = mocker.Mock()
+        sp.current_user_top_artists.return_value = {"items": []}
+        sp.current_user_saved_albums.side_effect = Exception("Service unavailable")
+        timings = metrics.start_timings()
+
+        with pytest.raises(statsCollector.CollectionError):
+            statsCollector.collect_slices_concurrently(
+                sp, [("top_artists", "short_term"), ("last_albums", None)]
+            )
+
+        assert "spotify_top_artists" in timings.stages
+        assert "spotify_saved_albums" in timings.stages
+        assert registry.get_counter(
+            "upstream_errors_total", {"upstream": "spotify", "section": "last_albums"}
+        ) == 1
+
+
+class TestEndpoints:
+    """Tests for the Server-Timing header and the /metrics endpoint"""
+
+    @pytest.fixture
+    def client(self, mocker):
+        from api import index
+
+        statsCache.set_cache(statsCache.MemoryCacheBackend())
+        sp = mocker.Mock()
+        sp.current_user_saved_albums.return_value = {"items": []}
+        mocker.patch("statsCollector.get_tenant_client", return_value=sp)
+        yield index.app.test_client()
+        statsCache.set_cache(None)
+
+    def test_server_timing(self, client):
+        response = client.get("/json?fields=last_albums")
+
+        assert "spotify_saved_albums;dur=" in response.headers["Server-Timing"]
+        assert "total;dur=" in response.headers["Server-Timing"]
+
+    def test_server_timing_can_be_disabled(self, client, monkeypatch):
+        monkeypatch.setenv("SERVER_TIMING", "0")
+
+        assert "Server-Timing" not in client.get("/json?fields=last_albums").headers
+
+    def test_metrics_endpoint(self, client):
+        client.get("/json?fields=last_albums")
+        client.get("/json?fields=last_albums")
+
+        response = client.get("/metrics")
+
+        assert response.mimetype == "text/plain"
+        text = response.get_data(as_text=True)
+        assert 'spotify_stats_cache_hit_ratio{cache="stats"} 0.5' in text
+        assert 'spotify_stats_request_duration_seconds_count{endpoint="get_stats",status="200"} 2' in text
+        assert 'spotify_stats_response_size_bytes_count{endpoint="get_stats"} 2' in text
+        assert 'stage="spotify_saved_albums"' in text
+
+    def test_metrics_token(self, client, monkeypatch):
+        monkeypatch.setenv("METRICS_TOKEN", "secret")
+
+        assert client.get("/metrics").status_code == 401
+        assert client.get("/metrics", headers={"Authorization": "Bearer other"}).status_code == 401
+        assert client.get("/metrics", headers={"Authorization": "Bearer secret"}).status_code == 200
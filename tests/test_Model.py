@@ -0,0 +1,95 @@
+# Test suite for statsModel.py and the compact stats in the cache, collector and renderer
+
+import pytest
+import statsCache
+import statsCollector
+import statsImageGenerator
+import statsModel
+
+
+ARTISTS = {
+    0: {"name": "Artist", "image": "http://test.com/a.jpg", "genre": "pop"},
+    1: {"name": "Other", "image": "http://test.com/b.jpg", "genre": "N/A"},
+}
+ALBUMS = {0: {"name": "Album", "artist": "Artist", "image": "http://test.com/c.jpg"}}
+
+
+class TestConversions:
+    """Tests for the conversions between records, rows and the legacy shape"""
+
+    def test_legacy_round_trip(self):
+        records = statsModel.from_legacy("top_artists", ARTISTS)
+
+        assert records[0] == statsModel.Artist("Artist", "http://test.com/a.jpg", "pop")
+        assert statsModel.to_legacy(records) == ARTISTS
+
+    def test_unused_fields_are_dropped(self):
+        records = statsModel.from_legacy(
+            "last_albums", {0: dict(ALBUMS[0], release_date="2020", popularity=50)}
+        )
+
+        assert statsModel.to_legacy(records) == ALBUMS
+
+    def test_serialization_round_trip(self):
+        records = statsModel.from_legacy("last_albums", ALBUMS)
+        data = statsModel.dumps(records)
+
+        assert data == '[["Album","Artist","http://test.com/c.jpg"]]'
+        assert statsModel.loads("last_albums", data) == records
+
+    def test_unknown_section(self):
+        with pytest.raises(ValueError):
+            statsModel.get_record_type("playlists")
+
+
+class TestCompactCollection:
+    """Tests for the compact slices in the cache and the collector"""
+
+    @pytest.fixture
+    def cache(self, mocker):
+        cache = statsCache.MemoryCacheBackend()
+        mocker.patch("statsCollector.get_tenant_client")
+        mocker.patch(
+            "statsCollector.collect_slices_concurrently",
+            return_value={"top_artists": {"short_term": ARTISTS}, "last_albums": ALBUMS},
+        )
+        statsCollector.collect(["top_artists", "last_albums"], ["short_term"], cache=cache)
+        return cache
+
+    def test_slices_are_cached_as_rows(self, cache):
+        assert cache.get("section:last_albums")["rows"] == [
+            ["Album", "Artist", "http://test.com/c.jpg"]
+        ]
+
+    def test_cached_slices_in_both_shapes(self, cache):
+        legacy = statsCollector.collect(["top_artists"], ["short_term"], cache=cache)
+        compact = statsCollector.collect(
+            ["top_artists"], ["short_term"], cache=cache, compact=True
+        )
+
+        assert legacy == {"top_artists": {"short_term": ARTISTS}}
+        assert compact == {
+            "top_artists": {"short_term": statsModel.from_legacy("top_artists", ARTISTS)}
+        }
+
+    def test_legacy_cache_entries_are_read(self, cache):
+        """Test that slices cached before the compact model are still served"""
+        cache.set("section:last_albums", {"fetched_at": 2e9, "data": ALBUMS})
+
+        assert statsCollector.collect(["last_albums"], cache=cache)["last_albums"] == ALBUMS
+
+
+class TestCompactRendering:
+    """Tests for the rendering of compact stats"""
+
+    def test_same_render_and_etag_for_both_shapes(self):
+        legacy = {"last_albums": ALBUMS}
+        compact = {"last_albums": statsModel.from_legacy("last_albums", ALBUMS)}
+        images = {"http://test.com/c.jpg": "data:image/jpeg;base64,AAAA"}
+
+        assert statsImageGenerator.create_spotify_infographic(
+            compact, "last_albums", images=images
+        ) == statsImageGenerator.create_spotify_infographic(legacy, "last_albums", images=images)
+        assert statsImageGenerator.get_infographic_etag(
+            compact, "last_albums"
+        ) == statsImageGenerator.get_infographic_etag(legacy, "last_albums")
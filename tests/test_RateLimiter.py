@@ -0,0 +1,191 @@
+# Test suite for rateLimiter.py and the handling of Spotify rate limits by the collector and the API
+
+import asyncio
+import threading
+import time
+import pytest
+import spotipy
+import metrics
+import rateLimiter
+import statsCache
+import statsCollector
+
+
+@pytest.fixture(autouse=True)
+def limiter():
+    """Fixture giving each test a new limiter and registry"""
+    rateLimiter.reset_limiter()
+    metrics.reset_registry()
+    yield rateLimiter.get_limiter()
+    rateLimiter.reset_limiter()
+    metrics.reset_registry()
+
+
+def too_many_requests(retry_after="30"):
+    return spotipy.SpotifyException(
+        429, -1, "API rate limit exceeded", headers={"Retry-After": retry_after}
+    )
+
+
+class TestTokenBucket:
+    """Tests for the pacing of the requests"""
+
+    def test_burst_then_paced(self):
+        limiter = rateLimiter.RateLimiter(rate=20, burst=2)
+
+        assert limiter.acquire() < 0.01
+        assert limiter.acquire() < 0.01
+        assert 0.02 < limiter.acquire() < 0.2
+
+    def test_max_wait(self):
+        limiter = rateLimiter.RateLimiter(rate=1, burst=1)
+        limiter.acquire()
+
+        with pytest.raises(rateLimiter.RateLimitedError):
+            limiter.acquire(max_wait=0.05)
+        assert metrics.get_registry().get_counter(
+            "rate_limited_total", {"priority": "interactive", "reason": "max_wait"}
+        ) == 1
+
+    def test_retry_after_holds_requests_back(self):
+        limiter = rateLimiter.RateLimiter(rate=0, burst=1)
+        limiter.throttle(30)
+
+        with pytest.raises(rateLimiter.RateLimitedError) as e:
+            limiter.acquire(max_wait=1)
+
+        assert e.value.retry_after > 29
+        assert limiter.is_throttled()
+
+    def test_interactive_requests_go_first(self):
+        """Test that a waiting interactive request gets the next token before a background one"""
+        limiter = rateLimiter.RateLimiter(rate=10, burst=1)
+        limiter.acquire()
+        served = []
+
+        def acquire(priority):
+            limiter.acquire(priority, max_wait=2)
+            served.append(priority)
+
+        background = threading.Thread(target=acquire, args=(rateLimiter.BACKGROUND,))
+        background.start()
+        time.sleep(0.02)
+        interactive = threading.Thread(target=acquire, args=(rateLimiter.INTERACTIVE,))
+        interactive.start()
+        background.join()
+        interactive.join()
+
+        assert served == [rateLimiter.INTERACTIVE, rateLimiter.BACKGROUND]
+
+    def test_async_acquire_waits_without_a_thread(self, mocker):
+        """Test that async requests sleep on the event loop until their token, paced like sync ones"""
+        limiter = rateLimiter.RateLimiter(rate=20, burst=1)
+        toThread = mocker.spy(asyncio, "to_thread")
+
+        async def acquire_all():
+            return await asyncio.gather(*(limiter.acquire_async() for _ in range(3)))
+
+        waits = asyncio.run(acquire_all())
+
+        assert sorted(waits)[0] < 0.01
+        assert 0.08 < max(waits) < 0.3
+        toThread.assert_not_called()
+
+    def test_async_acquire_max_wait(self):
+        limiter = rateLimiter.RateLimiter(rate=0, burst=1)
+        limiter.throttle(30)
+
+        with pytest.raises(rateLimiter.RateLimitedError):
+            asyncio.run(limiter.acquire_async(max_wait=0.05))
+        assert limiter.get_state()["waiting"] == {"interactive": 0, "background": 0}
+
+    def test_priority_of_the_context(self):
+        with rateLimiter.priority(rateLimiter.BACKGROUND):
+            assert rateLimiter.get_priority() == rateLimiter.BACKGROUND
+        assert rateLimiter.get_priority() == rateLimiter.INTERACTIVE
+
+
+class TestRateLimitedSpotify:
+    """Tests for the proxy of the spotipy client"""
+
+    def test_request_is_retried_after_retry_after(self, mocker):
+        sp = mocker.Mock()
+        sp.current_user_saved_albums.side_effect = [too_many_requests("0.05"), {"items": []}]
+
+        result = rateLimiter.limit(sp).current_user_saved_albums(limit=3)
+
+        assert result == {"items": []}
+        assert sp.current_user_saved_albums.call_count == 2
+
+    def test_interactive_request_does_not_wait_out_long_retry_after(self, mocker):
+        sp = mocker.Mock()
+        sp.current_user_saved_albums.side_effect = too_many_requests("30")
+
+        start = time.monotonic()
+        with pytest.raises(rateLimiter.RateLimitedError):
+            rateLimiter.limit(sp).current_user_saved_albums(limit=3)
+
+        assert time.monotonic() - start < 1
+        sp.current_user_saved_albums.assert_called_once()
+
+    def test_other_errors_are_raised(self, mocker):
+        sp = mocker.Mock()
+        sp.current_user_saved_albums.side_effect = spotipy.SpotifyException(404, -1, "Not found")
+
+        with pytest.raises(spotipy.SpotifyException):
+            rateLimiter.limit(sp).current_user_saved_albums(limit=3)
+        assert sp.current_user_saved_albums.call_count == 1
+
+    def test_attributes_are_forwarded(self, mocker):
+        sp = mocker.Mock(prefix="https://api.spotify.com/v1/")
+        proxy = rateLimiter.limit(sp)
+
+        assert proxy.prefix == "https://api.spotify.com/v1/"
+        assert rateLimiter.limit(proxy) is proxy
+
+
+class TestThrottledCollection:
+    """Tests for the fallback to the cache while Spotify rate limits requests"""
+
+    @pytest.fixture
+    def sp(self, mocker):
+        sp = mocker.Mock()
+        sp.current_user_saved_albums.side_effect = too_many_requests("30")
+        mocker.patch("statsCollector.get_tenant_client", return_value=sp)
+        return sp
+
+    def test_stale_stats_are_served(self, sp, monkeypatch):
+        monkeypatch.setenv("STATS_SERVE_STALE", "0")
+        cache = statsCache.MemoryCacheBackend()
+        cache.set("section:last_albums", {"fetched_at": 0, "rows": [["Album", "Artist", None]]})
+
+        stats = statsCollector.collect(["last_albums"], cache=cache)
+
+        assert stats["last_albums"] == {0: {"name": "Album", "artist": "Artist"}}
+
+    def test_api_answers_503_without_cached_stats(self, sp):
+        from api import index
+
+        statsCache.set_cache(statsCache.MemoryCacheBackend())
+        response = index.app.test_client().get("/json?fields=last_albums")
+        statsCache.set_cache(None)
+
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "30"
+
+    def test_state_in_metrics(self, sp, monkeypatch):
+        from api import index
+
+        monkeypatch.setenv("SPOTIFY_RATE_LIMIT", "0.01")
+        monkeypatch.setenv("SPOTIFY_RATE_LIMIT_BURST", "10")
+        rateLimiter.reset_limiter()
+        statsCache.set_cache(statsCache.MemoryCacheBackend())
+        client = index.app.test_client()
+        client.get("/json?fields=last_albums")
+        text = client.get("/metrics").get_data(as_text=True)
+        statsCache.set_cache(None)
+
+        assert "spotify_stats_rate_limit_tokens 9." in text
+        assert "spotify_stats_rate_limit_blocked_seconds 29." in text
+        assert 'spotify_stats_rate_limited_total{priority="interactive",reason="429"} 1' in text
+        assert 'spotify_stats_rate_limit_waiting_requests{priority="background"} 0' in text
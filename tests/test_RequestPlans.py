@@ -0,0 +1,46 @@
+# Test suite for requestPlans.py
+
+import asyncio
+import pytest
+import requestPlans
+
+
+def plan_sum(count):
+    """Plan asking for count numbers, one at a time, and returning their sum"""
+    total = 0
+    for i in range(count):
+        total += yield i
+    return total
+
+
+def plan_with_fallback():
+    """Plan answering the fallback value when its request fails"""
+    try:
+        return (yield "request")
+    except ValueError:
+        return "fallback"
+
+
+class TestRequestPlans:
+    """Tests for the sync and async runs of the plans"""
+
+    def test_sync_and_async_runs_agree(self):
+        async def perform(request):
+            return request * 10
+
+        assert requestPlans.run(plan_sum(3), lambda request: request * 10) == 30
+        assert asyncio.run(requestPlans.run_async(plan_sum(3), perform)) == 30
+        assert asyncio.run(requestPlans.run_async(plan_sum(3), perform, in_thread=True)) == 30
+
+    def test_errors_are_thrown_into_the_plan(self):
+        def fail(request):
+            raise ValueError(request)
+
+        assert requestPlans.run(plan_with_fallback(), fail) == "fallback"
+
+    def test_unhandled_errors_are_raised(self):
+        async def fail(request):
+            raise KeyError(request)
+
+        with pytest.raises(KeyError):
+            asyncio.run(requestPlans.run_async(plan_with_fallback(), fail, in_thread=True))
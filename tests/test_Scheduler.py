@@ -0,0 +1,102 @@
+# Test suite for statsScheduler.py and the /cron/refresh endpoint
+
+import pytest
+import statsCache
+import statsCollector
+import statsImageGenerator
+import statsScheduler
+
+
+STATS = {
+    "top_artists": {
+        "short_term": {0: {"name": "A", "image": "http://test.com/a.jpg", "genre": "pop"}},
+        "long_term": {0: {"name": "B", "image": "http://test.com/b.jpg", "genre": "rock"}},
+    },
+    "top_songs": {
+        "short_term": {0: {"name": "S", "artist": "A", "image": "http://test.com/s.jpg"}},
+        "long_term": {},
+    },
+    "last_albums": {0: {"name": "Al", "artist": "A", "image": "http://test.com/al.jpg"}},
+}
+
+
+@pytest.fixture
+def cache(mocker):
+    """Fixture mocking Spotify and the CDN with a fresh cache"""
+    cache = statsCache.MemoryCacheBackend()
+    statsCache.set_cache(cache)
+    mocker.patch("statsCollector.refresh_slices", return_value=STATS)
+    mocker.patch(
+        "statsImageGenerator.fetch_image_as_base64",
+        return_value="data:image/jpeg;base64,AAAA",
+    )
+    yield cache
+    statsCache.set_cache(None)
+
+
+class TestRefreshAll:
+    """Tests for the pre-warming of the caches"""
+
+    def test_every_variant_is_prerendered(self, cache, mocker):
+        """Test that requests after a refresh don't render anything"""
+        summary = statsScheduler.refresh_all(cache)
+        render = mocker.spy(statsImageGenerator, "create_spotify_infographic")
+
+        for section_type, time_range in statsImageGenerator.STATS_VARIANTS:
+            statsImageGenerator.get_cached_infographic(
+                STATS, section_type, time_range, cache=cache
+            )
+
+        assert len(summary["rendered"]) == len(statsImageGenerator.STATS_VARIANTS)
+        render.assert_not_called()
+
+    def test_images_are_prefetched(self, cache):
+        statsScheduler.refresh_all(cache)
+
+        fetched = {
+            call.args[0] for call in statsImageGenerator.fetch_image_as_base64.call_args_list
+        }
+        assert "http://test.com/al.jpg" in fetched
+        assert "http://test.com/b.jpg" in fetched
+
+
+class TestCronEndpoint:
+    """Tests for the /cron/refresh endpoint"""
+
+    @pytest.fixture
+    def client(self, cache):
+        from api import index
+
+        return index.app.test_client()
+
+    def test_requires_cron_secret(self, client, monkeypatch):
+        monkeypatch.setenv("CRON_SECRET", "secret")
+
+        assert client.get("/cron/refresh").status_code == 401
+        assert client.get(
+            "/cron/refresh", headers={"Authorization": "Bearer secret2"}
+        ).status_code == 401
+        response = client.get(
+            "/cron/refresh", headers={"Authorization": "Bearer secret"}
+        )
+        assert response.status_code == 200
+        assert response.get_json()["errors"] == {}
+
+    def test_rejected_without_cron_secret(self, client, monkeypatch):
+        monkeypatch.delenv("CRON_SECRET", raising=False)
+
+        assert client.get("/cron/refresh").status_code == 401
+        statsCollector.refresh_slices.assert_not_called()
+
+    def test_failed_refresh_is_reported(self, client, monkeypatch, mocker):
+        """Test that a refresh without any cached data answers its summary instead of a 500"""
+        monkeypatch.setenv("CRON_SECRET", "secret")
+        error = statsCollector.CollectionError({"last_albums": RuntimeError("Spotify is down")}, {})
+        statsCollector.refresh_slices.side_effect = error
+        mocker.patch("statsCollector.collect", side_effect=error)
+
+        response = client.get("/cron/refresh", headers={"Authorization": "Bearer secret"})
+
+        assert response.status_code == 200
+        assert response.get_json()["rendered"] == []
+        assert "last_albums" in response.get_json()["errors"]
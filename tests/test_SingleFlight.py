@@ -0,0 +1,182 @@
+# Test suite for singleFlight.py and the coalescing of concurrent stats collections and image downloads
+
+import threading
+import time
+import pytest
+import imageCache
+import metrics
+import singleFlight
+import statsCache
+import statsCollector
+import statsImageGenerator
+
+
+def run_concurrently(fn, count: int) -> list:
+    """Run fn in count threads started at the same time, returns their results or exceptions"""
+    barrier = threading.Barrier(count, timeout=5)
+    results = [None] * count
+
+    def run(i):
+        barrier.wait()
+        try:
+            results[i] = fn()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+@pytest.fixture(autouse=True)
+def registry():
+    metrics.reset_registry()
+    yield metrics.get_registry()
+    metrics.reset_registry()
+
+
+class TestGroup:
+    """Tests for the coalescing of the computations in flight"""
+
+    def test_concurrent_calls_share_one_computation(self, registry):
+        group = singleFlight.Group("test")
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return "result"
+
+        results = run_concurrently(lambda: group.do("key", compute), 5)
+
+        assert results == ["result"] * 5
+        assert len(calls) == 1
+        assert group.in_flight() == 0
+        assert registry.get_counter("single_flight_total", {"group": "test", "role": "follower"}) == 4
+
+    def test_errors_are_shared(self):
+        group = singleFlight.Group("test")
+
+        def compute():
+            time.sleep(0.1)
+            raise RuntimeError("down")
+
+        results = run_concurrently(lambda: group.do("key", compute), 3)
+
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+    def test_done_keys_are_computed_again(self):
+        group = singleFlight.Group("test")
+
+        assert group.do("key", lambda: 1) == 1
+        assert group.do("key", lambda: 2) == 2
+
+
+class TestCoalescedCollection:
+    """Tests for the coalescing of the collection of the same slices"""
+
+    @pytest.fixture
+    def collect(self, mocker):
+        mocker.patch("statsCollector.get_tenant_client")
+
+        def collect(sp, slices, history_store=None):
+            time.sleep(0.1)
+            return {"last_albums": {0: {"name": "Album", "artist": "Artist", "image": None}}}
+
+        return mocker.patch("statsCollector.collect_slices_concurrently", side_effect=collect)
+
+    def test_concurrent_cold_requests_collect_once(self, collect):
+        cache = statsCache.MemoryCacheBackend()
+
+        results = run_concurrently(lambda: statsCollector.collect(["last_albums"], cache=cache), 5)
+
+        assert collect.call_count == 1
+        assert all(result["last_albums"][0]["name"] == "Album" for result in results)
+
+    def test_failures_are_shared(self, collect):
+        def fail(sp, slices, history_store=None):
+            time.sleep(0.1)
+            raise statsCollector.CollectionError({"last_albums": RuntimeError("down")}, {})
+
+        collect.side_effect = fail
+        cache = statsCache.MemoryCacheBackend()
+
+        results = run_concurrently(lambda: statsCollector.collect(["last_albums"], cache=cache), 3)
+
+        assert collect.call_count == 1
+        assert all(isinstance(result, statsCollector.CollectionError) for result in results)
+
+    def test_tenants_are_not_coalesced(self, collect, monkeypatch):
+        monkeypatch.setattr("statsCollector.tenants.get_refresh_token", lambda user: user)
+        cache = statsCache.MemoryCacheBackend()
+
+        run_concurrently(
+            lambda: statsCollector.collect(
+                ["last_albums"], cache=cache, user=threading.current_thread().name
+            ),
+            2,
+        )
+
+        assert collect.call_count == 2
+
+
+class TestPageView:
+    """Tests for a README loading every /stats image at once with a cold cache"""
+
+    def test_upstream_calls_of_concurrent_page_views(self, mocker, monkeypatch):
+        from api import index
+
+        monkeypatch.setenv("IMAGE_SCALE", "0")
+        statsCache.set_cache(statsCache.MemoryCacheBackend())
+        imageCache.set_image_cache(imageCache.ImageCache())
+        artist = {"name": "Artist", "images": [{"url": "http://test.com/a.jpg"}], "genres": ["pop"]}
+        album = {"name": "Album", "artists": [{"name": "Artist"}], "images": [{"url": "http://test.com/c.jpg"}]}
+        track = {"name": "Song", "artists": [{"name": "Artist"}], "album": album}
+
+        def respond(items):
+            def call(**kwargs):
+                time.sleep(0.05)
+                return {"items": items}
+
+            return mocker.Mock(side_effect=call)
+
+        sp = mocker.Mock()
+        sp.current_user_top_artists = respond([artist] * 5)
+        sp.current_user_top_tracks = respond([track] * 5)
+        sp.current_user_saved_albums = respond([{"album": album}] * 3)
+        mocker.patch("statsCollector.get_tenant_client", return_value=sp)
+        download = mocker.patch(
+            "statsImageGenerator._download_image_as_base64",
+            side_effect=lambda url: time.sleep(0.05) or "data:image/jpeg;base64,AAAA",
+        )
+        pageUrls = [
+            f"/stats?type={section_type}&range={time_range}"
+            for section_type, time_range in statsImageGenerator.STATS_VARIANTS
+        ]
+
+        # Two visitors load the five images of the README at the same time
+        urls = pageUrls * 2
+
+        def view():
+            response = index.app.test_client().get(urls.pop())
+            response.get_data()  # Streamed renders download their images while being read
+            return response.status_code
+
+        statuses = run_concurrently(view, len(urls))
+        statsCache.set_cache(None)
+        imageCache.set_image_cache(None)
+
+        assert statuses == [200] * 10
+        spotifyCalls = sum(
+            method.call_count
+            for method in (
+                sp.current_user_top_artists,
+                sp.current_user_top_tracks,
+                sp.current_user_saved_albums,
+            )
+        )
+        assert spotifyCalls == 5
+        assert download.call_count == 2
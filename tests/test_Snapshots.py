@@ -0,0 +1,229 @@
+# Test suite for snapshotStore.py and the serving of the last known good stats
+
+import time
+import pytest
+import imageCache
+import snapshotStore
+import statsCache
+import statsCollector
+import statsImageGenerator
+import statsModel
+
+ARTISTS = (statsModel.Artist("Artist", "http://test.com/a.jpg", "pop"),)
+ALBUMS = (statsModel.Album("Album", "Artist", "http://test.com/c.jpg"),)
+OTHER_ARTISTS = (statsModel.Artist("Other", None, "rock"),)
+ALBUM = {"name": "Album", "artists": [{"name": "Artist"}], "images": [{"url": "http://test.com/c.jpg"}]}
+
+
+def albums(name: str) -> tuple:
+    return (statsModel.Album(name, "Artist", None),)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = snapshotStore.SnapshotStore(str(tmp_path / "snapshots.db"))
+    snapshotStore.set_store(store)
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def sp(mocker):
+    """Fixture for the Spotify client of the default account, answering one saved album"""
+    sp = mocker.Mock()
+    sp.current_user_saved_albums.return_value = {"items": [{"album": ALBUM}]}
+    mocker.patch("statsCollector.get_tenant_client", return_value=sp)
+    return sp
+
+
+class TestSnapshotStore:
+    """Tests for the storage and the retention of the snapshots"""
+
+    def test_newest_version_is_loaded(self, store):
+        store.save_slices(None, [("top_artists", "short_term", ARTISTS)], fetched_at=100)
+        store.save_slices(None, [("top_artists", "short_term", OTHER_ARTISTS)], fetched_at=200)
+
+        assert store.load_slice(None, "top_artists", "short_term") == (OTHER_ARTISTS, 200)
+        assert store.load_slice(None, "top_artists", "long_term") is None
+
+    def test_unchanged_slice_is_not_a_new_version(self, store):
+        store.save_slices(None, [("last_albums", None, ALBUMS)], fetched_at=100)
+        store.save_slices(None, [("last_albums", None, ALBUMS)], fetched_at=200)
+
+        versions = store.list_versions(None, "last_albums")
+        assert [fetchedAt for fetchedAt, _ in versions] == [200]
+
+    def test_tenants_are_separated(self, store):
+        store.save_slices("alice", [("last_albums", None, ALBUMS)])
+
+        assert store.load_slice("alice", "last_albums") is not None
+        assert store.load_slice(None, "last_albums") is None
+        assert store.load_slice("bob", "last_albums") is None
+
+    def test_retention_keeps_newest_versions(self, store):
+        now = time.time()
+        for i in range(5):
+            store.save_slices(None, [("last_albums", None, albums(f"Album {i}"))], now - 10 + i)
+
+        store.compact(keep_versions=2)
+
+        assert len(store.list_versions(None, "last_albums")) == 2
+        assert store.load_slice(None, "last_albums")[0] == albums("Album 4")
+
+    def test_retention_never_drops_last_known_good(self, store):
+        store.save_slices(None, [("last_albums", None, albums("Old"))], fetched_at=100)
+        store.save_slices(None, [("last_albums", None, ALBUMS)], fetched_at=200)
+        store.set_image("old", "data:image/jpeg;base64,AAAA")
+
+        deleted = store.compact(max_age=60)
+
+        assert deleted == {"stats_snapshots": 1, "images": 0, "renders": 0}
+        assert store.load_slice(None, "last_albums") == (ALBUMS, 200)
+
+    def test_old_images_and_renders_are_dropped(self, store, monkeypatch):
+        store.set_image("image", "data:image/jpeg;base64,AAAA")
+        store.set_render("render", "<svg/>")
+        monkeypatch.setattr("snapshotStore.time.time", lambda: 10**12)
+
+        store.compact()
+
+        assert store.get_image("image") is None
+        assert store.get_render("render") is None
+
+    def test_images_and_renders_are_capped_in_bytes(self, store, monkeypatch):
+        """Test that the oldest images and renders are dropped first once they take too much space"""
+        now = time.time()
+        for i, key in enumerate(["oldest", "older", "newest"]):
+            monkeypatch.setattr("snapshotStore.time.time", lambda: now + i)
+            store.set_image(key, "data:image/jpeg;base64," + "A" * 1000)
+        store.set_render("render", "<svg/>")
+
+        deleted = store.compact(max_bytes=2100)
+
+        assert deleted["images"] == 1
+        assert store.get_image("oldest") is None
+        assert store.get_image("older") is not None
+        assert store.get_render("render") == "<svg/>"
+
+    def test_image_and_render_writes_compact(self, tmp_path, mocker):
+        store = snapshotStore.SnapshotStore(str(tmp_path / "snapshots.db"), compact_interval=0)
+        compact = mocker.spy(store, "compact")
+
+        store.set_image("image", "data:image/jpeg;base64,AAAA")
+        store.set_render("render", "<svg/>")
+
+        assert compact.call_count == 2
+        store.close()
+
+    def test_errors_are_misses(self, store):
+        store.close()
+
+        assert store.load_slice(None, "last_albums") is None
+        store.save_slices(None, [("last_albums", None, ALBUMS)])
+
+    def test_disabled_with_empty_path(self, monkeypatch):
+        monkeypatch.setenv("SNAPSHOT_DB_PATH", "")
+        snapshotStore.set_store(None)
+
+        assert snapshotStore.get_store() is None
+
+
+class TestLastKnownGood:
+    """Tests for the stats served from the snapshots by a new instance"""
+
+    def test_collected_slices_are_saved(self, store, sp):
+        statsCollector.collect(["last_albums"], cache=statsCache.MemoryCacheBackend())
+
+        records, _ = store.load_slice(None, "last_albums")
+        assert records[0].name == "Album"
+
+    def test_cold_start_serves_snapshot_and_refreshes(self, store, sp, mocker):
+        store.save_slices(None, [("last_albums", None, albums("Saved"))], time.time() - 3600)
+        refresh = mocker.patch("statsCollector.refresh_slices_in_background")
+
+        stats = statsCollector.collect(["last_albums"], cache=statsCache.MemoryCacheBackend())
+
+        assert stats["last_albums"][0]["name"] == "Saved"
+        sp.current_user_saved_albums.assert_not_called()
+        refresh.assert_called_once()
+
+    def test_fresh_snapshot_is_not_refreshed(self, store, sp, mocker):
+        store.save_slices(None, [("last_albums", None, albums("Saved"))])
+        refresh = mocker.patch("statsCollector.refresh_slices_in_background")
+        cache = statsCache.MemoryCacheBackend()
+
+        statsCollector.collect(["last_albums"], cache=cache)
+        statsCollector.collect(["last_albums"], cache=cache)
+
+        refresh.assert_not_called()
+        sp.current_user_saved_albums.assert_not_called()
+
+    def test_spotify_errors_serve_snapshot(self, store, sp, monkeypatch):
+        monkeypatch.setenv("STATS_SERVE_STALE", "0")
+        store.save_slices(None, [("last_albums", None, albums("Saved"))], time.time() - 3600)
+        sp.current_user_saved_albums.side_effect = RuntimeError("Spotify is down")
+
+        stats = statsCollector.collect(["last_albums"], cache=statsCache.MemoryCacheBackend())
+
+        assert stats["last_albums"][0]["name"] == "Saved"
+
+    def test_cold_start_serves_render_without_downloads(self, store, sp, mocker):
+        from api import index
+
+        statsCache.set_cache(statsCache.MemoryCacheBackend())
+        imageCache.set_image_cache(imageCache.ImageCache())
+        download = mocker.patch(
+            "statsImageGenerator._download_image_as_base64",
+            return_value="data:image/jpeg;base64,AAAA",
+        )
+        stats = statsCollector.collect(["last_albums"], compact=True)
+        svgImage = statsImageGenerator.get_cached_infographic(stats, "last_albums")
+
+        # A new instance starts with empty caches
+        statsCache.set_cache(statsCache.MemoryCacheBackend())
+        imageCache.set_image_cache(imageCache.ImageCache())
+        sp.current_user_saved_albums.side_effect = RuntimeError("Spotify is down")
+        response = index.app.test_client().get("/stats?type=last_albums")
+        statsCache.set_cache(None)
+        imageCache.set_image_cache(None)
+
+        assert response.status_code == 200
+        assert response.get_data(as_text=True) == svgImage
+        assert download.call_count == 1
+
+
+class TestImageSnapshots:
+    """Tests for the images kept in the snapshot store"""
+
+    def test_images_survive_a_new_cache(self, store):
+        imageCache.ImageCache(snapshots=store).set("http://test.com/a.jpg", "data:image/jpeg;base64,AAAA")
+
+        cache = imageCache.ImageCache(snapshots=store)
+
+        assert cache.get("http://test.com/a.jpg") == "data:image/jpeg;base64,AAAA"
+        assert cache.get_stats()["snapshot_hits"] == 1
+        assert cache.get("http://test.com/a.jpg") == "data:image/jpeg;base64,AAAA"
+        assert cache.get_stats()["memory_hits"] == 1
+
+    def test_originals_of_resized_images_are_not_kept(self, store, mocker, monkeypatch):
+        """Test that only the resized image, which is rendered, takes space in the store"""
+        pytest.importorskip("PIL")
+        monkeypatch.setattr(
+            "statsImageGenerator._download_image_as_base64",
+            lambda url: "data:image/jpeg;base64,AAAA",
+        )
+        mocker.patch("statsImageGenerator._resize_data_uri", return_value="data:image/jpeg;base64,BBBB")
+        imageCache.set_image_cache(imageCache.ImageCache(snapshots=store))
+
+        statsImageGenerator.fetch_image_as_base64("http://test.com/a.jpg", 228)
+        imageCache.set_image_cache(None)
+
+        resizedKey = statsImageGenerator.get_resized_image_key("http://test.com/a.jpg", 228)
+        assert store.get_image(imageCache.ImageCache.key(resizedKey)) == "data:image/jpeg;base64,BBBB"
+        assert store.get_image(imageCache.ImageCache.key("http://test.com/a.jpg")) is None
+
+    def test_process_cache_uses_the_store(self, store):
+        imageCache.set_image_cache(None)
+
+        assert imageCache.get_image_cache().snapshots is store
+        imageCache.set_image_cache(None)
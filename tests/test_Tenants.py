@@ -0,0 +1,189 @@
+# Test suite for tenants.py and the multi-user support of the collector, scheduler and API
+
+import json
+import pytest
+import statsCache
+import statsCollector
+import statsScheduler
+import tenants
+
+
+STATS = {
+    "top_artists": {"short_term": {}, "long_term": {}},
+    "top_songs": {"short_term": {}, "long_term": {}},
+    "last_albums": {},
+}
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    """Fixture registering two tenants, reloaded for each test"""
+    monkeypatch.setenv("SPOTIFY_TENANTS", json.dumps({"alice": "token-a", "bob": "token-b"}))
+    tenants.reset_tenants()
+    yield
+    tenants.reset_tenants()
+
+
+class TestRegistry:
+    """Tests for the loading of the tenant registry"""
+
+    def test_loaded_from_environment(self):
+        assert tenants.get_refresh_token("alice") == "token-a"
+        assert list(tenants.get_tenants()) == ["alice", "bob"]
+
+    def test_loaded_from_file(self, monkeypatch, tmp_path):
+        path = tmp_path / "tenants.json"
+        path.write_text(json.dumps({"carol": "token-c"}))
+        monkeypatch.delenv("SPOTIFY_TENANTS")
+        monkeypatch.setenv("TENANTS_FILE", str(path))
+        tenants.reset_tenants()
+
+        assert tenants.get_tenants() == {"carol": "token-c"}
+
+    def test_no_registry(self, monkeypatch):
+        monkeypatch.delenv("SPOTIFY_TENANTS")
+        tenants.reset_tenants()
+
+        assert tenants.get_tenants() == {}
+
+    def test_unknown_user(self):
+        with pytest.raises(tenants.UnknownTenantError):
+            tenants.get_refresh_token("mallory")
+
+    def test_invalid_user_key(self, monkeypatch):
+        monkeypatch.setenv("SPOTIFY_TENANTS", json.dumps({"../admin": "token"}))
+
+        with pytest.raises(ValueError):
+            tenants.load_tenants()
+
+
+class TestTenantCache:
+    """Tests for the per-tenant view of a cache backend"""
+
+    def test_tenants_do_not_share_keys(self):
+        backend = statsCache.MemoryCacheBackend()
+        tenants.get_tenant_cache(backend, "alice").set("section:last_albums", "a")
+
+        assert tenants.get_tenant_cache(backend, "bob").get("section:last_albums") is None
+        assert backend.get("section:last_albums") is None
+        assert backend.get("tenant:alice:section:last_albums") == "a"
+
+    def test_view_is_not_nested(self):
+        backend = statsCache.MemoryCacheBackend()
+        alice = tenants.get_tenant_cache(backend, "alice")
+
+        assert tenants.get_tenant_cache(alice, "alice") is alice
+        assert tenants.get_tenant_cache(alice, "bob").backend is backend
+
+    def test_no_user_returns_cache(self):
+        backend = statsCache.MemoryCacheBackend()
+
+        assert tenants.get_tenant_cache(backend) is backend
+
+
+class TestTenantCollection:
+    """Tests for the collection of the stats of a tenant"""
+
+    def test_collects_with_tenant_client(self, mocker):
+        """Test that each tenant is collected with its own refresh token and cache"""
+        setup = mocker.patch("statsCollector.setup_spotify_client")
+        collect = mocker.patch(
+            "statsCollector.collect_slices_concurrently", return_value={"last_albums": {}}
+        )
+        cache = statsCache.MemoryCacheBackend()
+
+        statsCollector.collect(["last_albums"], cache=cache, user="bob")
+        statsCollector.collect(["last_albums"], cache=cache, user="bob")
+
+        setup.assert_called_once_with("token-b")
+        collect.assert_called_once()
+        assert cache.get("tenant:bob:section:last_albums")["rows"] == []
+        assert cache.get("section:last_albums") is None
+
+    def test_clients_are_reused_per_token(self, mocker):
+        """Test that tenants don't build a client, and refresh a token, on every request"""
+        statsCollector.reset_spotify_clients()
+        spotify = mocker.patch("statsCollector.spotipy.Spotify")
+        mocker.patch("statsCollector.SpotifyOAuth")
+
+        alice = statsCollector.get_tenant_client("alice")
+
+        assert statsCollector.get_tenant_client("alice") is alice
+        statsCollector.get_tenant_client("bob")
+        assert spotify.call_count == 2
+        statsCollector.reset_spotify_clients()
+
+
+class TestRefreshTenants:
+    """Tests for the pre-warming of every tenant"""
+
+    def test_every_tenant_is_refreshed(self, mocker):
+        refresh = mocker.patch("statsScheduler.refresh_all", return_value={"rendered": []})
+
+        summaries = statsScheduler.refresh_tenants(max_workers=2)
+
+        assert summaries == {"alice": {"rendered": []}, "bob": {"rendered": []}}
+        assert {call.args[1] for call in refresh.call_args_list} == {"alice", "bob"}
+
+    def test_failing_tenant_does_not_stop_others(self, mocker):
+        def refresh(cache, user):
+            if user == "alice":
+                raise RuntimeError("revoked")
+            return {"rendered": ["x"]}
+
+        mocker.patch("statsScheduler.refresh_all", side_effect=refresh)
+
+        summaries = statsScheduler.refresh_tenants()
+
+        assert "revoked" in summaries["alice"]["errors"]["all"]
+        assert summaries["bob"] == {"rendered": ["x"]}
+
+    def test_default_account_is_refreshed_with_tenants(self, mocker, monkeypatch):
+        """Test that the account of /stats and /json without a user is pre-warmed next to the tenants"""
+        monkeypatch.setenv("SPOTIFY_REFRESH_TOKEN", "token-default")
+        refresh = mocker.patch("statsScheduler.refresh_all", return_value={"rendered": []})
+
+        summaries = statsScheduler.refresh_everything()
+
+        assert summaries == {
+            "tenants": {"alice": {"rendered": []}, "bob": {"rendered": []}},
+            "default": {"rendered": []},
+        }
+        users = [call.args[1] if len(call.args) > 1 else None for call in refresh.call_args_list]
+        assert set(users) == {"alice", "bob", None}
+
+    def test_tenants_only(self, mocker, monkeypatch):
+        monkeypatch.delenv("SPOTIFY_REFRESH_TOKEN", raising=False)
+        mocker.patch("statsScheduler.refresh_all", return_value={"rendered": []})
+
+        assert "default" not in statsScheduler.refresh_everything()
+
+
+class TestTenantEndpoints:
+    """Tests for the /stats/<user> and /json/<user> endpoints"""
+
+    @pytest.fixture
+    def client(self, mocker):
+        from api import index
+
+        statsCache.set_cache(statsCache.MemoryCacheBackend())
+        mocker.patch("statsCollector.collect_slices", return_value=STATS)
+        yield index.app.test_client()
+        statsCache.set_cache(None)
+
+    def test_json_of_tenant(self, client):
+        response = client.get("/json/alice")
+
+        assert response.status_code == 200
+        assert statsCollector.collect_slices.call_args.kwargs["user"] == "alice"
+
+    def test_stats_of_tenant(self, client):
+        response = client.get("/stats/bob?type=last_albums")
+
+        assert response.status_code == 200
+        assert statsCollector.collect_slices.call_args.args[2] == "bob"
+
+    def test_unknown_tenant(self, client):
+        assert client.get("/stats/mallory").status_code == 404
+        assert client.get("/json/mallory").status_code == 404
+        statsCollector.collect_slices.assert_not_called()
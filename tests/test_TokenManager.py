@@ -0,0 +1,197 @@
+# Test suite for tokenManager.py and the Spotify client reuse in statsCollector.py
+
+import threading
+import pytest
+import spotipy
+import rateLimiter
+import statsCache
+import statsCollector
+import tokenManager
+
+
+@pytest.fixture
+def auth_manager(mocker):
+    """Fixture to create a mocked SpotifyOAuth returning one-hour tokens"""
+    manager = mocker.Mock()
+    manager.refresh_access_token.side_effect = lambda refresh_token: {
+        "access_token": f"access_{manager.refresh_access_token.call_count}",
+        "expires_in": 3600,
+    }
+    return manager
+
+
+class TestTokenManager:
+    """Tests for the access token reuse"""
+
+    def test_token_is_reused_until_expiry(self, auth_manager):
+        """Test that the refresh token is only used once while the token is valid"""
+        manager = tokenManager.TokenManager(auth_manager, "refresh")
+
+        assert manager.get_access_token() == "access_1"
+        assert manager.get_access_token() == "access_1"
+        assert auth_manager.refresh_access_token.call_count == 1
+
+    def test_cached_token_is_only_the_valid_one(self, auth_manager):
+        """Test that the cached token is None until a token was fetched"""
+        manager = tokenManager.TokenManager(auth_manager, "refresh")
+
+        assert manager.get_cached_access_token() is None
+        manager.get_access_token()
+        assert manager.get_cached_access_token() == "access_1"
+        manager.invalidate()
+        assert manager.get_cached_access_token() is None
+        assert auth_manager.refresh_access_token.call_count == 1
+
+    def test_token_is_refreshed_before_expiry(self, auth_manager, mocker):
+        """Test that the token is refreshed once it enters the refresh margin"""
+        clock = mocker.patch("tokenManager.time.time", return_value=1000.0)
+        manager = tokenManager.TokenManager(auth_manager, "refresh", refresh_margin=60)
+        manager.get_access_token()
+
+        clock.return_value = 1000.0 + 3600 - 30
+
+        assert manager.get_access_token() == "access_2"
+
+    def test_concurrent_callers_refresh_once(self, auth_manager):
+        """Test that simultaneous requests share a single refresh"""
+        manager = tokenManager.TokenManager(auth_manager, "refresh")
+        threads = [
+            threading.Thread(target=manager.get_access_token) for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert auth_manager.refresh_access_token.call_count == 1
+
+    def test_token_is_shared_through_store(self, auth_manager):
+        """Test that a second worker reuses the token persisted by the first"""
+        store = statsCache.MemoryCacheBackend()
+        tokenManager.TokenManager(auth_manager, "refresh", store=store).get_access_token()
+
+        other_worker = tokenManager.TokenManager(auth_manager, "refresh", store=store)
+
+        assert other_worker.get_access_token() == "access_1"
+        assert auth_manager.refresh_access_token.call_count == 1
+
+    def test_as_dict_returns_token_info(self, auth_manager):
+        manager = tokenManager.TokenManager(auth_manager, "refresh")
+
+        token_info = manager.get_access_token(as_dict=True)
+
+        assert token_info["access_token"] == "access_1"
+        assert "expires_at" in token_info
+
+
+class TestRejectedToken:
+    """Tests for the recovery from access tokens rejected by Spotify"""
+
+    def test_invalidated_token_is_refreshed(self, auth_manager):
+        store = statsCache.MemoryCacheBackend()
+        manager = tokenManager.TokenManager(auth_manager, "refresh", store=store)
+        manager.get_access_token()
+
+        manager.invalidate("access_1")
+
+        assert store.get(manager.store_key) is None
+        assert manager.get_access_token() == "access_2"
+
+    def test_token_refreshed_by_another_worker_is_kept(self, auth_manager):
+        """Test that a worker invalidating an old token doesn't drop the one already replacing it"""
+        store = statsCache.MemoryCacheBackend()
+        manager = tokenManager.TokenManager(auth_manager, "refresh", store=store)
+        manager.get_access_token()
+
+        manager.invalidate("access_0")
+
+        assert manager.get_access_token() == "access_1"
+        assert store.get(manager.store_key)["access_token"] == "access_1"
+
+    def test_rotated_refresh_token_is_used(self, auth_manager):
+        auth_manager.refresh_access_token.side_effect = lambda refresh_token: {
+            "access_token": f"access_for_{refresh_token}",
+            "refresh_token": "rotated",
+            "expires_in": 3600,
+        }
+        store = statsCache.MemoryCacheBackend()
+        manager = tokenManager.TokenManager(auth_manager, "refresh", store=store)
+        storeKey = manager.store_key
+        manager.get_access_token()
+
+        manager.invalidate()
+
+        assert manager.get_access_token() == "access_for_rotated"
+        assert manager.store_key == storeKey
+
+    def test_request_is_retried_with_new_token(self, auth_manager, mocker):
+        manager = tokenManager.TokenManager(auth_manager, "refresh")
+        manager.get_access_token()
+        sp = mocker.Mock(auth_manager=manager)
+        sp.current_user_saved_albums.side_effect = [
+            spotipy.SpotifyException(401, -1, "The access token expired"),
+            {"items": []},
+        ]
+
+        result = rateLimiter.limit(sp).current_user_saved_albums(limit=3)
+
+        assert result == {"items": []}
+        assert manager.get_access_token() == "access_2"
+
+    def test_token_is_only_refreshed_once(self, auth_manager, mocker):
+        sp = mocker.Mock(auth_manager=tokenManager.TokenManager(auth_manager, "refresh"))
+        sp.current_user_saved_albums.side_effect = spotipy.SpotifyException(401, -1, "Invalid token")
+
+        with pytest.raises(spotipy.SpotifyException):
+            rateLimiter.limit(sp).current_user_saved_albums(limit=3)
+        assert sp.current_user_saved_albums.call_count == 2
+
+    def test_concurrent_rejections_refresh_once(self, auth_manager, mocker):
+        """Test that requests rejected together only drop the rejected token and refresh it once"""
+        store = statsCache.MemoryCacheBackend()
+        manager = tokenManager.TokenManager(auth_manager, "refresh", store=store)
+        manager.get_access_token()
+        barrier = threading.Barrier(5)
+
+        def get_albums(limit):
+            if manager.get_access_token() == "access_1":
+                barrier.wait(timeout=5)
+                raise spotipy.SpotifyException(401, -1, "The access token expired")
+            return {"items": []}
+
+        sp = mocker.Mock(auth_manager=manager)
+        sp.current_user_saved_albums.side_effect = get_albums
+        client = rateLimiter.RateLimitedSpotify(sp, rateLimiter.RateLimiter(100, 100))
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(client.current_user_saved_albums(limit=3)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results == [{"items": []}] * 5
+        assert auth_manager.refresh_access_token.call_count == 2
+        assert store.get(manager.store_key)["access_token"] == "access_2"
+
+
+def test_setup_spotify_client_reuses_client(mocker, monkeypatch):
+    """Test that the Spotify client is built once per set of credentials"""
+    monkeypatch.setenv("SPOTIPY_CLIENT_ID", "reuse_client_id")
+    monkeypatch.setenv("SPOTIFY_REFRESH_TOKEN", "reuse_refresh_token")
+    statsCollector.reset_spotify_clients()
+    mock_oauth = mocker.patch("statsCollector.SpotifyOAuth")
+    mock_spotify = mocker.patch("statsCollector.spotipy.Spotify")
+
+    first = statsCollector.setup_spotify_client()
+    second = statsCollector.setup_spotify_client()
+
+    assert first is second
+    assert mock_oauth.call_count == 1
+    assert mock_spotify.call_count == 1
+    assert isinstance(
+        mock_spotify.call_args[1]["auth_manager"], tokenManager.TokenManager
+    )
+    mock_oauth.return_value.refresh_access_token.assert_not_called()
@@ -0,0 +1,104 @@
+## Access token reuse for the Spotify client
+## The refresh token is only exchanged for a new access token shortly before the current one expires
+import time, hashlib, threading
+import metrics
+
+
+class TokenManager:
+    # Drop-in auth_manager for spotipy.Spotify backed by a long lived refresh token
+    # Tokens are kept in memory and optionally persisted to a shared store (see statsCache)
+    # so other workers and cold starts can reuse them instead of refreshing again
+
+    def __init__(self, auth_manager, refresh_token: str, store=None, refresh_margin: int = 60):
+        self.auth_manager = auth_manager
+        self.refresh_token = refresh_token
+        # Keyed by the configured refresh token, so workers keep sharing tokens if Spotify rotates it
+        self.store_key = self.get_store_key(refresh_token)
+        self.store = store
+        self.refresh_margin = refresh_margin
+        self.refresh_count = 0
+        self._token_info = None
+        self._lock = threading.Lock()
+
+    # Key under which the token is shared, the refresh token itself is never stored
+    @staticmethod
+    def get_store_key(refresh_token: str) -> str:
+        digest = hashlib.sha256(str(refresh_token).encode("utf-8")).hexdigest()
+        return f"token:{digest[:16]}"
+
+    def _is_valid(self, token_info) -> bool:
+        if not token_info:
+            return False
+        return token_info["expires_at"] - self.refresh_margin > time.time()
+
+    def _load_from_store(self):
+        if self.store is None:
+            return None
+        return self.store.get(self.store_key)
+
+    def _refresh(self) -> dict:
+        with metrics.timer("token_refresh"):
+            token_info = self.auth_manager.refresh_access_token(self.refresh_token)
+        self.refresh_count += 1
+        # Spotify may answer with a new refresh token, the previous one can stop working
+        if token_info.get("refresh_token") and token_info["refresh_token"] != self.refresh_token:
+            self.refresh_token = token_info["refresh_token"]
+        token_info = {
+            "access_token": token_info["access_token"],
+            "expires_at": token_info.get("expires_at")
+            or int(time.time()) + token_info.get("expires_in", 3600),
+        }
+        if self.store is not None:
+            ttl = int(token_info["expires_at"] - self.refresh_margin - time.time())
+            if ttl > 0:
+                self.store.set(self.store_key, token_info, ttl)
+        return token_info
+
+    # Same signature as spotipy's auth managers so it can be given to spotipy.Spotify
+    def get_access_token(self, as_dict: bool = False):
+        token_info = self._token_info
+        if not self._is_valid(token_info):
+            # Only one thread refreshes, the others wait and reuse its token
+            with self._lock:
+                token_info = self._token_info
+                if not self._is_valid(token_info):
+                    token_info = self._load_from_store()
+                if not self._is_valid(token_info):
+                    token_info = self._refresh()
+                self._token_info = token_info
+        return token_info if as_dict else token_info["access_token"]
+
+    # Get the access token kept in memory if it is still valid, None when getting one
+    # needs the shared store or a refresh, so async callers only use a thread for those
+    def get_cached_access_token(self):
+        token_info = self._token_info
+        return token_info["access_token"] if self._is_valid(token_info) else None
+
+    # Forget the current token after Spotify rejected it (401), the next call will refresh it
+    # With the rejected access_token, a token another worker already refreshed is kept
+    def invalidate(self, access_token: str = None):
+        with self._lock:
+            if access_token is None or (self._token_info or {}).get("access_token") == access_token:
+                self._token_info = None
+            if self.store is not None:
+                stored = self.store.get(self.store_key)
+                if stored is not None and access_token in (None, stored.get("access_token")):
+                    self.store.delete(self.store_key)
+
+
+# Get the still valid access token a spotipy client has in memory, None if it has to get one
+def get_cached_token(sp):
+    auth_manager = getattr(sp, "auth_manager", None)
+    if not isinstance(auth_manager, TokenManager):
+        return None
+    return auth_manager.get_cached_access_token()
+
+
+# Invalidate the token of a spotipy client after a 401, returns False if its token can't be refreshed
+def invalidate_token(sp, access_token: str = None) -> bool:
+    auth_manager = getattr(sp, "auth_manager", None)
+    if not isinstance(auth_manager, TokenManager):
+        return False
+    print("Spotify rejected the access token, refreshing it")
+    auth_manager.invalidate(access_token)
+    return True